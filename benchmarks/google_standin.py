@@ -0,0 +1,70 @@
+"""Локальная замена Google для входа: свой ключ RSA, файл сертификатов и выпуск ID токенов.
+
+    python -m benchmarks.google_standin keys --dir /tmp/google-standin
+    GOOGLE_CERTS_FILE=/tmp/google-standin/certs.json uvicorn src.main:app
+    python -m benchmarks.google_standin token --dir /tmp/google-standin --sub 42 --email user@example.com
+
+Токен подписан ключом из --dir и проходит GoogleTokenVerifier с GOOGLE_CERTS_FILE=<dir>/certs.json.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import rsa
+from google.auth import crypt, jwt as google_jwt
+
+from src.core.config import GOOGLE_CLIENT_ID
+
+KEY_ID = 'standin'
+
+
+# ключ и certs.json ({kid: PEM}) в directory
+def create_keys(directory: Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    public_key, private_key = rsa.newkeys(2048)
+    (directory / 'key.pem').write_bytes(private_key.save_pkcs1())
+    certs = {KEY_ID: public_key.save_pkcs1().decode()}
+    (directory / 'certs.json').write_text(json.dumps(certs), encoding='utf-8')
+
+
+class TokenIssuer:
+    """Выпуск ID токенов в формате Google, подписанных локальным ключом."""
+
+    def __init__(self, directory: Path, audience: str | None = GOOGLE_CLIENT_ID):
+        self.signer = crypt.RSASigner.from_string((directory / 'key.pem').read_bytes(), key_id=KEY_ID)
+        self.audience = audience
+
+    def issue(self, sub: str, email: str, given_name: str = 'Test', family_name: str = 'User',
+              picture: str = '', lifetime: int = 3600) -> str:
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': self.audience,
+            'sub': sub,
+            'email': email,
+            'given_name': given_name,
+            'family_name': family_name,
+            'picture': picture,
+            'iat': now,
+            'exp': now + lifetime,
+        }
+        return google_jwt.encode(self.signer, payload).decode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена Google для входа")
+    parser.add_argument('command', choices=['keys', 'token'])
+    parser.add_argument('--dir', type=Path, required=True, help="каталог с key.pem и certs.json")
+    parser.add_argument('--sub', default='standin-user')
+    parser.add_argument('--email', default='standin@example.com')
+    args = parser.parse_args()
+    if args.command == 'keys':
+        create_keys(args.dir)
+        print(f"GOOGLE_CERTS_FILE={args.dir / 'certs.json'}")
+        return
+    print(TokenIssuer(args.dir).issue(args.sub, args.email))
+
+
+if __name__ == '__main__':
+    main()
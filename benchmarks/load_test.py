@@ -0,0 +1,256 @@
+"""Нагрузочный тест API с имитацией AI воркера.
+
+N пользователей параллельно: вход через /create/users (токен локальной замены Google),
+/dialogs/create, затем M раз /send/message/ai (ожидание ответа AI) и /dialogs/{id}.
+Фальшивые AI воркеры захватывают диалоги через /messages/claim (long-polling) и отвечают через /send/message/user
+после think-time. Итог: p50/p95/p99 по шагам, пропускная способность и запросы к БД на
+HTTP-запрос (по /metrics: вызовы методов репозитория / обработанные запросы).
+
+Свой сервер (uvicorn в подпроцессе, бэкенд из DATABASE_BACKEND, сертификаты замены Google;
+DATABASE_BACKEND=memory — только с --workers 1, у каждого воркера были бы свои данные):
+
+    python -m benchmarks.load_test --serve --workers 2 --users 50 --messages 5 --think-ms 200
+
+Пользователи прогона остаются в БД с google_id 'load-<run_id>-N' (run_id печатается в конце).
+
+Уже запущенный сервер — он должен принимать токены замены
+(GOOGLE_CERTS_FILE=<dir>/certs.json, см. benchmarks.google_standin):
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --standin-dir <dir>
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import aiohttp
+
+from benchmarks.google_standin import TokenIssuer, create_keys
+from src.core.config import API_KEY_AI, HEALTH_SECRET_KEY
+
+METRIC_LINE = re.compile(r'^(\w+)\{(.*)\} ([0-9.e+-]+)$')
+
+
+class Stats:
+    """Задержки (мс) и ошибки по шагам сценария."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, step: str, started: float, ok: bool) -> None:
+        if ok:
+            self.latencies.setdefault(step, []).append((time.perf_counter() - started) * 1000)
+        else:
+            self.errors[step] = self.errors.get(step, 0) + 1
+
+    def total(self) -> int:
+        return sum(len(values) for values in self.latencies.values()) + sum(self.errors.values())
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def request(session: aiohttp.ClientSession, stats: Stats, step: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.json(content_type=None)
+            stats.add(step, started, response.status == 200)
+            return body if response.status == 200 else None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        stats.add(step, started, False)
+        return None
+
+
+# пользователь: вход, диалог, messages раз сообщение AI + чтение диалога
+async def simulate_user(base_url: str, issuer: TokenIssuer, run_id: str, number: int, messages: int,
+                        stats: Stats, timeout: float) -> None:
+    jar = aiohttp.CookieJar(unsafe=True)
+    async with aiohttp.ClientSession(base_url, cookie_jar=jar,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        token = issuer.issue(f"load-{run_id}-{number}", f"load-{number}@example.com")
+        if await request(session, stats, 'login', 'POST', '/create/users', json={'token': token}) is None:
+            return
+        created = await request(session, stats, 'create_dialog', 'POST', '/dialogs/create',
+                                json={'dialog_name': f"load {number}"})
+        if created is None:
+            return
+        dialog_id = created['dialog']
+        for index in range(messages):
+            await request(session, stats, 'send_ai', 'POST', '/send/message/ai',
+                          json={'dialog_id': dialog_id, 'text_user': f"message {index}"})
+            await request(session, stats, 'get_dialog', 'GET', f"/dialogs/{dialog_id}")
+
+
+# фальшивый AI воркер: long-polling /messages/claim (захваченный диалог другим воркерам не отдаётся),
+# ответ на каждый захваченный диалог после think-time
+async def fake_ai_worker(base_url: str, number: int, think_ms: float, poll_wait: float, stats: Stats,
+                         stop: asyncio.Event) -> None:
+    headers = {'X-Messages-Key': API_KEY_AI, 'X-Worker-Id': f"load-ai-{number}"}
+    async with aiohttp.ClientSession(base_url, headers=headers,
+                                     timeout=aiohttp.ClientTimeout(total=poll_wait + 30)) as session:
+        while not stop.is_set():
+            body = await request(session, stats, 'ai_claim', 'POST', '/messages/claim',
+                                 params={'wait': poll_wait, 'limit': 50})
+            if body is None:
+                await asyncio.sleep(0.5)
+                continue
+            await asyncio.gather(*(answer(session, dialog, think_ms, stats) for dialog in body['service_message']))
+
+
+async def answer(session: aiohttp.ClientSession, dialog: dict, think_ms: float, stats: Stats) -> None:
+    await asyncio.sleep(random.uniform(0.5, 1.5) * think_ms / 1000)
+    await request(session, stats, 'ai_answer', 'POST', '/send/message/user', json={
+        'user_id': dialog['user_id'],
+        'dialog_id': dialog['dialog_id'],
+        'text_user': f"answer to: {dialog['messages'][-1]['content']}",
+    })
+
+
+# сумма счётчиков метрики по всем меткам, кроме служебных маршрутов
+async def scrape_counts(base_url: str) -> dict[str, float]:
+    counts = {'db': 0.0, 'http': 0.0}
+    async with aiohttp.ClientSession(base_url) as session:
+        async with session.get('/metrics', headers={'X-Health-Key': HEALTH_SECRET_KEY}) as response:
+            if response.status != 200:
+                return {}
+            text = await response.text()
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        if name == 'db_query_duration_seconds_count' and 'count_pending_dialogs' not in labels:
+            counts['db'] += float(value)
+        elif name == 'http_request_duration_seconds_count' and '/metrics' not in labels and '/health' not in labels:
+            counts['http'] += float(value)
+    return counts
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# uvicorn в подпроцессе с сертификатами замены Google и общими метриками воркеров
+async def start_server(workers: int, standin_dir: Path, metrics_dir: str,
+                       quiet: bool) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    output = subprocess.DEVNULL if quiet else None
+    env = dict(os.environ, GOOGLE_CERTS_FILE=str(standin_dir / 'certs.json'), PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.main:app', '--port', str(port), '--workers', str(workers),
+         '--log-level', 'warning'],
+        env=env, stdout=output, stderr=output,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession(base_url) as session:
+        for _ in range(100):
+            try:
+                async with session.get('/health', headers={'X-Health-Key': HEALTH_SECRET_KEY}) as response:
+                    if response.status == 200:
+                        return process, base_url
+            except aiohttp.ClientError:
+                pass
+            if process.poll() is not None:
+                break
+            await asyncio.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Сервер не запустился")
+
+
+def report(stats: Stats, elapsed: float, before: dict, after: dict) -> None:
+    print(f"{'step':<14} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for step in sorted(set(stats.latencies) | set(stats.errors)):
+        values = stats.latencies.get(step, [])
+        if values:
+            row = (f"{percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} "
+                   f"{percentile(values, 0.99):>9.1f} {statistics.mean(values):>9.1f}")
+        else:
+            row = f"{'-':>9} {'-':>9} {'-':>9} {'-':>9}"
+        print(f"{step:<14} {len(values):>7} {stats.errors.get(step, 0):>7} {row}")
+    answered = len(stats.latencies.get('send_ai', []))
+    print(f"\nвремя: {elapsed:.1f} с, запросов: {stats.total()} ({stats.total() / elapsed:.1f}/с), "
+          f"ответов AI: {answered} ({answered / elapsed:.1f}/с)")
+    if before and after and after['http'] > before['http']:
+        queries = after['db'] - before['db']
+        requests = after['http'] - before['http']
+        print(f"запросов к БД: {queries:.0f}, на HTTP-запрос: {queries / requests:.2f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API с имитацией AI воркера")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help="адрес запущенного сервера")
+    target.add_argument('--serve', action='store_true', help="запустить uvicorn в подпроцессе")
+    parser.add_argument('--workers', type=int, default=1, help="воркеров uvicorn для --serve")
+    parser.add_argument('--quiet', action='store_true', help="не выводить лог сервера (--serve)")
+    parser.add_argument('--standin-dir', type=Path, help="ключи замены Google (для --serve создаются сами)")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=5, help="сообщений AI на пользователя")
+    parser.add_argument('--ramp', type=float, default=1.0, help="за сколько секунд запустить всех пользователей")
+    parser.add_argument('--ai-workers', type=int, default=2)
+    parser.add_argument('--think-ms', type=float, default=200, help="среднее время ответа AI (±50%%)")
+    parser.add_argument('--poll-wait', type=float, default=10, help="wait для long-polling /messages/claim")
+    parser.add_argument('--timeout', type=float, default=120, help="таймаут одного запроса пользователя")
+    args = parser.parse_args()
+    if args.serve and args.workers > 1 and os.getenv('DATABASE_BACKEND') == 'memory':
+        parser.error("DATABASE_BACKEND=memory хранит данные в воркере — нужен --workers 1")
+
+    run_id = uuid.uuid4().hex[:8]
+    process = None
+    with tempfile.TemporaryDirectory() as temp:
+        standin_dir = args.standin_dir
+        if standin_dir is None:
+            if not args.serve:
+                parser.error("--url требует --standin-dir с ключами, которые принимает сервер")
+            standin_dir = Path(temp) / 'standin'
+            create_keys(standin_dir)
+        base_url = args.url
+        if args.serve:
+            metrics_dir = Path(temp) / 'metrics'
+            metrics_dir.mkdir()
+            process, base_url = await start_server(args.workers, standin_dir, str(metrics_dir), args.quiet)
+        try:
+            issuer = TokenIssuer(standin_dir)
+            stats = Stats()
+            stop = asyncio.Event()
+            workers = [asyncio.create_task(fake_ai_worker(base_url, number, args.think_ms, args.poll_wait, stats, stop))
+                       for number in range(args.ai_workers)]
+            before = await scrape_counts(base_url)
+            started = time.perf_counter()
+
+            async def delayed_user(number: int) -> None:
+                await asyncio.sleep(args.ramp * number / max(args.users, 1))
+                await simulate_user(base_url, issuer, run_id, number, args.messages, stats, args.timeout)
+
+            await asyncio.gather(*(delayed_user(number) for number in range(args.users)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            after = await scrape_counts(base_url)
+            report(stats, elapsed, before, after)
+            print(f"пользователи прогона: google_id load-{run_id}-*")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""Микробенчмарк репозиториев: Database (SQLAlchemy) против AsyncpgDatabase.
+
+Для каждого метода — задержка одного вызова (mean/p50/p99) и память по tracemalloc:
+пик выделений внутри вызова и прирост удерживаемой памяти на вызов. Строка baseline —
+голый SELECT 1 на соединении asyncpg: в пик любого запроса входит буфер чтения транспорта
+asyncio (256 КиБ), сравнивать стоит разницу с baseline. Логи INFO отключены, f-строки
+сообщений по-прежнему собираются. Создаёт тестового пользователя с диалогом и удаляет их в конце.
+
+    python -m benchmarks.repository_bench --calls 2000
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from src.core.config import DATABASE_HOST, DATABASE_PORT, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD
+from src.repository.asyncpg_repository import AsyncpgDatabase
+from src.repository.repository import Database
+
+BACKENDS = {'sqlalchemy': Database, 'asyncpg': AsyncpgDatabase}
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+# задержка каждого вызова в мс
+async def measure_latency(call, calls: int) -> list[float]:
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+# пиковая память, выделенная во время вызова, и прирост удерживаемой памяти (в среднем на вызов, байт)
+async def measure_allocations(call, calls: int) -> tuple[float, float]:
+    peaks = []
+    tracemalloc.start()
+    try:
+        retained_before = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            await call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = tracemalloc.get_traced_memory()[0] - retained_before
+    finally:
+        tracemalloc.stop()
+    return statistics.mean(peaks), retained / calls
+
+
+async def bench_backend(name: str, calls: int, user_id: int, dialog_id: int, message_id: int) -> list[tuple]:
+    db = BACKENDS[name](host=DATABASE_HOST, port=DATABASE_PORT, dbname=DATABASE_NAME,
+                        user=DATABASE_USER, password=DATABASE_PASSWORD, pool_size=1, max_overflow=0,
+                        pool_prewarm=1)
+    await db.connect()
+    methods = {
+        'get_ai_response_flag': lambda: db.get_ai_response_flag(user_id, dialog_id),
+        'check_dialog_ownership': lambda: db.check_dialog_ownership(user_id, dialog_id),
+        'get_dialog_json(limit=20)': lambda: db.get_dialog_json(user_id, dialog_id, limit=20),
+        'get_dialog_json(since)': lambda: db.get_dialog_json(user_id, dialog_id, since=message_id),
+    }
+    rows = []
+    try:
+        for method, call in methods.items():
+            # прогрев: пул, кеш подготовленных запросов, компиляция SQLAlchemy
+            await measure_latency(call, 50)
+            timings = await measure_latency(call, calls)
+            peak, retained = await measure_allocations(call, max(calls // 10, 10))
+            rows.append((name, method, statistics.mean(timings), percentile(timings, 0.5),
+                         percentile(timings, 0.99), peak, retained))
+    finally:
+        await db.close()
+    return rows
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Сравнение репозиториев SQLAlchemy и asyncpg")
+    parser.add_argument('--calls', type=int, default=2000, help="вызовов на метод")
+    args = parser.parse_args()
+
+    setup = AsyncpgDatabase(host=DATABASE_HOST, port=DATABASE_PORT, dbname=DATABASE_NAME,
+                            user=DATABASE_USER, password=DATABASE_PASSWORD, pool_size=1)
+    await setup.connect()
+    logging.disable(logging.INFO)
+    google_id = f"bench-{uuid.uuid4()}"
+    user_id = await setup.create_user('bench@deepbot', google_id, 'bench', 'bench', '')
+    dialog_id = await setup.create_dialog(user_id, 'bench')
+    message_ids = [await setup.insert_message(user_id, dialog_id, f"message {i}") for i in range(50)]
+    try:
+        async with setup.connection() as connection:
+            call = lambda: connection.fetchval("SELECT 1")
+            await measure_latency(call, 50)
+            timings = await measure_latency(call, args.calls)
+            peak, retained = await measure_allocations(call, max(args.calls // 10, 10))
+        rows = [('baseline', 'SELECT 1', statistics.mean(timings), percentile(timings, 0.5),
+                 percentile(timings, 0.99), peak, retained)]
+        for name in BACKENDS:
+            rows.extend(await bench_backend(name, args.calls, user_id, dialog_id, message_ids[-10]))
+    finally:
+        async with setup.connection() as connection:
+            await connection.execute("DELETE FROM users WHERE user_id = $1", user_id)
+        await setup.close()
+
+    print(f"{'backend':<11} {'method':<26} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak B':>9} {'kept B':>8}")
+    for name, method, mean, p50, p99, peak, retained in rows:
+        print(f"{name:<11} {method:<26} {mean:>8.3f} {p50:>8.3f} {p99:>8.3f} {peak:>9.0f} {retained:>8.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,18 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from src.core.security import get_current_user
+from src.repository.base import Repository
 from src.schemas.schemas import DialogSchema, DialogNameSchema, DialogSchemaRename
 from src.services.service import (
     init_user_dialog_service, delete_user_dialog_service, get_user_dialogs_service,
-    get_context_dialog_service, update_user_name_chat_service, get_ai_response_flag_service,
+    get_context_dialog_service, update_user_name_chat_service, get_ai_response_flag_service, get_repository,
+    export_dialogs_service, search_messages_service,
 )
+from src.utils.utils import raw_json_response
 
 
 router = APIRouter(prefix="/dialogs", tags=["dialogs"])
 
 
 @router.post('/create')
-async def create_dialog(data: DialogNameSchema,  user_id: int = Depends(get_current_user)):
-    result = await init_user_dialog_service(user_id, data.dialog_name)
+async def create_dialog(data: DialogNameSchema,  user_id: int = Depends(get_current_user),
+                        db: Repository = Depends(get_repository)):
+    result = await init_user_dialog_service(db, user_id, data.dialog_name)
     if result.get('success'):
         return {'server': 'ok', 'dialog': result.get('service_message')}
     if result.get('service_message') == 403:
@@ -21,43 +26,82 @@ async def create_dialog(data: DialogNameSchema,  user_id: int = Depends(get_curr
 
 
 @router.post('/delete')
-async def delete_dialog(dialog: DialogSchema, user_id: int = Depends(get_current_user)):
-    result = await delete_user_dialog_service(user_id, dialog.dialog_id)
+async def delete_dialog(dialog: DialogSchema, user_id: int = Depends(get_current_user),
+                        db: Repository = Depends(get_repository)):
+    result = await delete_user_dialog_service(db, user_id, dialog.dialog_id)
     if result.get('success'):
         return {'server': 'ok', 'status': result.get('service_message')}
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка удаления диалога')
 
 
 @router.post('/rename')
-async def delete_dialog(dialog: DialogNameSchema, user_id: int = Depends(get_current_user)):
-    result = await update_user_name_chat_service(user_id, dialog.dialog_id, dialog.dialog_name)
+async def rename_dialog(dialog: DialogSchemaRename, user_id: int = Depends(get_current_user),
+                        db: Repository = Depends(get_repository)):
+    result = await update_user_name_chat_service(db, user_id, dialog.dialog_id, dialog.dialog_name)
     if result.get('success'):
         return {'server': 'ok', 'status': result.get('service_message')}
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка переименования диалога')
 
 
 @router.post('')
-async def get_dialogs(user_id: int = Depends(get_current_user)):
-    result = await get_user_dialogs_service(user_id)
+async def get_dialogs(user_id: int = Depends(get_current_user), db: Repository = Depends(get_repository)):
+    result = await get_user_dialogs_service(db, user_id)
     if result.get('success'):
         return {'server': 'ok', 'dialogs': result.get('service_message')}
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка получения диалогов')
 
 
+# /search и /export — до /{dialog_id}: иначе путь разбирается как dialog_id
+@router.get('/search')
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="слова, \"фраза\", or, -исключить"),
+    dialog_id: int | None = Query(None, description="искать только в этом диалоге"),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    user_id: int = Depends(get_current_user),
+    db: Repository = Depends(get_repository)
+):
+    result = await search_messages_service(db, user_id, q, dialog_id, limit, offset)
+    if result.get('success'):
+        return {'server': 'ok', **result.get('service_message')}
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка поиска по сообщениям')
+
+
+@router.get('/export')
+async def export_dialogs(user_id: int = Depends(get_current_user), db: Repository = Depends(get_repository)):
+    result = await export_dialogs_service(db, user_id)
+    if result.get('success'):
+        return StreamingResponse(
+            result.get('service_message'),
+            media_type='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename="deepbot-dialogs.ndjson"',
+                     'X-Accel-Buffering': 'no'}
+        )
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка выгрузки диалогов')
+
+
 @router.get('/{dialog_id}')
-async def get_dialogs_by_id(dialog_id: int, user_id: int = Depends(get_current_user)):
-    result = await get_context_dialog_service(user_id, dialog_id)
+async def get_dialogs_by_id(
+    dialog_id: int,
+    before: int | None = Query(None, description="последние limit сообщений с message_id < before"),
+    since: int | None = Query(None, description="только сообщения с message_id > since"),
+    limit: int | None = Query(None, ge=1, le=500),
+    user_id: int = Depends(get_current_user),
+    db: Repository = Depends(get_repository)
+):
+    result = await get_context_dialog_service(db, user_id, dialog_id, before, since, limit)
     if result.get('success'):
-        return {'server': 'ok', 'dialogs': result.get('service_message')}
+        return raw_json_response({'server': 'ok'}, 'dialogs', result.get('service_message'))
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка при обновление диалога')
 
 
 @router.get("/flag/{dialog_id}")
 async def get_flag(
     dialog_id: int,
-    user_id: int = Depends(get_current_user)
+    user_id: int = Depends(get_current_user),
+    db: Repository = Depends(get_repository)
 ):
-    result = await get_ai_response_flag_service(user_id, dialog_id)
+    result = await get_ai_response_flag_service(db, user_id, dialog_id)
     if result.get("success"):
         return {"server": "ok", "content": result.get("service_message")}
     raise HTTPException(status_code=result.get('service_message'), detail="Ошибка обновление статуса чата")
@@ -1,15 +1,20 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 from src.core.config import HEALTH_SECRET_KEY
+from src.core.admission import admission
+from src.core.security import token_cache
+from src.repository.base import Repository
+from src.services.service import cache, get_repository
 
 router = APIRouter(tags=["health"])
 
 
 @router.get("/health")
-async def health(request: Request):
+async def health(request: Request, db: Repository = Depends(get_repository)):
     key = request.headers.get("X-Health-Key")
     if key != HEALTH_SECRET_KEY:
         raise HTTPException(status_code=403, detail="Forbidden")
-    return JSONResponse({"status": "ok"})
+    return JSONResponse({"status": "ok", "db_pool": db.pool_stats(), "jwt_cache": token_cache.stats(),
+                         "cache": cache.stats(), "admission": admission.stats()})
 
 
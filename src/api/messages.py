@@ -1,38 +1,102 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import StreamingResponse
 from src.core.security import get_current_user
-from src.services.service import get_message_users_service, send_message_user_service, send_message_ai_service
-from src.schemas.schemas import DialogSchemaAIsend, UserDialogMessage
+from src.repository.base import Repository
+from src.services.service import (
+    get_message_users_service, send_message_user_service, send_message_ai_service,
+    stream_message_ai_service, send_message_chunk_service, claim_messages_service,
+    send_messages_user_batch_service, get_repository,
+)
+from src.schemas.schemas import DialogSchemaAIsend, UserDialogMessage, DialogSchemaAIchunk, DialogSchemaAIbatch
 from src.core.config import API_KEY_AI
+from src.utils.utils import raw_json_response, cancel_on_disconnect
 
 
 router = APIRouter(tags=["messages"])
 
 
 @router.post('/send/message/ai')
-async def send_message(message: UserDialogMessage, user_id: int = Depends(get_current_user)):
-    result = await send_message_ai_service(user_id, message.dialog_id, message.text_user)
+async def send_message(request: Request, message: UserDialogMessage, user_id: int = Depends(get_current_user),
+                       db: Repository = Depends(get_repository)):
+    result = await cancel_on_disconnect(
+        request, send_message_ai_service(db, user_id, message.dialog_id, message.text_user)
+    )
+    # клиент отключился, ожидание отменено (как 499 в nginx)
+    if result is None:
+        raise HTTPException(status_code=499, detail='Клиент закрыл соединение')
     if result.get('success'):
         return {'server': 'ok', 'answer_ai': result.get('service_message')}
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка отправки сообщения')
 
 
+@router.post('/send/message/ai/stream')
+async def send_message_stream(message: UserDialogMessage, user_id: int = Depends(get_current_user),
+                              db: Repository = Depends(get_repository)):
+    result = await stream_message_ai_service(db, user_id, message.dialog_id, message.text_user)
+    if result.get('success'):
+        return StreamingResponse(
+            result.get('service_message'),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка отправки сообщения')
+
+
 @router.get("/messages")
-async def get_messages(request: Request):
+async def get_messages(request: Request, wait: float = Query(0, ge=0), db: Repository = Depends(get_repository)):
     key = request.headers.get("X-Messages-Key")
     if key != API_KEY_AI:
         raise HTTPException(status_code=403, detail="Forbidden")
-    result = await get_message_users_service()
+    result = await get_message_users_service(db, wait)
     if result.get('success'):
-        return result
+        return raw_json_response({'success': True}, 'service_message', result.get('service_message'))
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка при обновление сообщений')
 
 
+@router.post("/messages/claim")
+async def claim_messages(request: Request, limit: int = Query(10, ge=1), wait: float = Query(0, ge=0),
+                         context: bool = Query(True), db: Repository = Depends(get_repository)):
+    key = request.headers.get("X-Messages-Key")
+    if key != API_KEY_AI:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    worker_id = request.headers.get("X-Worker-Id", "ai-worker")
+    result = await claim_messages_service(db, worker_id, limit, wait, context)
+    if result.get('success'):
+        return result
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка при захвате диалогов')
+
+
 @router.post('/send/message/user')
-async def send_message(request: Request, data: DialogSchemaAIsend):
+async def send_message(request: Request, data: DialogSchemaAIsend, db: Repository = Depends(get_repository)):
     key = request.headers.get("X-Messages-Key")
     if key != API_KEY_AI:
         raise HTTPException(status_code=403, detail="Forbidden")
-    result = await send_message_user_service(data.user_id, data.dialog_id, data.text_user)
+    result = await send_message_user_service(db, data.user_id, data.dialog_id, data.text_user)
     if result.get('success'):
         return {'server': 'ok', 'service_message': result.get('service_message')}
     raise HTTPException(status_code=result.get('service_message'), detail='Ошибка отправки сообщения')
+
+
+@router.post('/send/message/user/chunk')
+async def send_message_chunk(request: Request, data: DialogSchemaAIchunk, db: Repository = Depends(get_repository)):
+    key = request.headers.get("X-Messages-Key")
+    if key != API_KEY_AI:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    result = await send_message_chunk_service(db, data.user_id, data.dialog_id, data.text_user, data.done)
+    if result.get('success'):
+        return {'server': 'ok', 'service_message': result.get('service_message')}
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка отправки части сообщения')
+
+
+@router.post('/send/message/user/batch')
+async def send_messages_batch(request: Request, data: DialogSchemaAIbatch, db: Repository = Depends(get_repository)):
+    key = request.headers.get("X-Messages-Key")
+    if key != API_KEY_AI:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    result = await send_messages_user_batch_service(
+        db,
+        [(reply.user_id, reply.dialog_id, reply.text_user) for reply in data.replies]
+    )
+    if result.get('success'):
+        return {'server': 'ok', 'results': result.get('service_message')}
+    raise HTTPException(status_code=result.get('service_message'), detail='Ошибка записи ответов')
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+
+from src.core.config import HEALTH_SECRET_KEY
+from src.core.metrics import render_metrics
+from src.repository.base import Repository
+from src.services.service import refresh_queue_depth_service, get_repository
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def metrics(request: Request, db: Repository = Depends(get_repository)):
+    key = request.headers.get("X-Health-Key")
+    if key != HEALTH_SECRET_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await refresh_queue_depth_service(db)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,155 @@
+import math
+import time
+
+import orjson
+from cachetools import TTLCache
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.core.config import (
+    API_KEY_AI, HEALTH_SECRET_KEY, ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST, ADMISSION_MAX_WAITS,
+    ADMISSION_MAX_USERS,
+)
+from src.core.metrics import admission_rejected, ai_waits_in_flight
+from src.core.security import decode_token
+
+# маршруты, держащие корутину до ответа AI
+WAIT_PATHS = frozenset({'/send/message/ai', '/send/message/ai/stream'})
+# служебные запросы с верным ключом (воркеры AI, мониторинг) не ограничиваются: они разгружают очередь
+SERVICE_KEYS = {
+    b'x-messages-key': API_KEY_AI.encode() if API_KEY_AI else None,
+    b'x-health-key': HEALTH_SECRET_KEY.encode() if HEALTH_SECRET_KEY else None,
+}
+
+
+class TokenBucket:
+    """Корзина токенов: rate запросов в секунду в среднем и до burst подряд."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: int, now: float | None = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    # взять токен: 0 — допущен, иначе через сколько секунд появится следующий
+    def take(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    # вернуть взятый токен: запрос всё же отклонён другой проверкой
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AdmissionControl:
+    """Контроль допуска в воркере: корзина пользователя и общая корзина воркера для пользовательских
+    запросов, для /send/message/ai и /stream — ещё потолок одновременных ожиданий.
+
+    Пользователь берётся из jwt через кеш проверенных токенов; недействительный токен пропускается —
+    его отклонит маршрут (401). Корзины пользователей живут в TTLCache и перекладываются в него при каждом
+    запросе: срок записи отсчитывается от последнего запроса, вытесняется только корзина, простоявшая дольше
+    burst/rate, — она уже полная, её вытеснение ничего не меняет.
+    """
+
+    def __init__(self, user_rate: float, user_burst: int, global_rate: float, global_burst: int,
+                 max_waits: int, max_users: int, timer=time.monotonic):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.timer = timer
+        self.users = TTLCache(max_users, user_burst / user_rate, timer=timer) if user_rate > 0 else None
+        self.bucket = TokenBucket(global_rate, global_burst, timer()) if global_rate > 0 else None
+        self.max_waits = max_waits
+        self.waits = 0
+
+    # причина отказа и Retry-After (сек.), None — запрос допущен; отклонённый запрос токенов не тратит
+    def check(self, scope) -> tuple[str, float] | None:
+        if scope['path'] in WAIT_PATHS and self.waits >= self.max_waits:
+            return 'max_waits', 1
+        now = self.timer()
+        user_bucket = None
+        if self.users is not None:
+            user_id = request_user(scope)
+            if user_id is not None:
+                user_bucket = self.users.get(user_id) or TokenBucket(self.user_rate, self.user_burst, now)
+                # запись заново: TTLCache отсчитывает срок от вставки, а не от чтения
+                self.users[user_id] = user_bucket
+                retry_after = user_bucket.take(now)
+                if retry_after:
+                    return 'user_rate', retry_after
+        if self.bucket is not None:
+            retry_after = self.bucket.take(now)
+            if retry_after:
+                if user_bucket is not None:
+                    user_bucket.refund()
+                return 'global_rate', retry_after
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'waits': self.waits,
+            'max_waits': self.max_waits,
+            'users': len(self.users) if self.users is not None else 0,
+            'global_tokens': round(self.bucket.tokens, 1) if self.bucket is not None else None,
+        }
+
+
+admission = AdmissionControl(ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_GLOBAL_RATE,
+                             ADMISSION_GLOBAL_BURST, ADMISSION_MAX_WAITS, ADMISSION_MAX_USERS)
+
+
+def request_user(scope) -> int | None:
+    token = Request(scope).cookies.get('access_token')
+    if not token:
+        return None
+    # недействительный токен залогирует маршрут, отклоняя запрос (401)
+    try:
+        return decode_token(token, log_errors=False)
+    except HTTPException:
+        return None
+
+
+def is_service_request(scope) -> bool:
+    return any(name in SERVICE_KEYS and value == SERVICE_KEYS[name] for name, value in scope['headers'])
+
+
+class AdmissionMiddleware:
+    """ASGI middleware: перегрузка отсекается ответом 429 с Retry-After до маршрутизации,
+    зависимостей и запросов к БД (решение — admission)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS' or is_service_request(scope):
+            await self.app(scope, receive, send)
+            return
+        rejected = admission.check(scope)
+        if rejected is not None:
+            reason, retry_after = rejected
+            admission_rejected.labels(reason).inc()
+            await send({
+                'type': 'http.response.start',
+                'status': 429,
+                'headers': [
+                    (b'content-type', b'application/json'),
+                    (b'retry-after', str(math.ceil(retry_after)).encode()),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': orjson.dumps({'detail': 'Слишком много запросов'})})
+            return
+        if scope['path'] not in WAIT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        admission.waits += 1
+        ai_waits_in_flight.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.waits -= 1
+            ai_waits_in_flight.dec()
@@ -17,11 +17,110 @@ API_KEY_AI = os.getenv('API_KEY_AI')
 # Доступ к бекенду
 SECRET_KEY_JWT = os.getenv('SECRET_KEY_JWT')
 ALGORITHM = os.getenv('ALGORITHM')
+# Кеш проверенных jwt-токенов (записей на воркер) и список отозванных при выходе
+JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', '10000'))
+JWT_DENYLIST_SIZE = int(os.getenv('JWT_DENYLIST_SIZE', '10000'))
 # Адрес фронта
 ADDRESS_FRONT = os.getenv('ADDRESS_FRONT')
 # GOOGLE_CLIENT_ID
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+# Сертификаты для проверки Google ID токена; GOOGLE_CERTS_FILE — локальный JSON {kid: PEM} вместо Google (тесты)
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_CERTS_FILE = os.getenv('GOOGLE_CERTS_FILE')
 # Ключ для контейнера
 HEALTH_SECRET_KEY = os.getenv('HEALTH_SECRET_KEY')
 # Передача cookies по http или https для перехода на локальные рельсы/серверные
 SECURE_HTTP_HTTPS = os.getenv('SECURE_HTTP_HTTPS') == 'True'
+# Ожидание ответа AI: 'notify' — пробуждение через LISTEN/NOTIFY и редкая перепроверка флага,
+# 'poll' — перепроверка флага каждые AI_POLL_INTERVAL сек. (уведомления, если канал есть, только ускоряют ответ)
+AI_WAIT_MODE = os.getenv('AI_WAIT_MODE', 'notify')
+# Канал Postgres для уведомлений о диалогах и событий между воркерами (отзыв токенов, сброс кеша, части ответа AI)
+# при любом AI_WAIT_MODE; пусто — без LISTEN/NOTIFY
+AI_NOTIFY_CHANNEL = os.getenv('AI_NOTIFY_CHANNEL', 'dialog_events')
+# Интервал опроса флага в режиме 'poll' (сек.)
+AI_POLL_INTERVAL = float(os.getenv('AI_POLL_INTERVAL', '1'))
+# Резервная перепроверка флага в режиме 'notify', если уведомление потерялось (сек.)
+AI_NOTIFY_FALLBACK_INTERVAL = float(os.getenv('AI_NOTIFY_FALLBACK_INTERVAL', '10'))
+# Очередь AI воркеров: аренда захваченного диалога (сек.) и максимальный размер пачки
+AI_CLAIM_LEASE = float(os.getenv('AI_CLAIM_LEASE', '60'))
+AI_CLAIM_MAX_BATCH = int(os.getenv('AI_CLAIM_MAX_BATCH', '100'))
+# Контекст диалога в ответе /messages/claim: последние сообщения user и бота, не больше N сообщений
+# и примерно M токенов (4 символа на токен); контексты кешируются в воркере для K диалогов
+AI_CONTEXT_MAX_MESSAGES = int(os.getenv('AI_CONTEXT_MAX_MESSAGES', '50'))
+AI_CONTEXT_MAX_TOKENS = int(os.getenv('AI_CONTEXT_MAX_TOKENS', '4000'))
+AI_CONTEXT_CACHE_SIZE = int(os.getenv('AI_CONTEXT_CACHE_SIZE', '10000'))
+# Максимальное время удержания long-polling запроса воркера (сек.)
+AI_LONG_POLL_MAX = float(os.getenv('AI_LONG_POLL_MAX', '30'))
+# Сколько пользователь ждёт ответа AI (сек.), затем 504; сообщение остаётся в очереди
+AI_WAIT_TIMEOUT = float(os.getenv('AI_WAIT_TIMEOUT', '120'))
+# Фоновое снятие флагов, висящих дольше AI_FLAG_TIMEOUT сек. (0 — не снимать; больше AI_WAIT_TIMEOUT):
+# раз в AI_REAPER_INTERVAL сек. пачками по AI_REAPER_BATCH диалогов
+AI_FLAG_TIMEOUT = float(os.getenv('AI_FLAG_TIMEOUT', '600'))
+AI_REAPER_INTERVAL = float(os.getenv('AI_REAPER_INTERVAL', '60'))
+AI_REAPER_BATCH = int(os.getenv('AI_REAPER_BATCH', '500'))
+# Выгрузка диалогов (/dialogs/export): строк за одно чтение серверного курсора
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+# Применять миграции схемы при старте приложения (иначе: python -m src.repository.migrations upgrade)
+DB_MIGRATE_ON_STARTUP = os.getenv('DB_MIGRATE_ON_STARTUP', 'True') == 'True'
+# Пул соединений с БД (на каждый воркер; плюс одно LISTEN-соединение)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Пересоздать соединение старше N сек. (только backend 'sqlalchemy')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Закрыть соединение, простоявшее в пуле без дела N сек., 0 — не закрывать (только backend 'asyncpg':
+# пересоздания по возрасту у asyncpg нет)
+DB_POOL_IDLE_LIFETIME = float(os.getenv('DB_POOL_IDLE_LIFETIME', '300'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
+# Сколько соединений открыть при старте
+DB_POOL_PREWARM = int(os.getenv('DB_POOL_PREWARM', '5'))
+# Реплики для чтения истории (только backend 'sqlalchemy'): DSN через запятую; недоступная реплика пропускается
+# DATABASE_REPLICA_RETRY сек. Read-your-writes: после записи клиент читает с основной БД ещё DATABASE_REPLICA_PIN
+# сек., после своего сообщения — AI_WAIT_TIMEOUT + DATABASE_REPLICA_PIN (ответ AI записывает другой запрос).
+# Закрепление не держится в памяти воркера (другие воркеры uvicorn его не видят): срок уходит клиенту в подписанной
+# cookie db_pin и приходит с каждым его запросом в любой воркер. Ограничения: клиент без cookie или серверы
+# с расхождением часов больше DATABASE_REPLICA_PIN могут прочитать отстающую реплику; ответ AI, записанный
+# после окончания ожидания, виден с задержкой репликации.
+DATABASE_REPLICAS = [dsn.strip() for dsn in os.getenv('DATABASE_REPLICAS', '').split(',') if dsn.strip()]
+DATABASE_REPLICA_PIN = float(os.getenv('DATABASE_REPLICA_PIN', '5'))
+DATABASE_REPLICA_RETRY = float(os.getenv('DATABASE_REPLICA_RETRY', '30'))
+DATABASE_REPLICA_CONNECT_TIMEOUT = float(os.getenv('DATABASE_REPLICA_CONNECT_TIMEOUT', '2'))
+# Реализация репозитория: 'sqlalchemy' — Database, 'asyncpg' — AsyncpgDatabase (быстрый путь без ORM-слоя),
+# 'memory' — MemoryDatabase без Postgres (тесты, профилирование, демо в одном воркере)
+DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'sqlalchemy')
+# Канал между воркерами есть только у Postgres
+NOTIFY_CHANNEL = AI_NOTIFY_CHANNEL if AI_NOTIFY_CHANNEL and DATABASE_BACKEND != 'memory' else None
+# Кеш списков диалогов, владельцев диалогов и /me: 'local' — в памяти воркера, 'redis' — общий (пакет redis)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local')
+CACHE_TTL = float(os.getenv('CACHE_TTL', '300'))
+CACHE_MAXSIZE = int(os.getenv('CACHE_MAXSIZE', '10000'))
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+# Логирование: общий уровень, формат ('text' | 'json'), уровни модулей ('src.repository=WARNING,...')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# Частые сообщения: писать 1 из N записей ниже WARNING из функции ('get_ai_response_flag=100,...')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', 'get_ai_response_flag=100,claim_dialogs=100,read_user_message_json=100')
+# Очередь записей к фоновому потоку вывода; при переполнении записи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Запуск в продакшене (python -m src.server): адрес, воркеры uvicorn (0 — по числу доступных CPU)
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '0'))
+# Простой keep-alive соединения (сек.): дольше, чем держит соединение прокси перед приложением
+SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', '75'))
+# Очередь ещё не принятых соединений (listen backlog, ограничена net.core.somaxconn)
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '2048'))
+# Остановка: сколько ждать незавершённых запросов (сек.); ожидания ответа AI, не дождавшиеся ответа, получают 503
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))
+SERVER_ACCESS_LOG = os.getenv('SERVER_ACCESS_LOG', 'False') == 'True'
+# Контроль допуска (429 + Retry-After до обращения к БД), в каждом воркере uvicorn отдельно:
+# запросов в секунду и запас (burst) на пользователя и на весь воркер (0 — без ограничения),
+# одновременных ожиданий ответа AI (/send/message/ai, /stream) на воркер
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', '5'))
+ADMISSION_USER_BURST = int(os.getenv('ADMISSION_USER_BURST', '20'))
+ADMISSION_GLOBAL_RATE = float(os.getenv('ADMISSION_GLOBAL_RATE', '500'))
+ADMISSION_GLOBAL_BURST = int(os.getenv('ADMISSION_GLOBAL_BURST', '1000'))
+ADMISSION_MAX_WAITS = int(os.getenv('ADMISSION_MAX_WAITS', '500'))
+# Сколько пользователей держать в памяти (корзины давно не приходивших уже полные и вытесняются)
+ADMISSION_MAX_USERS = int(os.getenv('ADMISSION_MAX_USERS', '100000'))
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+from google.auth import jwt as google_jwt
+
+from src.core.config import GOOGLE_CLIENT_ID, GOOGLE_CERTS_URL, GOOGLE_CERTS_FILE
+from src.utils.utils import get_logger
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+logger = get_logger(__name__)
+
+
+# срок жизни ответа по заголовкам: Cache-Control max-age минус Age, иначе Expires минус Date
+def cache_ttl(headers, default: float) -> float:
+    cache_control = headers.get('Cache-Control', '')
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    max_age = re.search(r'max-age=(\d+)', cache_control)
+    if max_age:
+        return max(int(max_age.group(1)) - int(headers.get('Age', 0)), 0)
+    if 'Expires' in headers:
+        try:
+            expires = parsedate_to_datetime(headers['Expires'])
+            date = parsedate_to_datetime(headers['Date']) if 'Date' in headers else None
+            return max((expires - date).total_seconds() if date else expires.timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+    return default
+
+
+class GoogleTokenVerifier:
+    """Проверка Google ID токена без блокировки event loop.
+
+    Сертификаты Google загружаются через aiohttp и хранятся в памяти, пока позволяют
+    заголовки кеширования ответа. Разбор сертификатов и проверка подписи (чистый Python)
+    выполняются в пуле потоков. certs_file — локальная замена сертификатов для тестов
+    (JSON {kid: PEM}), загружается один раз и не устаревает.
+    """
+
+    def __init__(self, client_id: str, certs_url: str, certs_file: str | None = None,
+                 default_ttl: float = 300, refresh_interval: float = 60, timeout: float = 10):
+        self.client_id = client_id
+        self.certs_url = certs_url
+        self.certs_file = certs_file
+        self.default_ttl = default_ttl
+        # не чаще раза в refresh_interval перезапрашивать сертификаты из-за неизвестного kid
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.certs: dict[str, str] = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def fetch_certs(self) -> None:
+        if self.certs_file:
+            with open(self.certs_file, encoding='utf-8') as file:
+                self.certs = json.load(file)
+            self.expires_at = float('inf')
+            self.fetched_at = time.monotonic()
+            logger.info("Сертификаты Google загружены из %s: %s", self.certs_file, len(self.certs))
+            return
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            async with session.get(self.certs_url) as response:
+                response.raise_for_status()
+                certs = await response.json(content_type=None)
+                ttl = cache_ttl(response.headers, self.default_ttl)
+        self.certs = certs
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + ttl
+        logger.info("Сертификаты Google обновлены: %s, кеш на %.0f сек.", len(certs), ttl)
+
+    # актуальные сертификаты; при ошибке загрузки — последние полученные, если они есть
+    async def get_certs(self, kid: str | None = None) -> dict[str, str]:
+        now = time.monotonic()
+        unknown_kid = kid is not None and kid not in self.certs and now - self.fetched_at > self.refresh_interval
+        if now < self.expires_at and not unknown_kid:
+            return self.certs
+        async with self.lock:
+            # пока ждали блокировку, сертификаты мог обновить другой запрос
+            if time.monotonic() - self.fetched_at < 1 and self.certs:
+                return self.certs
+            try:
+                await self.fetch_certs()
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                if not self.certs:
+                    raise
+                # не повторять запрос на каждом входе, пока Google недоступен
+                self.expires_at = time.monotonic() + self.refresh_interval
+                logger.error("Ошибка обновления сертификатов Google, используются прежние: %s", e)
+        return self.certs
+
+    # проверить токен: подпись, aud, exp/iat, iss; ValueError — токен недействителен
+    async def verify(self, token: str) -> dict:
+        header = google_jwt.decode_header(token)
+        certs = await self.get_certs(header.get('kid'))
+        idinfo = await asyncio.to_thread(google_jwt.decode, token, certs=certs, audience=self.client_id)
+        if idinfo.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError(f"Неверный издатель токена: {idinfo.get('iss')}")
+        return idinfo
+
+
+google_verifier = GoogleTokenVerifier(GOOGLE_CLIENT_ID, GOOGLE_CERTS_URL, GOOGLE_CERTS_FILE or None)
@@ -0,0 +1,138 @@
+import functools
+import inspect
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+
+# при нескольких воркерах uvicorn метрики пишутся в файлы каталога PROMETHEUS_MULTIPROC_DIR
+# (очищать перед запуском), /metrics любого воркера отдаёт сумму по всем
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+AI_WAIT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', "Время обработки запроса по маршруту",
+    ['method', 'route', 'status'],
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds', "Время вызова метода репозитория", ['method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+db_query_errors = Counter('db_query_errors_total', "Ошибки методов репозитория", ['method'])
+db_pool = Gauge('db_pool_connections', "Соединения пула БД", ['state'], multiprocess_mode='livesum')
+db_pool_wait = Gauge('db_pool_wait_seconds_total', "Суммарное ожидание соединения из пула",
+                     multiprocess_mode='livesum')
+ai_wait_duration = Histogram(
+    'ai_wait_seconds', "Ожидание ответа AI пользователем", ['mode', 'outcome'], buckets=AI_WAIT_BUCKETS,
+)
+ai_queue_depth = Gauge('ai_queue_depth', "Диалогов, ожидающих ответа AI", multiprocess_mode='mostrecent')
+ai_pickup_delay = Histogram(
+    'ai_pickup_delay_seconds', "От сообщения пользователя до захвата диалога воркером", buckets=AI_WAIT_BUCKETS,
+)
+
+ai_flags_reaped = Counter('ai_flags_reaped_total', "Флаги ожидания ответа AI, снятые по таймауту")
+admission_rejected = Counter('admission_rejected_total', "Запросы, отклонённые контролем допуска (429)", ['reason'])
+ai_waits_in_flight = Gauge('ai_waits_in_flight', "Запросы, ожидающие ответа AI", multiprocess_mode='livesum')
+
+
+class MetricsMiddleware:
+    """ASGI middleware: гистограмма времени запроса по шаблону маршрута ('/dialogs/{dialog_id}').
+
+    Шаблон берётся по endpoint, который роутер кладёт в scope; запросы мимо маршрутов — 'unmatched'.
+    Для потоковых ответов (SSE) время — до закрытия потока.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes: dict | None = None
+
+    def route_path(self, scope) -> str:
+        if self.routes is None:
+            self.routes = {
+                route.endpoint: route.path
+                for route in scope['app'].routes if getattr(route, 'endpoint', None) is not None
+            }
+        return self.routes.get(scope.get('endpoint'), 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.labels(
+                scope['method'], self.route_path(scope), str(status)
+            ).observe(time.perf_counter() - started)
+
+
+class RepositoryErrorCounter(logging.Handler):
+    """Методы репозитория перехватывают ошибки и пишут их в лог уровня ERROR — по нему и считаем."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        db_query_errors.labels(record.funcName).inc()
+
+
+def update_pool_gauges(stats: dict) -> None:
+    if not stats:
+        return
+    db_pool.labels('checked_out').set(stats['checked_out'])
+    db_pool.labels('checked_in').set(stats['checked_in'])
+    db_pool.labels('overflow').set(stats['overflow'])
+    db_pool_wait.set(stats['wait_seconds_total'])
+
+
+# обернуть публичные async-методы репозитория: время вызова, ошибки, состояние пула
+def instrument_repository(db) -> None:
+    db.logger.addHandler(RepositoryErrorCounter())
+    for name, method in inspect.getmembers(db, inspect.iscoroutinefunction):
+        if name.startswith('_') or name in ('connect', 'close'):
+            continue
+        setattr(db, name, timed(db, name, method))
+
+
+def timed(db, name: str, method):
+    histogram = db_query_duration.labels(name)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            db_query_errors.labels(name).inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            update_pool_gauges(db.pool_stats())
+    return wrapper
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# воркер завершился: его livesum-метрики больше не учитываются
+def mark_process_dead() -> None:
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,63 @@
+import hashlib
+import hmac
+import math
+import time
+
+from starlette.requests import Request
+
+from src.core.admission import is_service_request
+from src.core.config import SECRET_KEY_JWT, SECURE_HTTP_HTTPS
+from src.repository.repository import ReadPin, read_pin
+
+# cookie закрепления за основной БД: '<until>.<hmac>'
+COOKIE_NAME = 'db_pin'
+
+
+def sign(until: int) -> str:
+    return hmac.new(SECRET_KEY_JWT.encode(), str(until).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+# until из cookie; поддельная или испорченная cookie — без закрепления
+def parse_pin(value: str | None) -> float:
+    if not value:
+        return 0.0
+    until, _, signature = value.partition('.')
+    if not until.isdigit() or not hmac.compare_digest(signature, sign(int(until))):
+        return 0.0
+    return float(until)
+
+
+def pin_cookie(until: float) -> bytes:
+    until = math.ceil(until)
+    cookie = (f'{COOKIE_NAME}={until}.{sign(until)}; Max-Age={max(until - int(time.time()), 0)}; Path=/; '
+              f'HttpOnly; SameSite=Lax')
+    if SECURE_HTTP_HTTPS:
+        cookie += '; Secure'
+    return cookie.encode()
+
+
+class ReadPinMiddleware:
+    """ASGI middleware read-your-writes для реплик: ReadPin запроса из cookie клиента, а продлённый записью
+    (Database.pin) — обратно в cookie. Закрепление видят все воркеры uvicorn: оно приходит с запросом."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        pin = ReadPin(parse_pin(Request(scope).cookies.get(COOKIE_NAME)))
+        token = read_pin.set(pin)
+        # служебным запросам (воркеры AI) cookie не нужна: закрепление действует только внутри запроса
+        service = is_service_request(scope)
+
+        async def send_with_pin(message):
+            if message['type'] == 'http.response.start' and pin.changed and not service:
+                message = {**message, 'headers': [*message.get('headers', []), (b'set-cookie', pin_cookie(pin.until))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_pin)
+        finally:
+            read_pin.reset(token)
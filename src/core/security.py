@@ -1,13 +1,67 @@
+import hashlib
+import time
+
+from cachetools import TLRUCache
 from jose import jwt, JWTError
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, Request
 
 from src.utils.utils import get_logger
-from src.core.config import SECRET_KEY_JWT, ALGORITHM
+from src.core.config import SECRET_KEY_JWT, ALGORITHM, JWT_CACHE_SIZE, JWT_DENYLIST_SIZE
 
 logger = get_logger(__name__)
 
 
+class TokenCache:
+    """Проверенные jwt-токены и отозванные при выходе, по sha256 токена.
+
+    Запись живёт не дольше exp самого токена (время — time.time, как exp).
+    Отозванный токен хранится до своего exp. Переполненный denylist не забывает отзыв: из него уходит
+    запись с ближайшим exp, а revoked_until поднимается до этого exp — все токены, истекающие не позже,
+    отклоняются (пользователи входят заново), вытесненный отзыв не становится снова действительным.
+    """
+
+    def __init__(self, maxsize: int, denylist_size: int):
+        self.tokens = TLRUCache(maxsize, ttu=lambda _, value, now: value[1], timer=time.time)
+        self.denylist = TLRUCache(denylist_size, ttu=lambda _, exp, now: exp, timer=time.time)
+        self.revoked_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def revoke(self, digest: str, exp: float) -> None:
+        self.tokens.pop(digest, None)
+        if digest not in self.denylist and len(self.denylist) >= self.denylist.maxsize:
+            self.denylist.expire()
+        if digest not in self.denylist and len(self.denylist) >= self.denylist.maxsize:
+            # место освобождается самим классом, а не LRU-вытеснением TLRUCache
+            evicted, evicted_exp = min(self.denylist.items(), key=lambda item: item[1])
+            del self.denylist[evicted]
+            self.revoked_until = max(self.revoked_until, evicted_exp)
+            logger.warning("Список отозванных токенов переполнен: отклоняются все токены с exp до %s",
+                           datetime.fromtimestamp(self.revoked_until, timezone.utc).isoformat(timespec='seconds'))
+        self.denylist[digest] = exp
+
+    # отозван ли токен: в denylist или истекает не позже вытесненного из него отзыва
+    def is_revoked(self, digest: str, exp: float) -> bool:
+        return exp <= self.revoked_until or digest in self.denylist
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.tokens),
+            'hits': self.hits,
+            'misses': self.misses,
+            'revoked': len(self.denylist),
+            'revoked_until': self.revoked_until,
+        }
+
+
+token_cache = TokenCache(JWT_CACHE_SIZE, JWT_DENYLIST_SIZE)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
 # создает jwt-токен
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
@@ -16,18 +70,32 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     return jwt.encode(to_encode, SECRET_KEY_JWT, algorithm=ALGORITHM)
 
 
-# декодирует и проверяет jwt-токен
-def decode_token(token: str) -> int:
+# декодирует и проверяет jwt-токен (проверенные берутся из token_cache); log_errors=False — без записи
+# в лог (ошибку залогирует тот, кто отклонит запрос). Токен без exp не принимается: отзыв держится до exp
+def decode_token(token: str, log_errors: bool = True) -> int:
+    digest = token_digest(token)
+    cached = token_cache.tokens.get(digest)
+    if cached is not None:
+        if token_cache.is_revoked(digest, cached[1]):
+            raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+        token_cache.hits += 1
+        return cached[0]
+    token_cache.misses += 1
     try:
-        payload = jwt.decode(token, SECRET_KEY_JWT, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            logger.error("JWT ошибка: отсутствует 'sub'")
-            raise HTTPException(status_code=401, detail="Недействительный токен")
-        return int(user_id)
+        payload = jwt.decode(token, SECRET_KEY_JWT, algorithms=[ALGORITHM], options={'require_exp': True})
     except JWTError as e:
-        logger.error(f"JWT ошибка: {e}")
+        if log_errors:
+            logger.error("JWT ошибка: %s", e)
+        raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+    if token_cache.is_revoked(digest, payload['exp']):
         raise HTTPException(status_code=401, detail="Недействительный или просроченный токен")
+    user_id = payload.get("sub")
+    if user_id is None:
+        if log_errors:
+            logger.error("JWT ошибка: отсутствует 'sub'")
+        raise HTTPException(status_code=401, detail="Недействительный токен")
+    token_cache.tokens[digest] = (int(user_id), payload['exp'])
+    return int(user_id)
 
 
 # извлекает текущего пользователя
@@ -38,5 +106,13 @@ async def get_current_user(request: Request) -> int:
     return decode_token(token)
 
 
-
-
+# отозвать токен при выходе: до своего exp он не принимается; вернуть sha256 и exp для других воркеров
+def revoke_token(token: str) -> tuple[str, float] | None:
+    try:
+        payload = jwt.decode(token, SECRET_KEY_JWT, algorithms=[ALGORITHM], options={'require_exp': True})
+    except JWTError:
+        return None
+    exp = payload['exp']
+    digest = token_digest(token)
+    token_cache.revoke(digest, exp)
+    return digest, exp
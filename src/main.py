@@ -1,11 +1,55 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.api.init import api_router
-from src.core.config import ADDRESS_FRONT
+from src.core.admission import AdmissionMiddleware
+from src.core.read_pin import ReadPinMiddleware
+from src.core.metrics import MetricsMiddleware, mark_process_dead
+from src.core.config import (
+    ADDRESS_FRONT, NOTIFY_CHANNEL, AI_FLAG_TIMEOUT, DB_MIGRATE_ON_STARTUP, DATABASE_BACKEND, DATABASE_REPLICAS,
+)
+from src.repository.migrations import upgrade
+from src.services.service import repository, notifier, cache, run_flag_reaper
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # пул БД живёт вместе с приложением: прогрев при старте, закрытие при остановке
+    # в памяти (DATABASE_BACKEND=memory) нет ни схемы, ни других воркеров
+    postgres = DATABASE_BACKEND != 'memory'
+    if DB_MIGRATE_ON_STARTUP and postgres:
+        await upgrade()
+    await repository.connect()
+    # LISTEN для событий других воркеров: ответ AI, отзыв токена, сброс кеша — при любом AI_WAIT_MODE
+    if NOTIFY_CHANNEL:
+        await notifier.start()
+    # снятие зависших флагов ожидания AI
+    reaper = asyncio.create_task(run_flag_reaper(repository)) if AI_FLAG_TIMEOUT > 0 else None
+    yield
+    if reaper is not None:
+        reaper.cancel()
+        try:
+            await reaper
+        except asyncio.CancelledError:
+            pass
+    await notifier.stop()
+    await cache.close()
+    await repository.close()
+    mark_process_dead()
 
-app = FastAPI(title="Deepbot API")
+
+# ORJSONResponse по умолчанию: сериализация ответов через orjson вместо json.dumps
+app = FastAPI(title="Deepbot API", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# порядок: метрики -> CORS -> контроль допуска (ответ 429 тоже с заголовками CORS и в метриках) -> закрепление чтений
+if DATABASE_REPLICAS and DATABASE_BACKEND == 'sqlalchemy':
+    app.add_middleware(ReadPinMiddleware)
+app.add_middleware(AdmissionMiddleware)
 
 origins = [ADDRESS_FRONT,]
 app.add_middleware(
@@ -14,8 +58,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router)
 
 if __name__ == "__main__":
@@ -0,0 +1,454 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from itertools import product
+from typing import AsyncIterator
+
+import asyncpg
+
+from src.repository.base import Repository
+from src.repository.repository import (
+    HEADLINE_OPTIONS, dialog_json_query, GET_USERS_QUERY, CREATE_USER_QUERY, UPSERT_USER_QUERY,
+    CHECK_DIALOG_OWNERSHIP_QUERY, CREATE_DIALOG_QUERY, DELETE_DIALOG_QUERY, GET_DIALOGS_QUERY, INSERT_MESSAGE_QUERY,
+    GET_USER_QUERY, UPDATE_NAME_CHAT_QUERY, SUBMIT_USER_MESSAGE_QUERY, SUBMIT_NOTIFY, SAVE_AI_REPLIES_QUERY,
+    SAVE_AI_REPLIES_NOTIFY, NOTIFY_DIALOG_QUERY, GET_AI_RESPONSE_FLAG_QUERY, READ_AI_MESSAGE_QUERY,
+    COUNT_PENDING_DIALOGS_QUERY, READ_USER_MESSAGE_JSON_QUERY, CLAIM_DIALOGS_QUERY, REAP_STALE_FLAGS_QUERY,
+    EXPORT_DIALOGS_QUERY, SEARCH_MESSAGES_ALL, SEARCH_MESSAGES_DIALOG,
+)
+from src.utils.utils import get_logger
+
+# ошибки драйвера, которые методы репозитория превращают в False/None, как SQLAlchemyError в Database
+DB_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+
+# :name в SQL repository.py; приведения ::type не параметры
+PARAM = re.compile(r'(?<![:\w]):(\w+)')
+
+
+class Statement:
+    """Запрос из repository.py с :name, переписанный в $N для asyncpg.
+
+    SQL у Database и AsyncpgDatabase один, поэтому EXPLAIN_QUERIES в migrations.py проверяет и эти запросы.
+    Строка постоянная и попадает в кеш prepared statements соединения; повтор имени — тот же $N.
+    """
+
+    __slots__ = ('sql', 'names')
+
+    def __init__(self, query: str):
+        names: list[str] = []
+
+        def number(match: re.Match) -> str:
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f'${names.index(match.group(1)) + 1}'
+
+        self.sql = PARAM.sub(number, query)
+        self.names = tuple(names)
+
+    # (sql, *аргументы по номерам) для fetch/fetchval/execute; лишние параметры не передаются
+    def bind(self, **params) -> tuple:
+        return (self.sql, *(params[name] for name in self.names))
+
+
+GET_USERS = Statement(GET_USERS_QUERY)
+CREATE_USER = Statement(CREATE_USER_QUERY)
+UPSERT_USER = Statement(UPSERT_USER_QUERY)
+CHECK_DIALOG_OWNERSHIP = Statement(CHECK_DIALOG_OWNERSHIP_QUERY)
+CREATE_DIALOG = Statement(CREATE_DIALOG_QUERY)
+DELETE_DIALOG = Statement(DELETE_DIALOG_QUERY)
+GET_DIALOGS = Statement(GET_DIALOGS_QUERY)
+INSERT_MESSAGE = Statement(INSERT_MESSAGE_QUERY)
+# варианты get_dialog_json по заданным параметрам (before, since, limit)
+DIALOG_JSON = {flags: Statement(dialog_json_query(*flags)) for flags in product((False, True), repeat=3)}
+GET_USER = Statement(GET_USER_QUERY)
+UPDATE_NAME_CHAT = Statement(UPDATE_NAME_CHAT_QUERY)
+# без уведомления и с ним (notify_channel)
+SUBMIT_USER_MESSAGE = {notify: Statement(SUBMIT_USER_MESSAGE_QUERY.format(notify=SUBMIT_NOTIFY if notify else ''))
+                       for notify in (False, True)}
+SAVE_AI_REPLIES = {notify: Statement(SAVE_AI_REPLIES_QUERY.format(notify=SAVE_AI_REPLIES_NOTIFY if notify else ''))
+                   for notify in (False, True)}
+NOTIFY_DIALOG = Statement(NOTIFY_DIALOG_QUERY)
+GET_AI_RESPONSE_FLAG = Statement(GET_AI_RESPONSE_FLAG_QUERY)
+READ_AI_MESSAGE = Statement(READ_AI_MESSAGE_QUERY)
+COUNT_PENDING_DIALOGS = Statement(COUNT_PENDING_DIALOGS_QUERY)
+READ_USER_MESSAGE_JSON = Statement(READ_USER_MESSAGE_JSON_QUERY)
+CLAIM_DIALOGS = Statement(CLAIM_DIALOGS_QUERY)
+REAP_STALE_FLAGS = Statement(REAP_STALE_FLAGS_QUERY)
+EXPORT_DIALOGS = Statement(EXPORT_DIALOGS_QUERY)
+SEARCH_MESSAGES = {False: Statement(SEARCH_MESSAGES_ALL), True: Statement(SEARCH_MESSAGES_DIALOG)}
+
+
+class AsyncpgDatabase(Repository):
+    """Репозиторий напрямую на пуле asyncpg, без Session/text() и объектов результата SQLAlchemy.
+
+    Методы и возвращаемые значения совпадают с Database, SQL — тот же (Statement из констант repository.py).
+    Запросы — постоянные строки с $N: asyncpg держит их в кеше prepared statements каждого соединения,
+    повторный вызов не разбирает и не планирует SQL заново. Строки читаются как Record (кортеж) по позиции.
+
+    Пересоздания соединений по возрасту (pool_recycle в Database) у asyncpg нет: pool_idle_lifetime
+    закрывает соединение, простоявшее в пуле без дела дольше заданного (сек., 0 — не закрывать).
+    Занятое под нагрузкой соединение живёт сколько угодно долго.
+    """
+
+    def __init__(self, host, port, dbname, user, password, notify_channel: str | None = None,
+                 pool_size: int = 5, max_overflow: int = 10, pool_timeout: float = 30,
+                 pool_idle_lifetime: float = 0, pool_pre_ping: bool = False, pool_prewarm: int = 0):
+        self.connect_params = {'host': host, 'port': port, 'database': dbname, 'user': user, 'password': password}
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        # asyncpg сам сбрасывает соединение при возврате в пул, pre_ping не нужен
+        self.pool_idle_lifetime = pool_idle_lifetime
+        self.pool_prewarm = pool_prewarm
+        self.pool: asyncpg.Pool | None = None
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.notify_channel = notify_channel
+        self.logger = get_logger(__name__)
+
+    async def connect(self) -> None:
+        self.pool = await asyncpg.create_pool(
+            **self.connect_params,
+            min_size=self.pool_prewarm,
+            max_size=self.pool_size + self.max_overflow,
+            max_inactive_connection_lifetime=max(self.pool_idle_lifetime, 0),
+        )
+        self.logger.info("Пул asyncpg создан: max_size=%s, прогрето соединений: %s",
+                         self.pool_size + self.max_overflow, self.pool_prewarm)
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self.logger.info("Пул asyncpg закрыт")
+
+    def pool_stats(self) -> dict:
+        if self.pool is None:
+            return {}
+        size = self.pool.get_size()
+        return {
+            'size': self.pool_size,
+            'checked_out': size - self.pool.get_idle_size(),
+            'checked_in': self.pool.get_idle_size(),
+            'overflow': max(size - self.pool_size, 0),
+            'max_overflow': self.max_overflow,
+            'wait_count': self.wait_count,
+            'wait_seconds_total': round(self.wait_total, 6),
+            'wait_seconds_max': round(self.wait_max, 6),
+        }
+
+    # соединение из пула с учётом времени ожидания
+    @asynccontextmanager
+    async def connection(self):
+        started = time.perf_counter()
+        async with self.pool.acquire(timeout=self.pool_timeout) as connection:
+            waited = time.perf_counter() - started
+            self.wait_count += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            yield connection
+
+    # Сверка пользователя в БД
+    async def get_users(self, google_id: str) -> int | bool:
+        try:
+            async with self.connection() as connection:
+                user_id = await connection.fetchval(*GET_USERS.bind(google_id=google_id))
+            if user_id is not None:
+                return user_id
+            self.logger.info("Пользователь с google_id='%s' не найден.", google_id)
+            return False
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при получении пользователя: %s", e)
+            return False
+
+    # внесения пользователя в бд
+    async def create_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool:
+        try:
+            async with self.connection() as connection:
+                user_id = await connection.fetchval(*CREATE_USER.bind(
+                    mail=mail, google_id=google_id, given_name=given_name, family_name=family_name, picture=picture
+                ))
+            self.logger.info("Пользователь с почтой '%s' успешно создан с user_id=%s", mail, user_id)
+            return user_id
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при создании пользователя с почтой '%s': %s", mail, e)
+            return False
+
+    # вход через Google одним запросом: создать пользователя или обновить профиль существующего
+    async def upsert_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool:
+        try:
+            async with self.connection() as connection:
+                user_id = await connection.fetchval(*UPSERT_USER.bind(
+                    mail=mail, google_id=google_id, given_name=given_name, family_name=family_name, picture=picture
+                ))
+            self.logger.info("Пользователь с почтой '%s' вошёл, user_id=%s", mail, user_id)
+            return user_id
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка входа пользователя с почтой '%s': %s", mail, e)
+            return False
+
+    # проверка принадлежности диалога
+    async def check_dialog_ownership(self, user_id: int, dialog_id: int) -> bool:
+        try:
+            async with self.connection() as connection:
+                dialog = await connection.fetchval(*CHECK_DIALOG_OWNERSHIP.bind(user_id=user_id, dialog_id=dialog_id))
+            if dialog is None:
+                self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s", user_id, dialog_id)
+                return False
+            return True
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при проверке доступа к диалогу id:%s пользователя id:%s: %s",
+                              dialog_id, user_id, e)
+            return False
+
+    # внести user_id в dialogs (КНОПКА создать диалог)
+    async def create_dialog(self, user_id: int, dialog_name: str) -> int | bool:
+        try:
+            async with self.connection() as connection:
+                dialog_id = await connection.fetchval(*CREATE_DIALOG.bind(user_id=user_id, dialog_name=dialog_name))
+            self.logger.info("Пользователь id:%s успешно создал диалог id:%s", user_id, dialog_id)
+            return dialog_id
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при создании диалога. Пользователь id:%s: %s", user_id, e)
+            return False
+
+    # удаление dialog_id из dialogs
+    async def delete_dialog(self, user_id: int, dialog_id: int) -> bool:
+        try:
+            async with self.connection() as connection:
+                status = await connection.execute(*DELETE_DIALOG.bind(user_id=user_id, dialog_id=dialog_id))
+            if status == 'DELETE 0':
+                self.logger.warning("Диалог id:%s не найден или не принадлежит пользователю id:%s", dialog_id, user_id)
+                return False
+            self.logger.info("Пользователь id:%s удалил диалог id:%s", user_id, dialog_id)
+            return True
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при удаление диалога. Пользователь id:%s- %s", user_id, e)
+            return False
+
+    # запрос на список dialogs пользователя
+    async def get_dialogs(self, user_id: int) -> list | bool:
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*GET_DIALOGS.bind(user_id=user_id))
+            dialogs = [{'dialog_id': row[0], 'dialog_name': row[1]} for row in rows]
+            self.logger.info("Получено %s диалог(ов) пользователя id:%s", len(dialogs), user_id)
+            return dialogs
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при получении диалогов пользователя id:%s: %s", user_id, e)
+            return False
+
+    # отправка сообщения в messages
+    async def insert_message(self, user_id: int, dialog_id: int, content: str) -> int | bool:
+        try:
+            async with self.connection() as connection:
+                message_id = await connection.fetchval(*INSERT_MESSAGE.bind(
+                    dialog_id=dialog_id, user_id=user_id, content=content
+                ))
+            self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s",
+                             user_id, message_id, dialog_id)
+            return message_id
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка при записи сообщения пользователя id:%s: %s", user_id, e)
+            return False
+
+    # контекст диалога одним JSON-массивом из БД, семантика как в Database.get_dialog_json
+    async def get_dialog_json(self, user_id: int, dialog_id: int, before: int | None = None,
+                              since: int | None = None, limit: int | None = None) -> bool | str:
+        statement = DIALOG_JSON[(before is not None, since is not None, limit is not None)]
+        try:
+            async with self.connection() as connection:
+                dialog = await connection.fetchval(*statement.bind(
+                    dialog_id=dialog_id, before=before, since=since, limit=limit
+                ))
+            self.logger.info("Пользователь:%s получил сообщения диалога id:%s", user_id, dialog_id)
+            return dialog
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка получения диалога id:%s пользователям id: %s: %s", dialog_id, user_id, e)
+            return False
+
+    # получить имя, фамилию, аватарка
+    async def get_user(self, user_id: int) -> bool | list:
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*GET_USER.bind(user_id=user_id))
+            content_user = [{'given_name': row[0], 'family_name': row[1], 'picture': row[2]} for row in rows]
+            self.logger.info("Пользователь:%s получил дату для /me", user_id)
+            return content_user
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка получения даты для /me пользователем id: %s: %s", user_id, e)
+            return False
+
+    # Переименовать диалог
+    async def update_name_chat(self, user_id: int, dialog_id: int, dialog_name: str) -> bool:
+        try:
+            async with self.connection() as connection:
+                updated = await connection.fetchval(*UPDATE_NAME_CHAT.bind(
+                    dialog_name=dialog_name, user_id=user_id, dialog_id=dialog_id
+                ))
+            if updated is None:
+                self.logger.warning("Не найден диалог %s для переименования пользователем %s", dialog_id, user_id)
+                return False
+            self.logger.info("Пользователь id:%s переименовал диалог id:%s в '%s'", user_id, dialog_id, dialog_name)
+            return True
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка переименования диалога пользователем id: %s: %s", user_id, e)
+            return False
+
+    # приём сообщения user одним запросом, семантика как в Database.submit_user_message
+    async def submit_user_message(self, user_id: int, dialog_id: int, content: str) -> str | bool:
+        statement = SUBMIT_USER_MESSAGE[bool(self.notify_channel)]
+        try:
+            async with self.connection() as connection:
+                owned, message_id = await connection.fetchrow(*statement.bind(
+                    user_id=user_id, dialog_id=dialog_id, content=content, channel=self.notify_channel
+                ))
+            if not owned:
+                self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s", user_id, dialog_id)
+                return 'forbidden'
+            if message_id is None:
+                self.logger.info("Диалог id:%s уже ожидает ответа AI", dialog_id)
+                return 'pending'
+            self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s",
+                             user_id, message_id, dialog_id)
+            return 'accepted'
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка приёма сообщения пользователя id:%s в диалог id:%s: %s", user_id, dialog_id, e)
+            return False
+
+    # запись пачки ответов AI одним запросом, семантика как в Database.save_ai_replies
+    async def save_ai_replies(self, replies: list[tuple[int, int, str]]) -> bool | list:
+        statement = SAVE_AI_REPLIES[bool(self.notify_channel)]
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*statement.bind(
+                    user_ids=[reply[0] for reply in replies],
+                    dialog_ids=[reply[1] for reply in replies],
+                    contents=[reply[2] for reply in replies],
+                    channel=self.notify_channel
+                ))
+            saved = [row['saved'] for row in rows]
+            self.logger.info("AI записал %s из %s ответ(ов)", sum(saved), len(replies))
+            return saved
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка записи пачки ответов AI: %s", e)
+            return False
+
+    # уведомление воркеров о событии диалога (LISTEN/NOTIFY)
+    async def notify_dialog(self, event: str, dialog_id: int, data: str = '') -> bool:
+        try:
+            async with self.connection() as connection:
+                await connection.execute(*NOTIFY_DIALOG.bind(
+                    channel=self.notify_channel, payload=f"{event}:{dialog_id}:{data}"
+                ))
+            return True
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка уведомления %s для диалога %s: %s", event, dialog_id, e)
+            return False
+
+    # получение флага
+    async def get_ai_response_flag(self, user_id: int, dialog_id: int) -> bool | None:
+        try:
+            async with self.connection() as connection:
+                flag = await connection.fetchval(*GET_AI_RESPONSE_FLAG.bind(user_id=user_id, dialog_id=dialog_id))
+            if flag is None:
+                self.logger.warning("Флаг не найден для диалога %s пользователя %s", dialog_id, user_id)
+                return None
+            self.logger.info("Пользователь %s получил флаг: %s", user_id, flag)
+            return flag
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка получения флага для чата %s пользователя %s: %s", dialog_id, user_id, e)
+            return None
+
+    async def read_ai_message(self, user_id: int, dialog_id: int) -> bool | dict:
+        try:
+            async with self.connection() as connection:
+                content = await connection.fetchval(*READ_AI_MESSAGE.bind(dialog_id=dialog_id, user_id=user_id))
+            if content is None:
+                self.logger.warning("Последние сообщение: %s в диалоге: %s не найдено", user_id, dialog_id)
+                return False
+            self.logger.info("Пользователь %s получил последнее сообщение", user_id)
+            return {'content': content}
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка получения последнего сообщения для чата %s пользователя %s: %s",
+                              dialog_id, user_id, e)
+            return False
+
+    # число диалогов, ожидающих ответа AI (глубина очереди)
+    async def count_pending_dialogs(self) -> int | None:
+        try:
+            async with self.connection() as connection:
+                return await connection.fetchval(*COUNT_PENDING_DIALOGS.bind())
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка подсчёта ожидающих диалогов: %s", e)
+            return None
+
+    # сообщения пользователей в ожидающих ответа диалогах одним JSON-массивом
+    async def read_user_message_json(self) -> bool | str:
+        try:
+            async with self.connection() as connection:
+                messages = await connection.fetchval(*READ_USER_MESSAGE_JSON.bind())
+            self.logger.info("AI:получил диалоги")
+            return messages
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка AI не получила диалоги: %s", e)
+            return False
+
+    # захват ожидающих диалогов воркером, семантика как в Database.claim_dialogs
+    async def claim_dialogs(self, worker_id: str, limit: int, lease: float) -> bool | list:
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*CLAIM_DIALOGS.bind(worker_id=worker_id, limit=limit, lease=lease))
+            dialogs = {}
+            for dialog_id, user_id, pickup_delay, message_id, content in rows:
+                dialog = dialogs.setdefault(dialog_id, {'dialog_id': dialog_id, 'user_id': user_id,
+                                                        'pickup_delay': float(pickup_delay or 0), 'messages': []})
+                dialog['messages'].append({'message_id': message_id, 'content': content})
+            self.logger.info("AI воркер %s захватил %s диалог(ов)", worker_id, len(dialogs))
+            return list(dialogs.values())
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка захвата диалогов воркером %s: %s", worker_id, e)
+            return False
+
+    # снятие зависших флагов пачкой, семантика как в Database.reap_stale_flags
+    async def reap_stale_flags(self, timeout: float, limit: int) -> bool | list:
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*REAP_STALE_FLAGS.bind(timeout=timeout, limit=limit))
+            return [{'dialog_id': dialog_id, 'user_id': user_id, 'age': float(age) if age is not None else None}
+                    for dialog_id, user_id, age in rows]
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка снятия зависших флагов: %s", e)
+            return False
+
+    # выгрузка диалогов пользователя через курсор в транзакции, семантика как в Database.export_dialogs
+    async def export_dialogs(self, user_id: int, chunk_size: int) -> AsyncIterator[list | bool]:
+        try:
+            async with self.connection() as connection, connection.transaction(readonly=True):
+                cursor = await connection.cursor(*EXPORT_DIALOGS.bind(user_id=user_id))
+                while rows := await cursor.fetch(chunk_size):
+                    yield [tuple(row) for row in rows]
+            self.logger.info("Пользователь id:%s выгрузил диалоги", user_id)
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка выгрузки диалогов пользователя id:%s: %s", user_id, e)
+            yield False
+
+    # поиск по сообщениям пользователя, семантика как в Database.search_messages
+    async def search_messages(self, user_id: int, query: str, dialog_id: int | None, limit: int,
+                              offset: int) -> bool | list:
+        statement = SEARCH_MESSAGES[dialog_id is not None]
+        try:
+            async with self.connection() as connection:
+                rows = await connection.fetch(*statement.bind(
+                    query=query, user_id=user_id, dialog_id=dialog_id, limit=limit, offset=offset,
+                    options=HEADLINE_OPTIONS
+                ))
+            self.logger.info("Пользователь id:%s нашёл %s сообщение(й)", user_id, len(rows))
+            return [dict(row, rank=float(row['rank'])) for row in rows]
+        except DB_ERRORS as e:
+            self.logger.error("Ошибка поиска по сообщениям пользователя id:%s: %s", user_id, e)
+            return False
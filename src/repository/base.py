@@ -0,0 +1,116 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+
+class Repository(ABC):
+    """Интерфейс хранилища, с которым работает слой сервисов.
+
+    Реализации: Database (SQLAlchemy), AsyncpgDatabase (asyncpg), MemoryDatabase (в памяти процесса).
+    Ошибки хранилища не выбрасываются: методы пишут их в self.logger уровня ERROR и возвращают
+    False (None — у get_ai_response_flag и count_pending_dialogs). Бот — user_id=1.
+    """
+
+    logger = None
+
+    # открыть соединения (lifespan приложения)
+    @abstractmethod
+    async def connect(self) -> None: ...
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
+    # состояние пула соединений для /health и метрик, {} — пула нет
+    @abstractmethod
+    def pool_stats(self) -> dict: ...
+
+    # user_id по google_id, False — не найден
+    @abstractmethod
+    async def get_users(self, google_id: str) -> int | bool: ...
+
+    @abstractmethod
+    async def create_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool: ...
+
+    # создать или обновить пользователя по google_id, вернуть user_id
+    @abstractmethod
+    async def upsert_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool: ...
+
+    @abstractmethod
+    async def check_dialog_ownership(self, user_id: int, dialog_id: int) -> bool: ...
+
+    @abstractmethod
+    async def create_dialog(self, user_id: int, dialog_name: str) -> int | bool: ...
+
+    # удалить диалог вместе с сообщениями, False — не найден или чужой
+    @abstractmethod
+    async def delete_dialog(self, user_id: int, dialog_id: int) -> bool: ...
+
+    # [{dialog_id, dialog_name}] по возрастанию dialog_id
+    @abstractmethod
+    async def get_dialogs(self, user_id: int) -> list | bool: ...
+
+    @abstractmethod
+    async def insert_message(self, user_id: int, dialog_id: int, content: str) -> int | bool: ...
+
+    # JSON-массив [{message_id, role, content}] по возрастанию message_id: since — новее since,
+    # before/limit — последние limit до before, без параметров — вся история
+    @abstractmethod
+    async def get_dialog_json(self, user_id: int, dialog_id: int, before: int | None = None,
+                              since: int | None = None, limit: int | None = None) -> bool | str: ...
+
+    # [{given_name, family_name, picture}], пустой список — пользователя нет
+    @abstractmethod
+    async def get_user(self, user_id: int) -> bool | list: ...
+
+    @abstractmethod
+    async def update_name_chat(self, user_id: int, dialog_id: int, dialog_name: str) -> bool: ...
+
+    # владелец, установка снятого флага и запись сообщения атомарно: 'forbidden' | 'pending' | 'accepted'
+    @abstractmethod
+    async def submit_user_message(self, user_id: int, dialog_id: int, content: str) -> str | bool: ...
+
+    # ответы бота [(user_id, dialog_id, content)] и снятие флагов атомарно, True/False по каждому ответу
+    @abstractmethod
+    async def save_ai_replies(self, replies: list[tuple[int, int, str]]) -> bool | list: ...
+
+    # событие '<event>:<dialog_id>:<data>' для всех воркеров
+    @abstractmethod
+    async def notify_dialog(self, event: str, dialog_id: int, data: str = '') -> bool: ...
+
+    # флаг ожидания ответа AI, None — диалог не найден или чужой
+    @abstractmethod
+    async def get_ai_response_flag(self, user_id: int, dialog_id: int) -> bool | None: ...
+
+    # последнее сообщение user_id в диалоге: {'content'}
+    @abstractmethod
+    async def read_ai_message(self, user_id: int, dialog_id: int) -> bool | dict: ...
+
+    @abstractmethod
+    async def count_pending_dialogs(self) -> int | None: ...
+
+    # JSON-массив [{user_id, dialog_id, content}] сообщений пользователей в ожидающих диалогах
+    @abstractmethod
+    async def read_user_message_json(self) -> bool | str: ...
+
+    # захват ожидающих диалогов воркером на lease секунд:
+    # [{dialog_id, user_id, pickup_delay, messages: [{message_id, content}]}]
+    @abstractmethod
+    async def claim_dialogs(self, worker_id: str, limit: int, lease: float) -> bool | list: ...
+
+    # снять до limit флагов, висящих дольше timeout секунд без действующей аренды, старые — первыми:
+    # [{dialog_id, user_id, age}], age — сколько висел флаг (сек.)
+    @abstractmethod
+    async def reap_stale_flags(self, timeout: float, limit: int) -> bool | list: ...
+
+    # выгрузка всех диалогов пользователя пачками по chunk_size строк (dialog_id, dialog_name, message_id, role,
+    # content) по dialog_id и message_id; у диалога без сообщений одна строка с message_id = None.
+    # Ошибка — последняя пачка False
+    @abstractmethod
+    def export_dialogs(self, user_id: int, chunk_size: int) -> AsyncIterator[list | bool]: ...
+
+    # полнотекстовый поиск по сообщениям диалогов пользователя (или одного его диалога), по убыванию
+    # релевантности: [{message_id, dialog_id, dialog_name, role, rank, snippet}], совпадения в snippet — **слово**
+    @abstractmethod
+    async def search_messages(self, user_id: int, query: str, dialog_id: int | None, limit: int,
+                              offset: int) -> bool | list: ...
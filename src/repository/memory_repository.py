@@ -0,0 +1,384 @@
+import heapq
+import re
+import time
+from bisect import bisect_left, bisect_right
+from itertools import count, islice
+from typing import AsyncIterator, Callable
+
+import orjson
+
+from src.repository.base import Repository
+from src.utils.utils import get_logger
+
+BOT_USER_ID = 1
+# слова для поиска: буквы и цифры, без стемминга (в Postgres — конфигурация russian)
+WORD = re.compile(r'\w+')
+# фрагмент найденного сообщения: слов до первого совпадения и всего, как MinWords/MaxWords в Database
+SNIPPET_BEFORE = 5
+SNIPPET_WORDS = 30
+
+
+class MemoryDatabase(Repository):
+    """Репозиторий в памяти процесса: без сети и SQL, для тестов, профилирования сервисов и API
+    и демо-режима на одном узле (данные теряются при перезапуске и не видны другим воркерам).
+
+    Данные — словари по первичному ключу плюс индексы под запросы: google_id -> user_id,
+    диалоги пользователя, сообщения диалога списком по возрастанию message_id (срезы по since/before
+    через bisect), ожидающие ответа диалоги в порядке установки флага. Методы не уступают управление
+    event loop, поэтому каждый атомарен, как транзакция в Database. Семантика владельца, флагов,
+    захвата и порядка сообщений совпадает с Database; бот — user_id=1, как в миграции init.
+    Поиск — по инвертированному индексу слово -> {message_id: dialog_id}: все слова запроса без учёта
+    регистра, без стемминга и операторов websearch_to_tsquery; релевантность — число вхождений.
+
+    notify — куда доставлять notify_dialog (обычно DialogNotifier.wake): других воркеров нет,
+    событие сразу приходит в этот же процесс.
+    """
+
+    def __init__(self, notify: Callable[[str, int, str], None] | None = None):
+        self.notify = notify
+        self.user_ids = count(BOT_USER_ID + 1)
+        self.dialog_ids = count(1)
+        self.message_ids = count(1)
+        self.users: dict[int, dict] = {
+            BOT_USER_ID: {'mail': 'bot@deepbot', 'google_id': 'deepbot-bot', 'given_name': 'Deepbot',
+                          'family_name': None, 'picture': None},
+        }
+        self.users_by_google: dict[str, int] = {'deepbot-bot': BOT_USER_ID}
+        self.dialogs: dict[int, dict] = {}
+        # user_id -> dialog_id по возрастанию (dict как упорядоченное множество)
+        self.user_dialogs: dict[int, dict[int, None]] = {}
+        # dialog_id -> [(message_id, user_id, content)] по возрастанию message_id
+        self.messages: dict[int, list[tuple[int, int, str]]] = {}
+        # ожидающие ответа AI: dialog_id -> flagged_at, в порядке установки флага
+        self.pending: dict[int, float] = {}
+        # слово в нижнем регистре -> {message_id: dialog_id}
+        self.search_index: dict[str, dict[int, int]] = {}
+        self.logger = get_logger(__name__)
+
+    async def connect(self) -> None:
+        self.logger.info("Репозиторий в памяти: пользователей %s, диалогов %s", len(self.users), len(self.dialogs))
+
+    async def close(self) -> None:
+        pass
+
+    def pool_stats(self) -> dict:
+        return {}
+
+    def owned_dialog(self, user_id: int, dialog_id: int) -> dict | None:
+        dialog = self.dialogs.get(dialog_id)
+        if dialog is None or dialog['user_id'] != user_id:
+            return None
+        return dialog
+
+    def append_message(self, dialog_id: int, user_id: int, content: str) -> int:
+        message_id = next(self.message_ids)
+        self.messages[dialog_id].append((message_id, user_id, content))
+        for word in set(WORD.findall(content.lower())):
+            self.search_index.setdefault(word, {})[message_id] = dialog_id
+        return message_id
+
+    def unindex_messages(self, messages: list[tuple[int, int, str]]) -> None:
+        for message_id, _, content in messages:
+            for word in set(WORD.findall(content.lower())):
+                postings = self.search_index[word]
+                del postings[message_id]
+                if not postings:
+                    del self.search_index[word]
+
+    async def get_users(self, google_id: str) -> int | bool:
+        user_id = self.users_by_google.get(google_id)
+        if user_id is None:
+            self.logger.info("Пользователь с google_id='%s' не найден.", google_id)
+            return False
+        return user_id
+
+    async def create_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool:
+        if google_id in self.users_by_google:
+            self.logger.error("Ошибка при создании пользователя с почтой '%s': google_id занят", mail)
+            return False
+        user_id = next(self.user_ids)
+        self.users[user_id] = {'mail': mail, 'google_id': google_id, 'given_name': given_name,
+                               'family_name': family_name, 'picture': picture}
+        self.users_by_google[google_id] = user_id
+        self.logger.info("Пользователь с почтой '%s' успешно создан с user_id=%s", mail, user_id)
+        return user_id
+
+    async def upsert_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool:
+        user_id = self.users_by_google.get(google_id)
+        if user_id is None:
+            return await self.create_user(mail, google_id, given_name, family_name, picture)
+        self.users[user_id].update(mail=mail, given_name=given_name, family_name=family_name, picture=picture)
+        self.logger.info("Пользователь с почтой '%s' вошёл, user_id=%s", mail, user_id)
+        return user_id
+
+    async def check_dialog_ownership(self, user_id: int, dialog_id: int) -> bool:
+        if self.owned_dialog(user_id, dialog_id) is None:
+            self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s", user_id, dialog_id)
+            return False
+        return True
+
+    async def create_dialog(self, user_id: int, dialog_name: str) -> int | bool:
+        if user_id not in self.users:
+            self.logger.error("Ошибка при создании диалога. Пользователь id:%s не найден", user_id)
+            return False
+        dialog_id = next(self.dialog_ids)
+        self.dialogs[dialog_id] = {
+            'user_id': user_id,
+            'dialog_name': dialog_name,
+            'status_flag': False,
+            'flagged_at': None,
+            'claimed_by': None,
+            'claim_expires_at': None,
+            'acked_message_id': 0,
+        }
+        self.user_dialogs.setdefault(user_id, {})[dialog_id] = None
+        self.messages[dialog_id] = []
+        self.logger.info("Пользователь id:%s успешно создал диалог id:%s", user_id, dialog_id)
+        return dialog_id
+
+    async def delete_dialog(self, user_id: int, dialog_id: int) -> bool:
+        if self.owned_dialog(user_id, dialog_id) is None:
+            self.logger.warning("Диалог id:%s не найден или не принадлежит пользователю id:%s", dialog_id, user_id)
+            return False
+        del self.dialogs[dialog_id]
+        del self.user_dialogs[user_id][dialog_id]
+        self.unindex_messages(self.messages.pop(dialog_id))
+        self.pending.pop(dialog_id, None)
+        self.logger.info("Пользователь id:%s удалил диалог id:%s", user_id, dialog_id)
+        return True
+
+    async def get_dialogs(self, user_id: int) -> list | bool:
+        dialogs = [
+            {'dialog_id': dialog_id, 'dialog_name': self.dialogs[dialog_id]['dialog_name']}
+            for dialog_id in self.user_dialogs.get(user_id, ())
+        ]
+        self.logger.info("Получено %s диалог(ов) пользователя id:%s", len(dialogs), user_id)
+        return dialogs
+
+    async def insert_message(self, user_id: int, dialog_id: int, content: str) -> int | bool:
+        if dialog_id not in self.dialogs or user_id not in self.users:
+            self.logger.error("Ошибка при записи сообщения пользователя id:%s: диалог id:%s не найден",
+                              user_id, dialog_id)
+            return False
+        message_id = self.append_message(dialog_id, user_id, content)
+        self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s", user_id, message_id, dialog_id)
+        return message_id
+
+    # как в Database, владелец здесь не проверяется (это делает сервис); чужой или удалённый диалог — '[]'
+    async def get_dialog_json(self, user_id: int, dialog_id: int, before: int | None = None,
+                              since: int | None = None, limit: int | None = None) -> bool | str:
+        messages = self.messages.get(dialog_id, [])
+        if since is not None:
+            start = bisect_right(messages, since, key=lambda message: message[0])
+            page = messages[start:start + limit] if limit is not None else messages[start:]
+        else:
+            end = bisect_left(messages, before, key=lambda message: message[0]) if before is not None else None
+            page = messages[:end]
+            if limit is not None:
+                page = page[-limit:]
+        self.logger.info("Пользователь:%s получил сообщения диалога id:%s", user_id, dialog_id)
+        return orjson.dumps([
+            {'message_id': message_id, 'role': 'bot' if author == BOT_USER_ID else 'user', 'content': content}
+            for message_id, author, content in page
+        ]).decode()
+
+    async def get_user(self, user_id: int) -> bool | list:
+        user = self.users.get(user_id)
+        self.logger.info("Пользователь:%s получил дату для /me", user_id)
+        if user is None:
+            return []
+        return [{'given_name': user['given_name'], 'family_name': user['family_name'], 'picture': user['picture']}]
+
+    async def update_name_chat(self, user_id: int, dialog_id: int, dialog_name: str) -> bool:
+        dialog = self.owned_dialog(user_id, dialog_id)
+        if dialog is None:
+            self.logger.warning("Не найден диалог %s для переименования пользователем %s", dialog_id, user_id)
+            return False
+        dialog['dialog_name'] = dialog_name
+        self.logger.info("Пользователь id:%s переименовал диалог id:%s в '%s'", user_id, dialog_id, dialog_name)
+        return True
+
+    async def submit_user_message(self, user_id: int, dialog_id: int, content: str) -> str | bool:
+        dialog = self.owned_dialog(user_id, dialog_id)
+        if dialog is None:
+            self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s", user_id, dialog_id)
+            return 'forbidden'
+        if dialog['status_flag']:
+            self.logger.info("Диалог id:%s уже ожидает ответа AI", dialog_id)
+            return 'pending'
+        now = time.time()
+        dialog.update(status_flag=True, flagged_at=now, claimed_by=None, claim_expires_at=None)
+        self.pending[dialog_id] = now
+        message_id = self.append_message(dialog_id, user_id, content)
+        self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s", user_id, message_id, dialog_id)
+        return 'accepted'
+
+    # ответ сохраняется, если диалог существует и принадлежит user_id; флаг снимается в любом случае
+    async def save_ai_replies(self, replies: list[tuple[int, int, str]]) -> bool | list:
+        saved = []
+        for user_id, dialog_id, content in replies:
+            dialog = self.owned_dialog(user_id, dialog_id)
+            if dialog is None:
+                saved.append(False)
+                continue
+            message_id = self.append_message(dialog_id, BOT_USER_ID, content)
+            dialog.update(status_flag=False, flagged_at=None, claimed_by=None, claim_expires_at=None,
+                          acked_message_id=message_id)
+            self.pending.pop(dialog_id, None)
+            saved.append(True)
+        self.logger.info("AI записал %s из %s ответ(ов)", sum(saved), len(replies))
+        return saved
+
+    async def notify_dialog(self, event: str, dialog_id: int, data: str = '') -> bool:
+        if self.notify is not None:
+            self.notify(event, dialog_id, data)
+        return True
+
+    async def get_ai_response_flag(self, user_id: int, dialog_id: int) -> bool | None:
+        dialog = self.owned_dialog(user_id, dialog_id)
+        if dialog is None:
+            self.logger.warning("Флаг не найден для диалога %s пользователя %s", dialog_id, user_id)
+            return None
+        self.logger.info("Пользователь %s получил флаг: %s", user_id, dialog['status_flag'])
+        return dialog['status_flag']
+
+    async def read_ai_message(self, user_id: int, dialog_id: int) -> bool | dict:
+        for _, author, content in reversed(self.messages.get(dialog_id, ())):
+            if author == user_id:
+                self.logger.info("Пользователь %s получил последнее сообщение", user_id)
+                return {'content': content}
+        self.logger.warning("Последние сообщение: %s в диалоге: %s не найдено", user_id, dialog_id)
+        return False
+
+    async def count_pending_dialogs(self) -> int | None:
+        return len(self.pending)
+
+    async def read_user_message_json(self) -> bool | str:
+        # слияние уже упорядоченных списков диалогов — общий порядок по message_id
+        messages = heapq.merge(*(
+            [(message_id, author, dialog_id, content) for message_id, author, content in self.messages[dialog_id]]
+            for dialog_id in self.pending
+        ))
+        self.logger.info("AI:получил диалоги")
+        return orjson.dumps([
+            {'user_id': author, 'dialog_id': dialog_id, 'content': content}
+            for _, author, dialog_id, content in messages if author != BOT_USER_ID
+        ]).decode()
+
+    async def claim_dialogs(self, worker_id: str, limit: int, lease: float) -> bool | list:
+        now = time.time()
+        dialogs = []
+        for dialog_id, flagged_at in self.pending.items():
+            if len(dialogs) >= limit:
+                break
+            dialog = self.dialogs[dialog_id]
+            if dialog['claim_expires_at'] is not None and dialog['claim_expires_at'] >= now:
+                continue
+            messages = self.messages[dialog_id]
+            start = bisect_right(messages, dialog['acked_message_id'], key=lambda message: message[0])
+            new_messages = [
+                {'message_id': message_id, 'content': content}
+                for message_id, author, content in messages[start:] if author != BOT_USER_ID
+            ]
+            if not new_messages:
+                continue
+            dialog.update(claimed_by=worker_id, claim_expires_at=now + lease)
+            dialogs.append({
+                'dialog_id': dialog_id,
+                'user_id': dialog['user_id'],
+                'pickup_delay': now - flagged_at,
+                'messages': new_messages,
+            })
+        # как ORDER BY claimed.dialog_id в Database
+        dialogs.sort(key=lambda dialog: dialog['dialog_id'])
+        self.logger.info("AI воркер %s захватил %s диалог(ов)", worker_id, len(dialogs))
+        return dialogs
+
+    async def reap_stale_flags(self, timeout: float, limit: int) -> bool | list:
+        now = time.time()
+        reaped = []
+        # pending упорядочен по времени флага: после первого свежего старых уже нет
+        for dialog_id, flagged_at in self.pending.items():
+            if len(reaped) >= limit or now - flagged_at <= timeout:
+                break
+            dialog = self.dialogs[dialog_id]
+            if dialog['claim_expires_at'] is not None and dialog['claim_expires_at'] >= now:
+                continue
+            reaped.append({'dialog_id': dialog_id, 'user_id': dialog['user_id'], 'age': now - flagged_at})
+        for stale in reaped:
+            self.dialogs[stale['dialog_id']].update(status_flag=False, flagged_at=None, claimed_by=None,
+                                                    claim_expires_at=None)
+            self.pending.pop(stale['dialog_id'])
+        return reaped
+
+    # между пачками уступает event loop: удалённые за это время диалоги пропускаются,
+    # сообщения диалога — те, что были, когда до него дошла выгрузка
+    async def export_dialogs(self, user_id: int, chunk_size: int) -> AsyncIterator[list | bool]:
+        rows = []
+        for dialog_id in list(self.user_dialogs.get(user_id, ())):
+            dialog = self.dialogs.get(dialog_id)
+            if dialog is None:
+                continue
+            messages = self.messages[dialog_id]
+            if not messages:
+                rows.append((dialog_id, dialog['dialog_name'], None, None, None))
+            for message_id, author, content in islice(messages, len(messages)):
+                rows.append((dialog_id, dialog['dialog_name'], message_id,
+                             'bot' if author == BOT_USER_ID else 'user', content))
+                if len(rows) >= chunk_size:
+                    yield rows
+                    rows = []
+            if len(rows) >= chunk_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+        self.logger.info("Пользователь id:%s выгрузил диалоги", user_id)
+
+    async def search_messages(self, user_id: int, query: str, dialog_id: int | None, limit: int,
+                              offset: int) -> bool | list:
+        words = set(WORD.findall(query.lower()))
+        owned = self.user_dialogs.get(user_id, {})
+        # пересечение списков слов от самого короткого
+        postings = sorted((self.search_index.get(word, {}) for word in words), key=len)
+        hits = []
+        if postings:
+            for message_id, found_dialog in postings[0].items():
+                if found_dialog not in owned or (dialog_id is not None and found_dialog != dialog_id):
+                    continue
+                if all(message_id in other for other in postings[1:]):
+                    hits.append((message_id, found_dialog))
+        results = []
+        for message_id, found_dialog in hits:
+            messages = self.messages[found_dialog]
+            _, author, content = messages[bisect_left(messages, message_id, key=lambda message: message[0])]
+            rank = sum(1 for word in WORD.findall(content.lower()) if word in words)
+            results.append({'message_id': message_id, 'dialog_id': found_dialog,
+                            'dialog_name': self.dialogs[found_dialog]['dialog_name'],
+                            'role': 'bot' if author == BOT_USER_ID else 'user', 'rank': float(rank),
+                            'content': content})
+        results.sort(key=lambda result: (result['rank'], result['message_id']), reverse=True)
+        page = results[offset:offset + limit]
+        for result in page:
+            result['snippet'] = snippet(result.pop('content'), words)
+        self.logger.info("Пользователь id:%s нашёл %s сообщение(й)", user_id, len(page))
+        return page
+
+
+# до SNIPPET_WORDS слов вокруг первого совпадения, совпадения выделены ** (как ts_headline в Database)
+def snippet(content: str, words: set[str]) -> str:
+    matches = list(WORD.finditer(content))
+    first = next((i for i, match in enumerate(matches) if match.group().lower() in words), 0)
+    window = matches[max(first - SNIPPET_BEFORE, 0):max(first - SNIPPET_BEFORE, 0) + SNIPPET_WORDS]
+    if not window:
+        return content[:200]
+    parts = []
+    position = window[0].start()
+    for match in window:
+        parts.append(content[position:match.start()])
+        word = match.group()
+        parts.append(f'**{word}**' if word.lower() in words else word)
+        position = match.end()
+    return ''.join(parts)
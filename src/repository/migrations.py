@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.core.config import DATABASE_HOST, DATABASE_PORT, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD
+from src.repository.repository import (
+    Database, HEADLINE_OPTIONS, dialog_json_query, GET_USERS_QUERY, CREATE_USER_QUERY, UPSERT_USER_QUERY,
+    CHECK_DIALOG_OWNERSHIP_QUERY, CREATE_DIALOG_QUERY, DELETE_DIALOG_QUERY, GET_DIALOGS_QUERY, INSERT_MESSAGE_QUERY,
+    GET_USER_QUERY, UPDATE_NAME_CHAT_QUERY, SUBMIT_USER_MESSAGE_QUERY, SUBMIT_NOTIFY, SAVE_AI_REPLIES_QUERY,
+    SAVE_AI_REPLIES_NOTIFY, NOTIFY_DIALOG_QUERY, GET_AI_RESPONSE_FLAG_QUERY, READ_AI_MESSAGE_QUERY,
+    COUNT_PENDING_DIALOGS_QUERY, READ_USER_MESSAGE_JSON_QUERY, CLAIM_DIALOGS_QUERY, REAP_STALE_FLAGS_QUERY,
+    EXPORT_DIALOGS_QUERY, SEARCH_MESSAGES_ALL, SEARCH_MESSAGES_DIALOG,
+)
+from src.utils.utils import get_logger
+
+logger = get_logger(__name__)
+
+# ключ pg_advisory_xact_lock: миграции не применяются параллельно несколькими воркерами
+MIGRATIONS_LOCK_ID = 727_001
+
+# (версия, имя, список DDL). Каждый запрос — отдельная команда: asyncpg не выполняет несколько
+# команд в одном prepared statement. Уже применённые миграции не меняются — только новые версии.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, 'init', [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGSERIAL PRIMARY KEY,
+            mail TEXT NOT NULL,
+            google_id TEXT NOT NULL UNIQUE,
+            given_name TEXT,
+            family_name TEXT,
+            picture TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dialogs (
+            dialog_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            dialog_name VARCHAR(20) NOT NULL,
+            status_flag BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id BIGSERIAL PRIMARY KEY,
+            dialog_id BIGINT NOT NULL REFERENCES dialogs(dialog_id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            content TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        # очередь AI воркеров (для баз, созданных по старой схеме из README)
+        """
+        ALTER TABLE dialogs
+            ADD COLUMN IF NOT EXISTS flagged_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+            ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS acked_message_id BIGINT NOT NULL DEFAULT 0
+        """,
+        # бот в системе = user_id=1
+        """
+        INSERT INTO users(user_id, mail, google_id, given_name)
+        VALUES (1, 'bot@deepbot', 'deepbot-bot', 'Deepbot')
+        ON CONFLICT DO NOTHING
+        """,
+        "SELECT setval('users_user_id_seq', GREATEST((SELECT MAX(user_id) FROM users), 1))",
+    ]),
+    (2, 'query_indexes', [
+        # get_dialog (keyset по message_id), check/claim: новые сообщения после acked_message_id
+        "CREATE INDEX IF NOT EXISTS messages_dialog_id_message_id_idx ON messages(dialog_id, message_id)",
+        # read_ai_message: последнее сообщение бота в диалоге
+        "CREATE INDEX IF NOT EXISTS messages_dialog_id_user_id_message_id_idx "
+        "ON messages(dialog_id, user_id, message_id)",
+        # get_dialogs, check_dialog_ownership, delete/rename по (user_id, dialog_id)
+        "CREATE INDEX IF NOT EXISTS dialogs_user_id_dialog_id_idx ON dialogs(user_id, dialog_id)",
+        # read_user_message, claim_dialogs: только ожидающие ответа диалоги, старые первыми
+        "CREATE INDEX IF NOT EXISTS dialogs_pending_flagged_at_idx ON dialogs(flagged_at) WHERE status_flag",
+    ]),
+    (3, 'message_search', [
+        # search_messages: tsvector сообщения (конфигурация russian: русские слова — russian_stem, латиница —
+        # english_stem). Только быстрые команды: столбец без DEFAULT не переписывает таблицу (ACCESS EXCLUSIVE
+        # на миг), новые и изменённые сообщения заполняет триггер. Старые строки и GIN-индекс — онлайн-миграция 4
+        # (ONLINE_MIGRATIONS), не при старте. Генерируемый STORED столбец здесь переписал бы всю messages под
+        # ACCESS EXCLUSIVE: старт висит, запись сообщений стоит до конца.
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector",
+        """
+        CREATE OR REPLACE FUNCTION messages_content_tsv() RETURNS trigger AS $$
+        BEGIN
+            NEW.content_tsv := to_tsvector('russian'::regconfig, NEW.content);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS messages_content_tsv ON messages",
+        """
+        CREATE TRIGGER messages_content_tsv BEFORE INSERT OR UPDATE OF content ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_content_tsv()
+        """,
+    ]),
+]
+
+# ключ сессионного advisory lock онлайн-миграций: не выполняются параллельно
+ONLINE_LOCK_ID = 727_002
+
+
+# заполнить content_tsv старых сообщений пачками по message_id (каждая пачка — своя короткая транзакция,
+# блокируются только строки пачки), затем GIN-индекс CREATE INDEX CONCURRENTLY — без блокировки записи
+async def build_message_search(engine: AsyncEngine, conn: AsyncConnection, batch: int) -> None:
+    upto = (await conn.execute(text("SELECT COALESCE(MAX(message_id), 0) FROM messages"))).scalar()
+    after = 0
+    while after < upto:
+        async with engine.begin() as batch_conn:
+            await batch_conn.execute(text("""
+                UPDATE messages SET content_tsv = to_tsvector('russian'::regconfig, content)
+                WHERE message_id > :after AND message_id <= :after + :batch AND content_tsv IS NULL
+            """), {'after': after, 'batch': batch})
+        after += batch
+        logger.info("content_tsv заполнен до message_id %s из %s", min(after, upto), upto)
+    # прерванная сборка оставляет невалидный индекс, IF NOT EXISTS его бы пропустил
+    valid = (await conn.execute(text("""
+        SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('messages_content_tsv_idx')
+    """))).scalar()
+    if valid is False:
+        await conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS messages_content_tsv_idx"))
+    await conn.execute(text(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_content_tsv_idx ON messages USING GIN (content_tsv)"
+    ))
+
+
+# (версия, имя, шаг, чего нет до применения) — долгие миграции вне транзакции и вне старта приложения:
+# python -m ... online
+ONLINE_MIGRATIONS: list[tuple[int, str, Callable[[AsyncEngine, AsyncConnection, int], Awaitable[None]], str]] = [
+    (4, 'message_search_index', build_message_search,
+     "content_tsv старых сообщений не заполнен и GIN-индекса нет: поиск не находит сообщения, записанные "
+     "до миграции 3, и читает messages целиком"),
+]
+
+# запросы репозитория для проверки планов: те же строки SQL, что выполняет Database, со всеми вариантами,
+# которые выдают эндпоинты, и параметрами-образцами; новый запрос в repository.py — добавить сюда
+USER = {'user_id': 2}
+DIALOG = {'user_id': 2, 'dialog_id': 1}
+NEW_USER = {'mail': 'check@x', 'google_id': 'check-1', 'given_name': 'x', 'family_name': 'x', 'picture': ''}
+REPLIES = {'user_ids': [2], 'dialog_ids': [1], 'contents': ['check'], 'channel': 'check'}
+SEARCH = {'query': 'check', 'user_id': 2, 'dialog_id': 1, 'limit': 21, 'offset': 0, 'options': HEADLINE_OPTIONS}
+EXPLAIN_QUERIES: dict[str, tuple[str, dict]] = {
+    'get_users': (GET_USERS_QUERY, {'google_id': 'check-1'}),
+    'create_user': (CREATE_USER_QUERY, NEW_USER),
+    'upsert_user': (UPSERT_USER_QUERY, NEW_USER),
+    'check_dialog_ownership': (CHECK_DIALOG_OWNERSHIP_QUERY, DIALOG),
+    'create_dialog': (CREATE_DIALOG_QUERY, {'user_id': 2, 'dialog_name': 'check'}),
+    'delete_dialog': (DELETE_DIALOG_QUERY, DIALOG),
+    'get_dialogs': (GET_DIALOGS_QUERY, USER),
+    'insert_message': (INSERT_MESSAGE_QUERY, {**DIALOG, 'content': 'check'}),
+    # get_dialog_json: вся история, хвост (контекст AI, первая страница), страница до before, новые после since
+    'get_dialog_json_all': (dialog_json_query(False, False, False), {'dialog_id': 1}),
+    'get_dialog_json_tail': (dialog_json_query(False, False, True), {'dialog_id': 1, 'limit': 50}),
+    'get_dialog_json_before': (dialog_json_query(True, False, False), {'dialog_id': 1, 'before': 100}),
+    'get_dialog_json_before_limit': (dialog_json_query(True, False, True),
+                                     {'dialog_id': 1, 'before': 100, 'limit': 50}),
+    'get_dialog_json_since': (dialog_json_query(False, True, False), {'dialog_id': 1, 'since': 100}),
+    'get_dialog_json_since_limit': (dialog_json_query(False, True, True),
+                                    {'dialog_id': 1, 'since': 100, 'limit': 50}),
+    'get_user': (GET_USER_QUERY, USER),
+    'update_name_chat': (UPDATE_NAME_CHAT_QUERY, {**DIALOG, 'dialog_name': 'check'}),
+    'submit_user_message': (SUBMIT_USER_MESSAGE_QUERY.format(notify=''), {**DIALOG, 'content': 'check'}),
+    'submit_user_message_notify': (SUBMIT_USER_MESSAGE_QUERY.format(notify=SUBMIT_NOTIFY),
+                                   {**DIALOG, 'content': 'check', 'channel': 'check'}),
+    'save_ai_replies': (SAVE_AI_REPLIES_QUERY.format(notify=''), REPLIES),
+    'save_ai_replies_notify': (SAVE_AI_REPLIES_QUERY.format(notify=SAVE_AI_REPLIES_NOTIFY), REPLIES),
+    'notify_dialog': (NOTIFY_DIALOG_QUERY, {'channel': 'check', 'payload': 'check:1:'}),
+    'get_ai_response_flag': (GET_AI_RESPONSE_FLAG_QUERY, DIALOG),
+    'read_ai_message': (READ_AI_MESSAGE_QUERY, {'user_id': 1, 'dialog_id': 1}),
+    'count_pending_dialogs': (COUNT_PENDING_DIALOGS_QUERY, {}),
+    'read_user_message_json': (READ_USER_MESSAGE_JSON_QUERY, {}),
+    'claim_dialogs': (CLAIM_DIALOGS_QUERY, {'worker_id': 'check', 'limit': 10, 'lease': 60}),
+    'reap_stale_flags': (REAP_STALE_FLAGS_QUERY, {'timeout': 600, 'limit': 500}),
+    'export_dialogs': (EXPORT_DIALOGS_QUERY, USER),
+    'search_messages': (SEARCH_MESSAGES_ALL, SEARCH),
+    'search_messages_dialog': (SEARCH_MESSAGES_DIALOG, SEARCH),
+}
+
+
+# синтетический объём для check: на пустых таблицах планировщик выбирает планы, которых не будет
+# в проде; данные и статистика ANALYZE откатываются вместе с транзакцией проверки
+SEED_QUERIES: list[str] = [
+    "INSERT INTO users(mail, google_id) SELECT 'check-' || g, 'check-' || g FROM generate_series(1, 2000) g",
+    """
+    INSERT INTO dialogs(user_id, dialog_name, status_flag, flagged_at)
+    SELECT users.user_id, 'check', g % 100 = 0, CASE WHEN g % 100 = 0 THEN NOW() END
+    FROM users, generate_series(1, 5) g
+    WHERE users.google_id LIKE 'check-%'
+    """,
+    """
+    INSERT INTO messages(dialog_id, user_id, content)
+    SELECT dialogs.dialog_id, CASE WHEN g % 2 = 0 THEN 1 ELSE dialogs.user_id END, 'check'
+    FROM dialogs, generate_series(1, 20) g
+    """,
+    "ANALYZE users",
+    "ANALYZE dialogs",
+    "ANALYZE messages",
+]
+
+
+# применить новые миграции одной транзакцией, вернуть список применённых версий
+async def migrate(engine: AsyncEngine) -> list[int]:
+    applied = []
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {'lock_id': MIGRATIONS_LOCK_ID})
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """))
+        result = await conn.execute(text("SELECT version FROM schema_migrations"))
+        done = set(result.scalars().all())
+        for version, name, statements in MIGRATIONS:
+            if version in done:
+                continue
+            for statement in statements:
+                await conn.execute(text(statement))
+            await conn.execute(
+                text("INSERT INTO schema_migrations(version, name) VALUES(:version, :name)"),
+                {'version': version, 'name': name}
+            )
+            logger.info("Применена миграция %s_%s", version, name)
+            applied.append(version)
+    for version, name, _, missing in ONLINE_MIGRATIONS:
+        if version not in done:
+            logger.warning("Не применена онлайн-миграция %s_%s: %s. Выполнить: python -m src.repository.migrations "
+                           "online", version, name, missing)
+    return applied
+
+
+# применить онлайн-миграции (после обычных): соединение в autocommit держит сессионный advisory lock,
+# шаг сам решает, какие команды в транзакциях; версия записывается после успешного шага
+async def migrate_online(engine: AsyncEngine, batch: int) -> list[int]:
+    applied = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        await conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {'lock_id': ONLINE_LOCK_ID})
+        try:
+            result = await conn.execute(text("SELECT version FROM schema_migrations"))
+            done = set(result.scalars().all())
+            for version, name, step, _ in ONLINE_MIGRATIONS:
+                if version in done:
+                    continue
+                await step(engine, conn, batch)
+                await conn.execute(
+                    text("INSERT INTO schema_migrations(version, name) VALUES(:version, :name)"),
+                    {'version': version, 'name': name}
+                )
+                logger.info("Применена онлайн-миграция %s_%s", version, name)
+                applied.append(version)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {'lock_id': ONLINE_LOCK_ID})
+    return applied
+
+
+# миграции на отдельном соединении: не зависят от выбранной реализации репозитория приложения
+async def upgrade() -> list[int]:
+    db = Database(host=DATABASE_HOST, port=DATABASE_PORT, dbname=DATABASE_NAME,
+                  user=DATABASE_USER, password=DATABASE_PASSWORD, pool_size=1)
+    await db.connect()
+    try:
+        return await migrate(db.engine)
+    finally:
+        await db.close()
+
+
+# Seq Scan или полный проход индекса без условия (с выключенным seqscan планировщик обходит
+# индекс целиком вместо таблицы); частичные индексы без условия допустимы — они уже отфильтрованы
+def find_full_scans(plan: dict, partial_indexes: set[str]) -> list[str]:
+    found = []
+    node_type = plan.get('Node Type')
+    if node_type == 'Seq Scan':
+        found.append(f"Seq Scan {plan.get('Relation Name')}")
+    elif (node_type in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in plan
+          and plan.get('Index Name') not in partial_indexes):
+        found.append(f"{node_type} {plan.get('Index Name')} без условия")
+    for child in plan.get('Plans', []):
+        found.extend(find_full_scans(child, partial_indexes))
+    return found
+
+
+# EXPLAIN каждого запроса репозитория, вернуть {метод: [полные проходы]} для провалившихся
+async def check_query_plans(engine: AsyncEngine, seed: bool = True) -> dict[str, list[str]]:
+    failures = {}
+    async with engine.connect() as conn:
+        if seed:
+            for query in SEED_QUERIES:
+                await conn.execute(text(query))
+        result = await conn.execute(text("""
+            SELECT indexrelid::regclass::text FROM pg_index WHERE indpred IS NOT NULL
+        """))
+        partial_indexes = set(result.scalars().all())
+        await conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, (query, params) in EXPLAIN_QUERIES.items():
+            result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params)
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            full_scans = find_full_scans(plan[0]['Plan'], partial_indexes)
+            if full_scans:
+                failures[name] = full_scans
+        await conn.rollback()
+    return failures
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('command', choices=['upgrade', 'online', 'check'],
+                        help="upgrade — применить миграции, online — долгие онлайн-миграции (после upgrade), "
+                             "check — проверить планы запросов (EXPLAIN)")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="check без синтетических данных (на наполненной базе)")
+    parser.add_argument('--batch', type=int, default=10000,
+                        help="online: строк в одной транзакции заполнения")
+    args = parser.parse_args()
+
+    if args.command == 'upgrade':
+        try:
+            applied = await upgrade()
+        except SQLAlchemyError as e:
+            logger.error("Ошибка миграций: %s", e)
+            return 1
+        print(f"Применено миграций: {len(applied)} {applied}")
+        return 0
+
+    db = Database(host=DATABASE_HOST, port=DATABASE_PORT, dbname=DATABASE_NAME,
+                  user=DATABASE_USER, password=DATABASE_PASSWORD, pool_size=1)
+    await db.connect()
+    try:
+        if args.command == 'online':
+            applied = await migrate_online(db.engine, args.batch)
+            print(f"Применено онлайн-миграций: {len(applied)} {applied}")
+            return 0
+        failures = await check_query_plans(db.engine, seed=not args.no_seed)
+        for name, scans in failures.items():
+            print(f"FAIL {name}: {'; '.join(scans)}")
+        print(f"Проверено запросов: {len(EXPLAIN_QUERIES)}, без индекса: {len(failures)}")
+        return 1 if failures else 0
+    except SQLAlchemyError as e:
+        logger.error("Ошибка миграций: %s", e)
+        return 1
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
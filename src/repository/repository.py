@@ -1,29 +1,471 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import AsyncIterator
+
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.exc import SQLAlchemyError
+from src.repository.base import Repository
 from src.utils.utils import get_logger
 
 
-class Database:
-    def __init__(self, host, port, dbname, user, password):
-        self.engine = create_async_engine(
-            f'postgresql+asyncpg://{user}:{password}@{host}:{port}/{dbname}',
-            echo=False
-        )
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, считающий время ожидания свободного соединения."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_count += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+# логгер пула SQLAlchemy назван по модулю класса — не наследовать INFO логгера репозитория
+logging.getLogger(f"{__name__}.TimedQueuePool").setLevel(logging.WARNING)
+
+
+# фрагменты найденного сообщения: до двух отрывков по 10–30 слов, совпадения выделены **
+HEADLINE_OPTIONS = 'StartSel=**, StopSel=**, MinWords=10, MaxWords=30, MaxFragments=2, FragmentDelimiter=" … "'
+
+
+# страница сообщений {page} -> JSON-массив [{message_id, role, content}] по возрастанию message_id
+DIALOG_JSON_QUERY = """
+    SELECT COALESCE(json_agg(json_build_object(
+        'message_id', page.message_id,
+        'role', CASE WHEN page.user_id = 1 THEN 'bot' ELSE 'user' END,
+        'content', page.content
+    ) ORDER BY page.message_id), '[]')::text
+    FROM ({page}) AS page
+"""
+
+
+# страница сообщений get_dialog_json: since — новее since по возрастанию, before/limit — последние limit
+# до before, без параметров — вся история (флаги — какие параметры заданы)
+def dialog_json_query(before: bool, since: bool, limit: bool) -> str:
+    page = "SELECT message_id, user_id, content FROM messages WHERE dialog_id = :dialog_id"
+    if since:
+        page += " AND message_id > :since ORDER BY message_id"
+    elif before or limit:
+        page += (" AND message_id < :before" if before else "") + " ORDER BY message_id DESC"
+    if limit:
+        page += " LIMIT :limit"
+    return DIALOG_JSON_QUERY.format(page=page)
+
+
+# SQL методов Database и (через Statement с $N) AsyncpgDatabase; те же строки проверяет migrations.py
+# (EXPLAIN_QUERIES)
+GET_USERS_QUERY = """
+    SELECT user_id FROM users
+    WHERE google_id = :google_id;
+"""
+CREATE_USER_QUERY = """
+    INSERT INTO users(mail, google_id, given_name, family_name, picture)
+    VALUES(:mail, :google_id, :given_name, :family_name, :picture)
+    RETURNING user_id;
+"""
+UPSERT_USER_QUERY = """
+    INSERT INTO users(mail, google_id, given_name, family_name, picture)
+    VALUES(:mail, :google_id, :given_name, :family_name, :picture)
+    ON CONFLICT (google_id) DO UPDATE
+    SET mail = EXCLUDED.mail,
+        given_name = EXCLUDED.given_name,
+        family_name = EXCLUDED.family_name,
+        picture = EXCLUDED.picture
+    RETURNING user_id;
+"""
+CHECK_DIALOG_OWNERSHIP_QUERY = """
+    SELECT dialog_id FROM dialogs
+    WHERE user_id = :user_id AND dialog_id = :dialog_id
+"""
+CREATE_DIALOG_QUERY = """
+    INSERT INTO dialogs(user_id, dialog_name)
+    VALUES(:user_id, :dialog_name)
+    RETURNING dialog_id;
+"""
+DELETE_DIALOG_QUERY = """
+    DELETE FROM dialogs
+    WHERE user_id = :user_id AND dialog_id = :dialog_id;
+"""
+GET_DIALOGS_QUERY = """
+    SELECT dialog_id, dialog_name
+    FROM dialogs
+    WHERE user_id = :user_id
+    ORDER BY dialog_id;
+"""
+INSERT_MESSAGE_QUERY = """
+    INSERT INTO messages(dialog_id, user_id, content)
+    VALUES(:dialog_id, :user_id, :content)
+    RETURNING message_id
+"""
+GET_USER_QUERY = """
+    SELECT given_name, family_name, picture FROM users
+    WHERE user_id = :user_id
+"""
+UPDATE_NAME_CHAT_QUERY = """
+    UPDATE dialogs
+    SET dialog_name = :dialog_name
+    WHERE user_id = :user_id AND dialog_id = :dialog_id
+    RETURNING dialog_id
+"""
+# {notify} — SUBMIT_NOTIFY при notify_channel, иначе пусто
+SUBMIT_USER_MESSAGE_QUERY = """
+    WITH owned AS (
+        SELECT dialog_id FROM dialogs
+        WHERE user_id = :user_id AND dialog_id = :dialog_id
+    ), flagged AS (
+        UPDATE dialogs
+        SET status_flag = true,
+            flagged_at = NOW(),
+            claimed_by = NULL,
+            claim_expires_at = NULL
+        WHERE user_id = :user_id AND dialog_id = :dialog_id AND status_flag = false
+        RETURNING dialog_id{notify}
+    ), inserted AS (
+        INSERT INTO messages(dialog_id, user_id, content)
+        SELECT dialog_id, :user_id, :content FROM flagged
+        RETURNING message_id
+    )
+    SELECT EXISTS (SELECT 1 FROM owned) AS owned, (SELECT message_id FROM inserted) AS message_id
+"""
+SUBMIT_NOTIFY = ", pg_notify(:channel, 'pending:' || dialog_id)"
+# {notify} — SAVE_AI_REPLIES_NOTIFY при notify_channel, иначе пусто
+SAVE_AI_REPLIES_QUERY = """
+    WITH input AS (
+        SELECT * FROM unnest(
+            CAST(:user_ids AS BIGINT[]), CAST(:dialog_ids AS BIGINT[]), CAST(:contents AS TEXT[])
+        ) WITH ORDINALITY AS t(user_id, dialog_id, content, position)
+    ), valid AS (
+        SELECT input.* FROM input
+        JOIN dialogs ON dialogs.dialog_id = input.dialog_id AND dialogs.user_id = input.user_id
+    ), inserted AS (
+        INSERT INTO messages(dialog_id, user_id, content)
+        SELECT dialog_id, 1, content FROM valid
+        ORDER BY position
+        RETURNING message_id, dialog_id
+    ), updated AS (
+        UPDATE dialogs
+        SET status_flag = false,
+            flagged_at = NULL,
+            claimed_by = NULL,
+            claim_expires_at = NULL,
+            acked_message_id = last.message_id
+        FROM (SELECT dialog_id, MAX(message_id) AS message_id FROM inserted GROUP BY dialog_id) AS last
+        WHERE dialogs.dialog_id = last.dialog_id
+        RETURNING dialogs.dialog_id{notify}
+    )
+    SELECT input.position, updated.dialog_id IS NOT NULL AS saved
+    FROM input
+    LEFT JOIN valid ON valid.position = input.position
+    LEFT JOIN updated ON updated.dialog_id = valid.dialog_id
+    ORDER BY input.position
+"""
+SAVE_AI_REPLIES_NOTIFY = ", pg_notify(:channel, 'answer:' || dialogs.dialog_id)"
+NOTIFY_DIALOG_QUERY = """
+    SELECT pg_notify(:channel, :payload)
+"""
+GET_AI_RESPONSE_FLAG_QUERY = """
+    SELECT status_flag
+    FROM dialogs
+    WHERE user_id = :user_id AND dialog_id = :dialog_id
+"""
+READ_AI_MESSAGE_QUERY = """
+    SELECT content FROM messages
+    WHERE dialog_id = :dialog_id AND user_id = :user_id
+    ORDER BY message_id DESC
+    LIMIT 1
+"""
+COUNT_PENDING_DIALOGS_QUERY = """
+    SELECT COUNT(*) FROM dialogs WHERE status_flag = true
+"""
+READ_USER_MESSAGE_JSON_QUERY = """
+    SELECT COALESCE(json_agg(json_build_object(
+        'user_id', messages.user_id,
+        'dialog_id', messages.dialog_id,
+        'content', messages.content
+    ) ORDER BY messages.message_id), '[]')::text
+    FROM messages
+    JOIN dialogs ON messages.dialog_id = dialogs.dialog_id
+    WHERE dialogs.status_flag = true AND messages.user_id <> 1
+"""
+CLAIM_DIALOGS_QUERY = """
+    WITH picked AS (
+        SELECT dialog_id FROM dialogs
+        WHERE status_flag = true
+          AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+          AND EXISTS (
+              SELECT 1 FROM messages
+              WHERE messages.dialog_id = dialogs.dialog_id
+                AND messages.message_id > dialogs.acked_message_id
+                AND messages.user_id <> 1
+          )
+        ORDER BY flagged_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    ), claimed AS (
+        UPDATE dialogs
+        SET claimed_by = :worker_id,
+            claim_expires_at = NOW() + make_interval(secs => :lease)
+        FROM picked
+        WHERE dialogs.dialog_id = picked.dialog_id
+        RETURNING dialogs.dialog_id, dialogs.user_id, dialogs.acked_message_id,
+                  EXTRACT(EPOCH FROM NOW() - dialogs.flagged_at) AS pickup_delay
+    )
+    SELECT claimed.dialog_id, claimed.user_id, claimed.pickup_delay, messages.message_id, messages.content
+    FROM claimed
+    JOIN messages ON messages.dialog_id = claimed.dialog_id
+     AND messages.message_id > claimed.acked_message_id
+     AND messages.user_id <> 1
+    ORDER BY claimed.dialog_id, messages.message_id
+"""
+REAP_STALE_FLAGS_QUERY = """
+    WITH stale AS (
+        SELECT dialog_id, flagged_at FROM dialogs
+        WHERE status_flag = true
+          AND (flagged_at IS NULL OR flagged_at < NOW() - make_interval(secs => :timeout))
+          AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+        ORDER BY flagged_at NULLS FIRST
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE dialogs
+    SET status_flag = false,
+        flagged_at = NULL,
+        claimed_by = NULL,
+        claim_expires_at = NULL
+    FROM stale
+    WHERE dialogs.dialog_id = stale.dialog_id
+    RETURNING dialogs.dialog_id, dialogs.user_id, EXTRACT(EPOCH FROM NOW() - stale.flagged_at) AS age
+"""
+EXPORT_DIALOGS_QUERY = """
+    SELECT dialogs.dialog_id, dialogs.dialog_name, messages.message_id,
+           CASE WHEN messages.user_id = 1 THEN 'bot' ELSE 'user' END AS role, messages.content
+    FROM dialogs
+    LEFT JOIN messages ON messages.dialog_id = dialogs.dialog_id
+    WHERE dialogs.user_id = :user_id
+    ORDER BY dialogs.dialog_id, messages.message_id
+"""
+# поиск по сообщениям пользователя, {dialog} — условие на один диалог
+SEARCH_MESSAGES_QUERY = """
+    WITH query AS (SELECT websearch_to_tsquery('russian', :query) AS q),
+    hits AS (
+        SELECT messages.message_id, messages.dialog_id, dialogs.dialog_name, messages.user_id,
+               messages.content, ts_rank_cd(messages.content_tsv, query.q) AS rank
+        FROM messages
+        JOIN dialogs ON dialogs.dialog_id = messages.dialog_id
+        CROSS JOIN query
+        WHERE dialogs.user_id = :user_id AND messages.content_tsv @@ query.q {dialog}
+        ORDER BY rank DESC, messages.message_id DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT hits.message_id, hits.dialog_id, hits.dialog_name,
+           CASE WHEN hits.user_id = 1 THEN 'bot' ELSE 'user' END AS role, hits.rank,
+           ts_headline('russian', hits.content, query.q, :options) AS snippet
+    FROM hits
+    CROSS JOIN query
+    ORDER BY hits.rank DESC, hits.message_id DESC
+"""
+SEARCH_MESSAGES_ALL = SEARCH_MESSAGES_QUERY.format(dialog='')
+SEARCH_MESSAGES_DIALOG = SEARCH_MESSAGES_QUERY.format(dialog='AND messages.dialog_id = :dialog_id')
+
+
+class ReadPin:
+    """Закрепление чтений за основной БД (read-your-writes) до until (unix-время).
+
+    Живёт в запросе: ReadPinMiddleware восстанавливает его из подписанной cookie клиента, записи продлевают,
+    а продлённое (changed) уходит клиенту в cookie — следующий его запрос в любом воркере читает с основной БД.
+    """
+
+    __slots__ = ('until', 'changed')
+
+    def __init__(self, until: float = 0.0):
+        self.until = until
+        self.changed = False
+
+    def extend(self, until: float) -> None:
+        if until > self.until:
+            self.until = until
+            self.changed = True
+
+
+# закрепление текущего запроса; None — вне запроса (фоновые задачи), чтения идут на реплики
+read_pin: ContextVar[ReadPin | None] = ContextVar('read_pin', default=None)
+
+
+class Replica:
+    """Реплика для чтения: свой движок и пул; после ошибки пропускается до down_until."""
+
+    def __init__(self, dsn: str):
+        # postgresql://... из настроек -> драйвер asyncpg, как у основной БД
+        self.url = make_url(dsn).set(drivername='postgresql+asyncpg')
+        self.name = f'{self.url.host}:{self.url.port or 5432}'
+        self.engine: AsyncEngine | None = None
+        self.async_session = None
+        self.down_until = 0.0
+
+
+class Database(Repository):
+    """Репозиторий на SQLAlchemy (async, asyncpg): запросы text() через сессии пула основной БД.
+
+    С репликами (replicas — DSN) чтения истории (get_dialogs, get_dialog_json, get_user, search_messages,
+    export_dialogs, count_pending_dialogs) идут на реплики по кругу; реплика, на которой запрос упал,
+    пропускается replica_retry секунд, а запрос повторяется на основной БД. После записи запрос и клиент
+    (ReadPin в cookie) replica_pin секунд читают с основной БД — видят свою запись при отставании реплики;
+    после принятого сообщения — replica_pin_answer секунд: ответ AI записывает запрос воркера AI, а не клиента.
+    Флаг и ответ AI, владелец диалога и очередь воркеров (read_user_message_json) всегда читаются с основной
+    БД: их ждут сразу после записи.
+    """
+
+    def __init__(self, host, port, dbname, user, password, notify_channel: str | None = None,
+                 pool_size: int = 5, max_overflow: int = 10, pool_timeout: float = 30,
+                 pool_recycle: int = -1, pool_pre_ping: bool = False, pool_prewarm: int = 0,
+                 replicas: list[str] | None = None, replica_pin: float = 5, replica_retry: float = 30,
+                 replica_pin_answer: float = 0, replica_connect_timeout: float = 2):
+        self.url = f'postgresql+asyncpg://{user}:{password}@{host}:{port}/{dbname}'
+        self.pool_options = {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'pool_recycle': pool_recycle,
+            'pool_pre_ping': pool_pre_ping,
+        }
+        self.pool_prewarm = pool_prewarm
+        # движок создаётся в lifespan приложения (connect) и закрывается в close
+        self.engine: AsyncEngine | None = None
+        self.async_session = None
+        self.notify_channel = notify_channel
+        self.replicas = [Replica(dsn) for dsn in replicas or []]
+        self.replica_turn = count()
+        self.replica_retry = replica_retry
+        self.replica_connect_timeout = replica_connect_timeout
+        self.replica_pin = replica_pin
+        self.replica_pin_answer = replica_pin_answer
+        self.logger = get_logger(__name__)
+
+    # создать движок и заранее открыть pool_prewarm соединений; соединения с репликами — при первом чтении
+    async def connect(self) -> None:
+        self.engine = create_async_engine(self.url, echo=False, poolclass=TimedQueuePool, **self.pool_options)
         self.async_session = sessionmaker(
             bind=self.engine,
             expire_on_commit=False,
             class_=AsyncSession
         )
-        self.logger = get_logger(__name__)
+        if self.pool_prewarm:
+            connections = await asyncio.gather(*(self.engine.connect() for _ in range(self.pool_prewarm)))
+            for connection in connections:
+                await connection.close()
+        self.logger.info("Пул БД создан: %s, прогрето соединений: %s", self.pool_options, self.pool_prewarm)
+        for replica in self.replicas:
+            replica.engine = create_async_engine(replica.url, echo=False, poolclass=TimedQueuePool,
+                                                 connect_args={'timeout': self.replica_connect_timeout},
+                                                 **self.pool_options)
+            replica.async_session = sessionmaker(bind=replica.engine, expire_on_commit=False, class_=AsyncSession)
+        if self.replicas:
+            self.logger.info("Реплики для чтения: %s", ', '.join(replica.name for replica in self.replicas))
+
+    # закрыть все соединения пула
+    async def close(self) -> None:
+        for replica in self.replicas:
+            if replica.engine is not None:
+                await replica.engine.dispose()
+                replica.engine = None
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+            self.logger.info("Пул БД закрыт")
+
+    # read-your-writes: чтения запроса и клиента — с основной БД ещё seconds (по умолчанию replica_pin) секунд
+    def pin(self, seconds: float | None = None) -> None:
+        pin = read_pin.get()
+        if self.replicas and pin is not None:
+            pin.extend(time.time() + (self.replica_pin if seconds is None else seconds))
+
+    # следующая по кругу доступная реплика; None — читать с основной БД
+    def pick_replica(self) -> Replica | None:
+        pin = read_pin.get()
+        if not self.replicas or (pin is not None and pin.until > time.time()):
+            return None
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self.replica_turn) % len(self.replicas)]
+            if replica.down_until <= now:
+                return replica
+        return None
+
+    def mark_down(self, replica: Replica, error: Exception) -> None:
+        replica.down_until = time.monotonic() + self.replica_retry
+        self.logger.warning("Реплика %s недоступна, чтение с основной БД %s с: %s",
+                            replica.name, self.replica_retry, error)
+
+    # SELECT на реплике, при её ошибке — на основной БД; результат буферизован (сессия уже закрыта)
+    async def _execute_read(self, query, params: dict):
+        replica = self.pick_replica()
+        if replica is not None:
+            try:
+                async with replica.async_session() as session:
+                    return await session.execute(query, params)
+            except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+                self.mark_down(replica, e)
+        async with self.async_session() as session:
+            return await session.execute(query, params)
+
+    # соединение для долгого чтения (курсор): с реплики, если она отвечает, иначе с основной БД
+    @asynccontextmanager
+    async def _read_connection(self) -> AsyncIterator[AsyncConnection]:
+        connection = None
+        replica = self.pick_replica()
+        if replica is not None:
+            try:
+                connection = await replica.engine.connect()
+            except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+                self.mark_down(replica, e)
+        if connection is None:
+            connection = await self.engine.connect()
+        try:
+            yield connection
+        finally:
+            await connection.close()
+
+    # состояние пула: занятые/свободные соединения, overflow и ожидание свободного соединения
+    def pool_stats(self) -> dict:
+        if self.engine is None:
+            return {}
+        pool = self.engine.pool
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            # overflow() отсчитывается от -size, пока пул не заполнен
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': self.pool_options['max_overflow'],
+            'wait_count': pool.wait_count,
+            'wait_seconds_total': round(pool.wait_total, 6),
+            'wait_seconds_max': round(pool.wait_max, 6),
+            'replicas': [
+                {'name': replica.name, 'healthy': replica.down_until <= time.monotonic(),
+                 'checked_out': replica.engine.pool.checkedout() if replica.engine is not None else 0}
+                for replica in self.replicas
+            ],
+        }
 
     # Сверка пользователя в БД
     async def get_users(self, google_id: str) -> int | bool:
-        query = text("""
-            SELECT user_id FROM users
-            WHERE google_id = :google_id;
-        """)
+        query = text(GET_USERS_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {'google_id': google_id})
@@ -31,20 +473,39 @@ class Database:
                 if user_id is not None:
                     return user_id
                 else:
-                    self.logger.info(f"Пользователь с google_id='{google_id}' не найден.")
+                    self.logger.info("Пользователь с google_id='%s' не найден.", google_id)
                     return False
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка при получении пользователя: {e}")
+                self.logger.error("Ошибка при получении пользователя: %s", e)
                 return False
 
     # внесения пользователя в бд
     async def create_user(self, mail: str, google_id: str, given_name: str, family_name: str,
                           picture: str) -> int | bool:
-        query = text("""
-            INSERT INTO users(mail, google_id, given_name, family_name, picture)
-            VALUES(:mail, :google_id, :given_name, :family_name, :picture)
-            RETURNING user_id;
-        """)
+        query = text(CREATE_USER_QUERY)
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(query, {
+                    "mail": mail,
+                    "google_id": google_id,
+                    "given_name": given_name,
+                    "family_name": family_name,
+                    "picture": picture,
+                })
+                await session.commit()
+                user_id = result.scalar()
+                self.pin()
+                self.logger.info("Пользователь с почтой '%s' успешно создан с user_id=%s", mail, user_id)
+                return user_id
+            except SQLAlchemyError as e:
+                await session.rollback()
+                self.logger.error("Ошибка при создании пользователя с почтой '%s': %s", mail, e)
+                return False
+
+    # вход через Google одним запросом: создать пользователя или обновить профиль существующего
+    async def upsert_user(self, mail: str, google_id: str, given_name: str, family_name: str,
+                          picture: str) -> int | bool:
+        query = text(UPSERT_USER_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {
@@ -56,162 +517,134 @@ class Database:
                 })
                 await session.commit()
                 user_id = result.scalar()
-                self.logger.info(f"Пользователь с почтой '{mail}' успешно создан с user_id={user_id}")
+                self.pin()
+                self.logger.info("Пользователь с почтой '%s' вошёл, user_id=%s", mail, user_id)
                 return user_id
             except SQLAlchemyError as e:
                 await session.rollback()
-                self.logger.error(f"Ошибка при создании пользователя с почтой '{mail}': {e}")
+                self.logger.error("Ошибка входа пользователя с почтой '%s': %s", mail, e)
                 return False
 
     # проверка принадлежности диалога
     async def check_dialog_ownership(self, user_id: int, dialog_id: int) -> bool:
-        query = text("""
-            SELECT dialog_id FROM dialogs
-            WHERE user_id = :user_id AND dialog_id = :dialog_id
-        """)
+        query = text(CHECK_DIALOG_OWNERSHIP_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {"user_id": user_id, "dialog_id": dialog_id})
                 dialog = result.scalar_one_or_none()
                 if dialog is None:
-                    self.logger.warning(f"Доступ запрещён пользователь id:{user_id} не владеет диалогом id:{dialog_id}")
+                    self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s",
+                                        user_id, dialog_id)
                     return False
                 return True
             except SQLAlchemyError as e:
                 await session.rollback()
-                self.logger.error(f"Ошибка при проверке доступа к диалогу id:{dialog_id} пользователя id:{user_id}: {e}")
+                self.logger.error("Ошибка при проверке доступа к диалогу id:%s пользователя id:%s: %s",
+                                  dialog_id, user_id, e)
                 return False
 
     # внести user_id в dialogs (КНОПКА создать диалог)
     async def create_dialog(self, user_id: int, dialog_name: str) -> int | bool:
-        query = text("""
-            INSERT INTO dialogs(user_id, dialog_name)
-            VALUES(:user_id, :dialog_name)
-            RETURNING dialog_id;
-        """)
+        query = text(CREATE_DIALOG_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {'user_id': user_id, 'dialog_name': dialog_name})
                 await session.commit()
                 dialog_id = result.scalar()
-                self.logger.info(f"Пользователь id:{user_id} успешно создал диалог id:{dialog_id}")
+                self.pin()
+                self.logger.info("Пользователь id:%s успешно создал диалог id:%s", user_id, dialog_id)
                 return dialog_id
             except SQLAlchemyError as e:
                 await session.rollback()
-                self.logger.error(f"Ошибка при создании диалога. Пользователь id:{user_id}: {e}")
+                self.logger.error("Ошибка при создании диалога. Пользователь id:%s: %s", user_id, e)
                 return False
 
     # удаление dialog_id из dialogs
     async def delete_dialog(self, user_id: int, dialog_id: int) -> bool:
-        query = text("""
-            DELETE FROM dialogs
-            WHERE user_id = :user_id AND dialog_id = :dialog_id;
-        """)
+        query = text(DELETE_DIALOG_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {'user_id': user_id, 'dialog_id': dialog_id})
                 await session.commit()
                 if result.rowcount == 0:
-                    self.logger.warning(f"Диалог id:{dialog_id} не найден или не принадлежит пользователю id:{user_id}")
+                    self.logger.warning("Диалог id:%s не найден или не принадлежит пользователю id:%s",
+                                        dialog_id, user_id)
                     return False
-                self.logger.info(f"Пользователь id:{user_id} удалил диалог id:{dialog_id}")
+                self.pin()
+                self.logger.info("Пользователь id:%s удалил диалог id:%s", user_id, dialog_id)
                 return True
             except SQLAlchemyError as e:
                 await session.rollback()
-                self.logger.error(f"Ошибка при удаление диалога. Пользователь id:{user_id}- {e}")
+                self.logger.error("Ошибка при удаление диалога. Пользователь id:%s- %s", user_id, e)
                 return False
 
     # запрос на список dialogs пользователя
     async def get_dialogs(self, user_id: int) -> list | bool:
-        query = text("""
-            SELECT dialog_id, dialog_name 
-            FROM dialogs
-            WHERE user_id = :user_id
-            ORDER BY dialog_id;
-        """)
-        async with self.async_session() as session:
-            try:
-                result = await session.execute(query, {'user_id': user_id})
-                rows = result.mappings().all()
-                dialogs = [dict(row) for row in rows]
-                self.logger.info(f"Получено {len(dialogs)} диалог(ов) пользователя id:{user_id}")
-                return dialogs
-            except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка при получении диалогов пользователя id:{user_id}: {e}")
-                return False
+        query = text(GET_DIALOGS_QUERY)
+        try:
+            result = await self._execute_read(query, {'user_id': user_id})
+            rows = result.mappings().all()
+            dialogs = [dict(row) for row in rows]
+            self.logger.info("Получено %s диалог(ов) пользователя id:%s", len(dialogs), user_id)
+            return dialogs
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка при получении диалогов пользователя id:%s: %s", user_id, e)
+            return False
 
     # отправка сообщения в messages
-    async def insert_message(self, user_id: int, dialog_id: int, content: str) -> bool:
-        query = text("""
-            INSERT INTO messages(dialog_id, user_id, content)
-            VALUES(:dialog_id, :user_id, :content)
-        """)
+    async def insert_message(self, user_id: int, dialog_id: int, content: str) -> int | bool:
+        query = text(INSERT_MESSAGE_QUERY)
         async with self.async_session() as session:
             try:
-                await session.execute(query, {
+                result = await session.execute(query, {
                     'dialog_id': dialog_id,
                     'user_id': user_id,
                     'content': content
                 })
                 await session.commit()
-                self.logger.info(f"Пользователь id:{user_id} записал сообщение в диалог id:{dialog_id}")
-                return True
+                message_id = result.scalar()
+                self.pin()
+                self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s",
+                                 user_id, message_id, dialog_id)
+                return message_id
             except SQLAlchemyError as e:
                 await session.rollback()
-                self.logger.error(f"Ошибка при записи сообщения пользователя id:{user_id}: {e}")
+                self.logger.error("Ошибка при записи сообщения пользователя id:%s: %s", user_id, e)
                 return False
 
-    # получить контекст диалога
-    async def get_dialog(self, user_id: int, dialog_id: int) -> bool | list:
-        query = text("""
-            SELECT user_id, content FROM messages
-            WHERE dialog_id = :dialog_id
-            ORDER BY created_at
-        """)
-        async with self.async_session() as session:
-            try:
-                result = await session.execute(query, {'dialog_id': dialog_id})
-                rows = result.mappings().all()
-                dialog = [
-                    {
-                        "role": "bot" if row["user_id"] == 1 else "user",
-                        "content": row["content"]
-                    }
-                    for row in rows
-                ]
-                self.logger.info(f"Пользователь:{user_id} получил диалог id:{dialog_id}")
-                return dialog
-            except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка получения диалога id:{dialog_id} пользователям id: {user_id}: {e}")
-                return False
+    # получить контекст диалога одним JSON-массивом, собранным в БД
+    # (keyset по message_id, индекс messages(dialog_id, message_id)):
+    # since — сообщения новее since по возрастанию, before/limit — последние limit до before,
+    # без параметров — вся история
+    async def get_dialog_json(self, user_id: int, dialog_id: int, before: int | None = None,
+                              since: int | None = None, limit: int | None = None) -> bool | str:
+        params = {'dialog_id': dialog_id, 'before': before, 'since': since, 'limit': limit}
+        query = text(dialog_json_query(before is not None, since is not None, limit is not None))
+        try:
+            result = await self._execute_read(query, params)
+            dialog = result.scalar()
+            self.logger.info("Пользователь:%s получил сообщения диалога id:%s", user_id, dialog_id)
+            return dialog
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка получения диалога id:%s пользователям id: %s: %s", dialog_id, user_id, e)
+            return False
 
     # получить имя, фамилию, аватарка
     async def get_user(self, user_id: int) -> bool | list:
-        query = text("""
-                    SELECT given_name,
-                    family_name,
-                    picture FROM users
-                    WHERE user_id = :user_id
-                """)
-        async with self.async_session() as session:
-            try:
-                result = await session.execute(query, {'user_id': user_id})
-                rows = result.mappings().all()
-                content_user = [dict(row) for row in rows]
-                self.logger.info(f"Пользователь:{user_id} получил дату для /me")
-                return content_user
-            except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка получения даты для /me пользователем id: {user_id}: {e}")
-                return False
+        query = text(GET_USER_QUERY)
+        try:
+            result = await self._execute_read(query, {'user_id': user_id})
+            rows = result.mappings().all()
+            content_user = [dict(row) for row in rows]
+            self.logger.info("Пользователь:%s получил дату для /me", user_id)
+            return content_user
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка получения даты для /me пользователем id: %s: %s", user_id, e)
+            return False
 
     # Переименовать диалог
     async def update_name_chat(self, user_id: int, dialog_id: int, dialog_name: str) -> bool:
-        query = text("""
-            UPDATE dialogs
-            SET dialog_name = :dialog_name
-            WHERE user_id = :user_id AND dialog_id = :dialog_id
-            RETURNING dialog_id
-        """)
+        query = text(UPDATE_NAME_CHAT_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {
@@ -222,48 +655,89 @@ class Database:
                 await session.commit()
                 updated = result.scalar_one_or_none()
                 if updated is None:
-                    self.logger.error(f"Не найден диалог {dialog_id} для переименования пользователем {user_id}")
+                    self.logger.warning("Не найден диалог %s для переименования пользователем %s", dialog_id, user_id)
                     return False
-
-                self.logger.info(f"Пользователь id:{user_id} переименовал диалог id:{dialog_id} в '{dialog_name}'")
+                self.pin()
+                self.logger.info("Пользователь id:%s переименовал диалог id:%s в '%s'", user_id, dialog_id, dialog_name)
                 return True
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка переименования диалога пользователем id: {user_id}: {e}")
+                self.logger.error("Ошибка переименования диалога пользователем id: %s: %s", user_id, e)
                 return False
 
-    # установка флага чата
-    async def set_ai_response_flag(self, user_id: int, dialog_id: int, flag_status: bool) -> bool:
-        query = text("""
-            UPDATE dialogs
-            SET status_flag = :flag_status
-            WHERE user_id = :user_id AND dialog_id = :dialog_id
-            RETURNING dialog_id
-        """)
+    # приём сообщения user одним запросом: проверка владельца, установка флага только если он
+    # снят (условный UPDATE закрывает гонку двух вкладок) и запись сообщения. При notify_channel
+    # в той же транзакции уходит NOTIFY 'pending:<dialog_id>' для воркеров AI.
+    # Результат: 'forbidden' | 'pending' | 'accepted', False — ошибка БД
+    async def submit_user_message(self, user_id: int, dialog_id: int, content: str) -> str | bool:
+        query = text(SUBMIT_USER_MESSAGE_QUERY.format(notify=SUBMIT_NOTIFY if self.notify_channel else ''))
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {
                     'user_id': user_id,
                     'dialog_id': dialog_id,
-                    'flag_status': flag_status
+                    'content': content,
+                    'channel': self.notify_channel
+                })
+                row = result.one()
+                await session.commit()
+                if not row.owned:
+                    self.logger.warning("Доступ запрещён пользователь id:%s не владеет диалогом id:%s",
+                                        user_id, dialog_id)
+                    return 'forbidden'
+                if row.message_id is None:
+                    self.logger.info("Диалог id:%s уже ожидает ответа AI", dialog_id)
+                    return 'pending'
+                # ответ AI запишет запрос воркера AI: клиент читает с основной БД, пока его ждёт
+                self.pin(self.replica_pin_answer)
+                self.logger.info("Пользователь id:%s записал сообщение id:%s в диалог id:%s",
+                                 user_id, row.message_id, dialog_id)
+                return 'accepted'
+            except SQLAlchemyError as e:
+                await session.rollback()
+                self.logger.error("Ошибка приёма сообщения пользователя id:%s в диалог id:%s: %s",
+                                  user_id, dialog_id, e)
+                return False
+
+    # запись пачки ответов AI одним запросом: вставка сообщений бота и снятие флагов
+    # (с подтверждением и освобождением захвата) в одной транзакции.
+    # replies — [(user_id, dialog_id, content)], результат — True/False по каждому ответу
+    async def save_ai_replies(self, replies: list[tuple[int, int, str]]) -> bool | list:
+        query = text(SAVE_AI_REPLIES_QUERY.format(notify=SAVE_AI_REPLIES_NOTIFY if self.notify_channel else ''))
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(query, {
+                    'user_ids': [reply[0] for reply in replies],
+                    'dialog_ids': [reply[1] for reply in replies],
+                    'contents': [reply[2] for reply in replies],
+                    'channel': self.notify_channel
+                })
+                saved = [row.saved for row in result]
+                await session.commit()
+                self.logger.info("AI записал %s из %s ответ(ов)", sum(saved), len(replies))
+                return saved
+            except SQLAlchemyError as e:
+                await session.rollback()
+                self.logger.error("Ошибка записи пачки ответов AI: %s", e)
+                return False
+
+    # уведомление воркеров о событии диалога (LISTEN/NOTIFY)
+    async def notify_dialog(self, event: str, dialog_id: int, data: str = '') -> bool:
+        query = text(NOTIFY_DIALOG_QUERY)
+        async with self.async_session() as session:
+            try:
+                await session.execute(query, {
+                    'channel': self.notify_channel,
+                    'payload': f"{event}:{dialog_id}:{data}"
                 })
                 await session.commit()
-                updated = result.scalar_one_or_none()
-                if updated is None:
-                    self.logger.error(f"Не найден диалог {dialog_id} для пользователя {user_id}")
-                    return False
-                self.logger.info(f"Диалог id:{dialog_id} — статус флага: {flag_status}")
                 return True
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка установки флага для пользователя {user_id}: {e}")
+                self.logger.error("Ошибка уведомления %s для диалога %s: %s", event, dialog_id, e)
                 return False
 
     # получение флага
     async def get_ai_response_flag(self, user_id: int, dialog_id: int) -> bool | None:
-        query = text("""
-            SELECT status_flag
-            FROM dialogs
-            WHERE user_id = :user_id AND dialog_id = :dialog_id
-        """)
+        query = text(GET_AI_RESPONSE_FLAG_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {
@@ -272,21 +746,16 @@ class Database:
                 })
                 flag = result.scalar_one_or_none()
                 if flag is None:
-                    self.logger.warning(f"Флаг не найден для диалога {dialog_id} пользователя {user_id}")
+                    self.logger.warning("Флаг не найден для диалога %s пользователя %s", dialog_id, user_id)
                     return None
-                self.logger.info(f"Пользователь {user_id} получил флаг: {flag}")
+                self.logger.info("Пользователь %s получил флаг: %s", user_id, flag)
                 return flag
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка получения флага для чата {dialog_id} пользователя {user_id}: {e}")
+                self.logger.error("Ошибка получения флага для чата %s пользователя %s: %s", dialog_id, user_id, e)
                 return None
 
     async def read_ai_message(self, user_id: int, dialog_id: int) -> bool | dict:
-        query = text("""
-            SELECT content FROM messages
-            WHERE dialog_id = :dialog_id AND user_id = :user_id
-            ORDER BY created_at DESC
-            LIMIT 1
-           """)
+        query = text(READ_AI_MESSAGE_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query, {
@@ -295,27 +764,109 @@ class Database:
                 })
                 content = result.scalar_one_or_none()
                 if content is None:
-                    self.logger.warning(f"Последние сообщение: {user_id} в диалоге: {dialog_id} не найдено")
+                    self.logger.warning("Последние сообщение: %s в диалоге: %s не найдено", user_id, dialog_id)
                     return False
-                self.logger.info(f"Пользователь {user_id} получил последнее сообщение")
+                self.logger.info("Пользователь %s получил последнее сообщение", user_id)
                 return {'content': content}
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка получения последнего сообщения для чата {dialog_id} пользователя {user_id}: {e}")
+                self.logger.error("Ошибка получения последнего сообщения для чата %s пользователя %s: %s",
+                                  dialog_id, user_id, e)
                 return False
 
-    async def read_user_message(self) -> bool | list:
-        query = text("""
-            SELECT messages.user_id, messages.dialog_id, messages.content FROM messages
-            JOIN dialogs ON messages.dialog_id = dialogs.dialog_id
-            WHERE dialogs.status_flag = true AND messages.user_id <> 1
-              """)
+    # число диалогов, ожидающих ответа AI (глубина очереди)
+    async def count_pending_dialogs(self) -> int | None:
+        query = text(COUNT_PENDING_DIALOGS_QUERY)
+        try:
+            result = await self._execute_read(query, {})
+            return result.scalar()
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка подсчёта ожидающих диалогов: %s", e)
+            return None
+
+    # сообщения пользователей в ожидающих ответа диалогах одним JSON-массивом
+    async def read_user_message_json(self) -> bool | str:
+        query = text(READ_USER_MESSAGE_JSON_QUERY)
         async with self.async_session() as session:
             try:
                 result = await session.execute(query)
+                self.logger.info("AI:получил диалоги")
+                return result.scalar()
+            except SQLAlchemyError as e:
+                self.logger.error("Ошибка AI не получила диалоги: %s", e)
+                return False
+
+    # захват до limit ожидающих диалогов воркером: FOR UPDATE SKIP LOCKED и аренда на lease секунд,
+    # отдаются только сообщения user новее последнего подтверждения (acked_message_id);
+    # pickup_delay — сколько диалог ждал захвата (сек.)
+    async def claim_dialogs(self, worker_id: str, limit: int, lease: float) -> bool | list:
+        query = text(CLAIM_DIALOGS_QUERY)
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(query, {'worker_id': worker_id, 'limit': limit, 'lease': lease})
+                rows = result.mappings().all()
+                await session.commit()
+                dialogs = {}
+                for row in rows:
+                    dialog = dialogs.setdefault(row['dialog_id'], {
+                        'dialog_id': row['dialog_id'],
+                        'user_id': row['user_id'],
+                        'pickup_delay': float(row['pickup_delay'] or 0),
+                        'messages': []
+                    })
+                    dialog['messages'].append({'message_id': row['message_id'], 'content': row['content']})
+                # контекст захваченного диалога читается сразу после захвата — с основной БД
+                self.pin()
+                self.logger.info("AI воркер %s захватил %s диалог(ов)", worker_id, len(dialogs))
+                return list(dialogs.values())
+            except SQLAlchemyError as e:
+                await session.rollback()
+                self.logger.error("Ошибка захвата диалогов воркером %s: %s", worker_id, e)
+                return False
+
+    # снятие зависших флагов пачкой: FOR UPDATE SKIP LOCKED — воркеры uvicorn не мешают друг другу,
+    # диалоги с действующей арендой не трогаются (воркер AI ещё отвечает). Флаг без flagged_at (поставлен
+    # до появления столбца) считается зависшим, его age — None
+    async def reap_stale_flags(self, timeout: float, limit: int) -> bool | list:
+        query = text(REAP_STALE_FLAGS_QUERY)
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(query, {'timeout': timeout, 'limit': limit})
                 rows = result.mappings().all()
-                content_messages = [dict(row) for row in rows]
-                self.logger.info(f"AI:получил диалоги")
-                return content_messages
+                await session.commit()
+                return [{'dialog_id': row['dialog_id'], 'user_id': row['user_id'],
+                         'age': float(row['age']) if row['age'] is not None else None} for row in rows]
             except SQLAlchemyError as e:
-                self.logger.error(f"Ошибка AI не получила диалоги")
+                await session.rollback()
+                self.logger.error("Ошибка снятия зависших флагов: %s", e)
                 return False
+
+    # выгрузка диалогов пользователя через серверный курсор (stream, пачки по chunk_size): в памяти одна пачка,
+    # соединение из пула занято, пока читается курсор, и возвращается сразу после последней пачки
+    # или при закрытии генератора (клиент отключился)
+    async def export_dialogs(self, user_id: int, chunk_size: int) -> AsyncIterator[list | bool]:
+        query = text(EXPORT_DIALOGS_QUERY)
+        try:
+            async with self._read_connection() as connection:
+                result = await connection.stream(query, {'user_id': user_id})
+                async for rows in result.partitions(chunk_size):
+                    yield [tuple(row) for row in rows]
+            self.logger.info("Пользователь id:%s выгрузил диалоги", user_id)
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка выгрузки диалогов пользователя id:%s: %s", user_id, e)
+            yield False
+
+    # поиск по GIN-индексу messages.content_tsv (миграция 3) в диалогах пользователя; ts_headline — только
+    # для строк страницы
+    async def search_messages(self, user_id: int, query: str, dialog_id: int | None, limit: int,
+                              offset: int) -> bool | list:
+        statement = text(SEARCH_MESSAGES_ALL if dialog_id is None else SEARCH_MESSAGES_DIALOG)
+        params = {'query': query, 'user_id': user_id, 'dialog_id': dialog_id, 'limit': limit, 'offset': offset,
+                  'options': HEADLINE_OPTIONS}
+        try:
+            result = await self._execute_read(statement, params)
+            messages = [dict(row, rank=float(row['rank'])) for row in result.mappings()]
+            self.logger.info("Пользователь id:%s нашёл %s сообщение(й)", user_id, len(messages))
+            return messages
+        except SQLAlchemyError as e:
+            self.logger.error("Ошибка поиска по сообщениям пользователя id:%s: %s", user_id, e)
+            return False
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, constr
+from pydantic import BaseModel, constr, conlist
 
 
 class DialogNameSchema(BaseModel):
@@ -9,6 +9,11 @@ class DialogSchema(BaseModel):
     dialog_id: int
 
 
+class DialogSchemaRename(BaseModel):
+    dialog_id: int
+    dialog_name: constr(min_length=3, max_length=20)
+
+
 class UserDialogMessage(BaseModel):
     dialog_id: int
     text_user: constr(min_length=1, max_length=2000)
@@ -18,3 +23,15 @@ class DialogSchemaAIsend(BaseModel):
     user_id: int
     dialog_id: int
     text_user: str
+
+
+class DialogSchemaAIbatch(BaseModel):
+    replies: conlist(DialogSchemaAIsend, min_length=1, max_length=500)
+
+
+class DialogSchemaAIchunk(BaseModel):
+    user_id: int
+    dialog_id: int
+    # ограничение под лимит payload NOTIFY (8000 байт)
+    text_user: constr(max_length=1500) = ''
+    done: bool = False
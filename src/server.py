@@ -0,0 +1,84 @@
+"""Запуск API в продакшене: python -m src.server
+
+Несколько воркеров uvicorn на одном сокете (по SERVER_WORKERS или числу доступных CPU), event loop uvloop
+и HTTP-парсер httptools, keep-alive и backlog из настроек. При SIGTERM/SIGINT воркер перестаёт принимать
+соединения, отпускает long-polling воркеров AI, даёт ожиданиям ответа AI дойти до ответа (не дольше
+SERVER_GRACEFUL_TIMEOUT) и в lifespan закрывает LISTEN, кеш и пул БД.
+"""
+import glob
+import os
+import tempfile
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from src.core.config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_KEEPALIVE, SERVER_BACKLOG, SERVER_GRACEFUL_TIMEOUT,
+    SERVER_ACCESS_LOG, NOTIFY_CHANNEL,
+)
+
+# запас до принудительной отмены запросов uvicorn: ожидания успевают ответить 503 сами
+DRAIN_MARGIN = 1.0
+
+
+class DrainingServer(uvicorn.Server):
+    """Server uvicorn, который перед остановкой переводит сервисы в режим остановки (begin_drain)."""
+
+    async def shutdown(self, sockets=None) -> None:
+        # импорт в воркере: в процессе-супервизоре сервисы (пул БД, метрики) не создаются
+        from src.services.service import begin_drain
+
+        timeout = self.config.timeout_graceful_shutdown
+        begin_drain(None if timeout is None else max(timeout - DRAIN_MARGIN, 0))
+        await super().shutdown(sockets)
+
+
+def worker_count() -> int:
+    if SERVER_WORKERS > 0:
+        return SERVER_WORKERS
+    # в контейнере с ограничением cpuset доступно меньше ядер, чем os.cpu_count()
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# метрики нескольких воркеров суммируются через файлы каталога, оставшиеся от прошлого запуска удаляются
+def prepare_metrics_dir(workers: int) -> None:
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory is None and workers > 1:
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='deepbot-metrics-')
+        return
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+
+def main() -> None:
+    workers = worker_count()
+    # локальный кеш, отзыв токенов и части ответа AI расходятся по воркерам только через LISTEN/NOTIFY
+    if workers > 1 and NOTIFY_CHANNEL is None:
+        raise SystemExit("Несколько воркеров без канала LISTEN/NOTIFY: задайте AI_NOTIFY_CHANNEL "
+                         "с Postgres-бэкендом или SERVER_WORKERS=1")
+    prepare_metrics_dir(workers)
+    config = uvicorn.Config(
+        'src.main:app',
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=workers,
+        loop='uvloop',
+        http='httptools',
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        access_log=SERVER_ACCESS_LOG,
+    )
+    server = DrainingServer(config)
+    if workers > 1:
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+if __name__ == '__main__':
+    main()
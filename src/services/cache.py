@@ -0,0 +1,104 @@
+import json
+
+from cachetools import TTLCache
+
+from src.utils.utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class LocalCache:
+    """Кеш в памяти воркера: TTL и вытеснение LRU при переполнении (cachetools).
+
+    Другие воркеры про изменения не знают — для них ключи сбрасываются через evict
+    (уведомление 'invalidate' по LISTEN/NOTIFY), TTL ограничивает устаревание без уведомлений.
+    """
+
+    shared = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.data = TTLCache(maxsize, ttl)
+        # растёт при каждом сбросе: значение, прочитанное из БД до сброса, не записывается
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value) -> None:
+        self.data[key] = value
+
+    async def delete(self, *keys: str) -> None:
+        self.evict(keys)
+
+    def evict(self, keys) -> None:
+        self.generation += 1
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def close(self) -> None:
+        self.data.clear()
+
+    def stats(self) -> dict:
+        return {'backend': 'local', 'size': len(self.data), 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisCache:
+    """Общий для всех воркеров кеш в Redis (нужен пакет redis); значения хранятся в JSON.
+
+    Ошибки Redis не ломают запрос: чтение считается промахом, запись пропускается.
+    """
+
+    shared = True
+    generation = 0
+
+    def __init__(self, url: str, ttl: float, prefix: str = 'deepbot:'):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis требует пакет redis (pip install redis)") from e
+        self.errors = (redis.RedisError, OSError)
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except self.errors as e:
+            logger.error("Ошибка чтения кеша %s: %s", key, e)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value) -> None:
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), px=int(self.ttl * 1000))
+        except self.errors as e:
+            logger.error("Ошибка записи кеша %s: %s", key, e)
+
+    async def delete(self, *keys: str) -> None:
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except self.errors as e:
+            logger.error("Ошибка сброса кеша %s: %s", keys, e)
+
+    def evict(self, keys) -> None:
+        pass
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def stats(self) -> dict:
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,40 @@
+from collections import deque
+
+# грубая оценка токенов по длине текста: ~4 символа на токен у BPE-токенизаторов
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class DialogContext:
+    """Контекст диалога для AI: последние сообщения user и бота по возрастанию message_id.
+
+    Не больше max_messages сообщений и max_tokens оценочных токенов; самое новое сообщение
+    остаётся всегда, даже если одно превышает бюджет. Сообщения в БД только добавляются, поэтому
+    контекст продлевается новыми сообщениями (extend) без перечитывания истории.
+    """
+
+    def __init__(self, max_messages: int, max_tokens: int):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.turns: deque[tuple[dict, int]] = deque()
+        self.tokens = 0
+        self.last_message_id = 0
+
+    # messages — [{message_id, role, content}] по возрастанию, уже учтённые пропускаются
+    def extend(self, messages: list[dict]) -> None:
+        for message in messages:
+            if message['message_id'] <= self.last_message_id:
+                continue
+            tokens = estimate_tokens(message['content'])
+            self.turns.append((message, tokens))
+            self.tokens += tokens
+            self.last_message_id = message['message_id']
+        while len(self.turns) > 1 and (len(self.turns) > self.max_messages or self.tokens > self.max_tokens):
+            _, tokens = self.turns.popleft()
+            self.tokens -= tokens
+
+    def messages(self) -> list[dict]:
+        return [message for message, _ in self.turns]
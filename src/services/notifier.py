@@ -0,0 +1,132 @@
+import asyncio
+from typing import Callable
+
+import asyncpg
+
+from src.utils.utils import get_logger
+
+
+class DialogNotifier:
+    """Пробуждение корутин, ожидающих события по диалогу.
+
+    Ожидающие хранятся в процессе по dialog_id. События из других воркеров
+    приходят через Postgres LISTEN/NOTIFY в формате '<event>:<dialog_id>[:<data>]'.
+    Подписчики потока (SSE) получают все события диалога вместе с данными.
+    Обработчики (add_handler) вызываются на каждое событие своего типа — для событий
+    не про диалог (например, отзыв токена) dialog_id = 0.
+    """
+
+    def __init__(self, host, port, dbname, user, password, channel: str, reconnect_delay: float = 5):
+        self.connect_params = {'host': host, 'port': port, 'database': dbname, 'user': user, 'password': password}
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.waiters: dict[tuple[str, int], set[asyncio.Event]] = {}
+        self.streams: dict[int, set[asyncio.Queue]] = {}
+        self.handlers: dict[str, Callable[[int, str], None]] = {}
+        self.task: asyncio.Task | None = None
+        self.logger = get_logger(__name__)
+
+    # подписка на событие диалога (до записи в БД, чтобы не потерять пробуждение),
+    # dialog_id=None — на событие любого диалога
+    def subscribe(self, event: str, dialog_id: int | None) -> asyncio.Event:
+        waiter = asyncio.Event()
+        self.waiters.setdefault((event, dialog_id), set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, event: str, dialog_id: int | None, waiter: asyncio.Event) -> None:
+        waiters = self.waiters.get((event, dialog_id))
+        if waiters is None:
+            return
+        waiters.discard(waiter)
+        if not waiters:
+            del self.waiters[(event, dialog_id)]
+
+    # подписка на все события диалога: в очередь приходят пары (event, data)
+    def subscribe_stream(self, dialog_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.streams.setdefault(dialog_id, set()).add(queue)
+        return queue
+
+    def unsubscribe_stream(self, dialog_id: int, queue: asyncio.Queue) -> None:
+        queues = self.streams.get(dialog_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.streams[dialog_id]
+
+    def add_handler(self, event: str, handler: Callable[[int, str], None]) -> None:
+        self.handlers[event] = handler
+
+    # разбудить ожидающих в текущем процессе
+    def wake(self, event: str, dialog_id: int, data: str = '') -> None:
+        if event in self.handlers:
+            self.handlers[event](dialog_id, data)
+        for waiter in self.waiters.get((event, dialog_id), ()):
+            waiter.set()
+        for waiter in self.waiters.get((event, None), ()):
+            waiter.set()
+        for queue in self.streams.get(dialog_id, ()):
+            queue.put_nowait((event, data))
+
+    # разбудить всех ожидающих процесса (обрыв LISTEN, остановка воркера): каждый перепроверит своё состояние
+    def wake_all(self, event: str) -> None:
+        for waiters in list(self.waiters.values()):
+            for waiter in waiters:
+                waiter.set()
+        for dialog_id in list(self.streams):
+            self.wake(event, dialog_id)
+
+    # ждать пробуждения не дольше timeout, True — если разбудили
+    @staticmethod
+    async def wait(waiter: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def on_notify(self, connection, pid, channel, payload: str) -> None:
+        event, dialog_id, *data = payload.split(':', 2)
+        try:
+            self.wake(event, int(dialog_id), *data)
+        except ValueError:
+            self.logger.warning("Некорректное уведомление в канале %s: %s", channel, payload)
+
+    # держит LISTEN-соединение, переподключаясь при обрыве
+    async def listen(self) -> None:
+        while True:
+            closed = asyncio.Event()
+            try:
+                connection = await asyncpg.connect(**self.connect_params)
+            except (OSError, asyncpg.PostgresError) as e:
+                self.logger.error("Не удалось подключить LISTEN %s: %s", self.channel, e)
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            try:
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(self.channel, self.on_notify)
+                self.logger.info("LISTEN %s запущен", self.channel)
+                await closed.wait()
+                self.logger.warning("LISTEN %s соединение потеряно", self.channel)
+            except asyncpg.PostgresError as e:
+                self.logger.error("Ошибка LISTEN %s: %s", self.channel, e)
+            finally:
+                if not connection.is_closed():
+                    await connection.close()
+            # ожидающие перепроверят флаг сами, пока нет соединения
+            self.wake_all('reconnect')
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -1,159 +1,573 @@
 import asyncio
+import time
+import uuid
+from contextlib import aclosing
 
+import orjson
+from cachetools import LRUCache
+
+from src.repository.base import Repository
 from src.repository.repository import Database
-from src.utils.utils import get_logger
-from src.core.config import DATABASE_HOST, DATABASE_PORT, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD
+from src.repository.asyncpg_repository import AsyncpgDatabase
+from src.repository.memory_repository import MemoryDatabase
+from src.core.metrics import (
+    ai_wait_duration, ai_pickup_delay, ai_queue_depth, ai_flags_reaped, instrument_repository,
+)
+from src.core.security import revoke_token, token_cache
+from src.services.cache import LocalCache, RedisCache
+from src.services.context import DialogContext
+from src.services.notifier import DialogNotifier
+from src.services.stream import ReplyBuffers
+from src.utils.utils import get_logger, format_sse
+from src.core.config import (
+    DATABASE_HOST, DATABASE_PORT, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD,
+    AI_WAIT_MODE, AI_NOTIFY_CHANNEL, AI_POLL_INTERVAL, AI_NOTIFY_FALLBACK_INTERVAL,
+    AI_CLAIM_LEASE, AI_CLAIM_MAX_BATCH, AI_LONG_POLL_MAX, AI_WAIT_TIMEOUT, AI_FLAG_TIMEOUT, AI_REAPER_INTERVAL,
+    AI_REAPER_BATCH, EXPORT_CHUNK_SIZE,
+    AI_CONTEXT_MAX_MESSAGES, AI_CONTEXT_MAX_TOKENS, AI_CONTEXT_CACHE_SIZE,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_IDLE_LIFETIME, DB_POOL_PRE_PING,
+    DB_POOL_PREWARM,
+    DATABASE_REPLICAS, DATABASE_REPLICA_PIN, DATABASE_REPLICA_RETRY, DATABASE_REPLICA_CONNECT_TIMEOUT,
+    DATABASE_BACKEND, NOTIFY_CHANNEL, CACHE_BACKEND, CACHE_TTL, CACHE_MAXSIZE, CACHE_REDIS_URL,
+)
+
+DATABASE_BACKENDS = {'sqlalchemy': Database, 'asyncpg': AsyncpgDatabase}
+
+notifier = DialogNotifier(host=DATABASE_HOST,
+                          port=DATABASE_PORT,
+                          dbname=DATABASE_NAME,
+                          user=DATABASE_USER,
+                          password=DATABASE_PASSWORD,
+                          channel=AI_NOTIFY_CHANNEL)
+
+
+# репозиторий по DATABASE_BACKEND; 'memory' — без БД, уведомления сразу в notifier этого процесса
+def create_repository(backend: str = DATABASE_BACKEND) -> Repository:
+    if backend == 'memory':
+        repository = MemoryDatabase(notify=notifier.wake)
+    else:
+        # реплики для чтения поддерживает только Database
+        replicas = {
+            'replicas': DATABASE_REPLICAS,
+            'replica_pin': DATABASE_REPLICA_PIN,
+            'replica_pin_answer': AI_WAIT_TIMEOUT + DATABASE_REPLICA_PIN,
+            'replica_retry': DATABASE_REPLICA_RETRY,
+            'replica_connect_timeout': DATABASE_REPLICA_CONNECT_TIMEOUT,
+        } if backend == 'sqlalchemy' else {}
+        # пересоздание по возрасту есть только у пула SQLAlchemy, asyncpg закрывает простаивающие соединения
+        recycle = ({'pool_recycle': DB_POOL_RECYCLE} if backend == 'sqlalchemy'
+                   else {'pool_idle_lifetime': DB_POOL_IDLE_LIFETIME})
+        repository = DATABASE_BACKENDS[backend](host=DATABASE_HOST,
+                                                port=DATABASE_PORT,
+                                                dbname=DATABASE_NAME,
+                                                user=DATABASE_USER,
+                                                password=DATABASE_PASSWORD,
+                                                notify_channel=NOTIFY_CHANNEL,
+                                                pool_size=DB_POOL_SIZE,
+                                                max_overflow=DB_MAX_OVERFLOW,
+                                                pool_timeout=DB_POOL_TIMEOUT,
+                                                pool_pre_ping=DB_POOL_PRE_PING,
+                                                pool_prewarm=DB_POOL_PREWARM,
+                                                **recycle,
+                                                **replicas)
+    instrument_repository(repository)
+    return repository
+
+
+# репозиторий процесса: подключается в lifespan приложения
+repository = create_repository()
+
+
+# зависимость FastAPI: репозиторий для сервисов (подменяется через app.dependency_overrides)
+def get_repository() -> Repository:
+    return repository
+
+
+# кеш редко меняющихся чтений: списки диалогов, владелец диалога, профиль для /me
+cache = RedisCache(CACHE_REDIS_URL, CACHE_TTL) if CACHE_BACKEND == 'redis' else LocalCache(CACHE_MAXSIZE, CACHE_TTL)
+
+# контексты диалогов для AI по dialog_id
+dialog_contexts: LRUCache = LRUCache(AI_CONTEXT_CACHE_SIZE)
+
+# как часто перепроверять флаг, если пробуждения не было
+AI_WAIT_INTERVAL = AI_NOTIFY_FALLBACK_INTERVAL if AI_WAIT_MODE == 'notify' else AI_POLL_INTERVAL
+
+# остановка воркера (begin_drain): срок, до которого ожидания ответа AI ещё ждут; None — воркер работает
+drain_deadline: float | None = None
+
+# части потокового ответа AI по dialog_id: пополняются событиями 'chunk' всех воркеров
+reply_buffers = ReplyBuffers()
+# сколько ждать возврата метки конца ответа через LISTEN, сек.
+STREAM_END_TIMEOUT = 5
 
+logger = get_logger(__name__)
 
-db = Database(host=DATABASE_HOST,
-              port=DATABASE_PORT,
-              dbname=DATABASE_NAME,
-              user=DATABASE_USER,
-              password=DATABASE_PASSWORD)
 
-logger = get_logger(__name__)
+# отзыв токена, пришедший от другого воркера: '<sha256>:<exp>'
+def on_token_revoked(_: int, data: str) -> None:
+    digest, _, exp = data.partition(':')
+    try:
+        token_cache.revoke(digest, float(exp))
+    except ValueError:
+        logger.warning("Некорректное уведомление об отзыве токена: %s", data)
+
+
+notifier.add_handler('revoke', on_token_revoked)
+# сброс ключей кеша, пришедший от другого воркера: '<key>,<key>'
+notifier.add_handler('invalidate', lambda _, data: cache.evict(data.split(',')))
+notifier.add_handler('chunk', reply_buffers.on_chunk)
+notifier.add_handler('chunk_end', reply_buffers.on_end)
+notifier.add_handler('pending', reply_buffers.on_reset)
+
+
+# остановка воркера: новые запросы уже не принимаются, long-polling воркеров AI отпускается сразу,
+# ожидания ответа AI ждут ещё timeout секунд (None — без ограничения) и затем получают 503
+def begin_drain(timeout: float | None) -> None:
+    global drain_deadline
+    drain_deadline = float('inf') if timeout is None else time.monotonic() + timeout
+    logger.info("Остановка воркера: ожиданий ответа AI %s, потоков %s",
+                sum(len(waiters) for (event, _), waiters in notifier.waiters.items() if event == 'answer'),
+                sum(len(queues) for queues in notifier.streams.values()))
+    notifier.wake_all('drain')
+
+
+# сколько ждать пробуждения до следующей проверки флага: не дольше срока ожидания и срока остановки
+def wait_interval(deadline: float) -> float:
+    interval = min(AI_WAIT_INTERVAL, deadline - time.monotonic())
+    if drain_deadline is not None:
+        interval = min(interval, drain_deadline - time.monotonic())
+    return max(interval, 0)
+
 
+def drain_expired() -> bool:
+    return drain_deadline is not None and time.monotonic() >= drain_deadline
 
-# авторизация в бд если еще нет
-async def insert_user_service(mail: str, google: str, given_name: str, family_name: str, picture: str) -> dict:
-    result = await db.create_user(mail, google, given_name, family_name, picture)
+
+# чтение через кеш: load вызывается при промахе, False/None (ошибка, нет доступа) не кешируются,
+# как и значение, во время чтения которого кеш сбрасывали
+async def cached(key: str, load):
+    value = await cache.get(key)
+    if value is not None:
+        return value
+    generation = cache.generation
+    value = await load()
+    if value is not False and value is not None and cache.generation == generation:
+        await cache.set(key, value)
+    return value
+
+
+# сбросить ключи после записи; локальный кеш других воркеров — через LISTEN/NOTIFY
+async def invalidate(db: Repository, *keys: str) -> None:
+    await cache.delete(*keys)
+    if not cache.shared and NOTIFY_CHANNEL:
+        await db.notify_dialog('invalidate', 0, ','.join(keys))
+
+
+# вход через Google: пользователь создаётся или обновляется одним запросом
+async def upsert_user_service(db: Repository, mail: str, google: str, given_name: str, family_name: str,
+                              picture: str) -> dict:
+    result = await db.upsert_user(mail, google, given_name, family_name, picture)
     if result is False:
         return {'success': False, 'service_message': 500}
+    await invalidate(db, f"me:{result}")
     return {'success': True, 'service_message': result}
 
 
-# сверка авторизованых пользователей
-async def get_user_by_google_id_service(google_id: str) -> dict:
-    result = await db.get_users(google_id)
-    if result is False:
-        return {'success': False, 'service_message': 'Данного google_id нету'}
-    return {'success': True, 'service_message': result}
+# выход: токен отзывается в этом воркере и в остальных через LISTEN/NOTIFY (если канал есть)
+async def revoke_token_service(db: Repository, token: str) -> dict:
+    revoked = revoke_token(token)
+    if revoked is None:
+        return {'success': True, 'service_message': 'Токен недействителен'}
+    digest, exp = revoked
+    if NOTIFY_CHANNEL:
+        result = await db.notify_dialog('revoke', 0, f"{digest}:{exp}")
+        if result is False:
+            return {'success': False, 'service_message': 500}
+    return {'success': True, 'service_message': 'Токен отозван'}
 
 
 # создание диалога
-async def init_user_dialog_service(user_id: int, dialog_name: str) -> dict:
-    dialogs = await db.get_dialogs(user_id)
+async def init_user_dialog_service(db: Repository, user_id: int, dialog_name: str) -> dict:
+    dialogs = await cached(f"dialogs:{user_id}", lambda: db.get_dialogs(user_id))
     if dialogs is False:
         return {'success': False, 'service_message': 'Ошибка при получении диалогов'}
     if len(dialogs) <= 4:
         dialog_id = await db.create_dialog(user_id, dialog_name)
         if dialog_id:
+            await invalidate(db, f"dialogs:{user_id}")
             return {'success': True, 'service_message': dialog_id}
         else:
             return {'success': False, 'service_message': 500}
-    logger.info(f"Пользователь id:{user_id} имеет больше 5 диалогов")
+    logger.info("Пользователь id:%s имеет больше 5 диалогов", user_id)
     return {'success': False, 'service_message': 403}
 
 
 # удаление таблицы диалога
-async def delete_user_dialog_service(user_id: int, dialog_id: int) -> dict:
+async def delete_user_dialog_service(db: Repository, user_id: int, dialog_id: int) -> dict:
     result = await db.delete_dialog(user_id, dialog_id)
     if result is False:
         return {'success': False, 'service_message': 500}
+    await invalidate(db, f"dialogs:{user_id}", f"owner:{user_id}:{dialog_id}")
     if result:
         return {'success': True, 'service_message': 'Диалог удалён'}
 
 
 # запрос списков диалогов
-async def get_user_dialogs_service(user_id: int) -> dict:
-    result = await db.get_dialogs(user_id)
+async def get_user_dialogs_service(db: Repository, user_id: int) -> dict:
+    result = await cached(f"dialogs:{user_id}", lambda: db.get_dialogs(user_id))
     if result is False:
         return {'success': False, 'service_message': 500}
     return {'success': True, 'service_message': result}
 
 
-# отправка сообщения user -> AI
-async def send_message_ai_service(user_id: int, dialog_id: int, text_user: str) -> dict:
-    result_ownership = await db.check_dialog_ownership(user_id, dialog_id)
-
+# приём сообщения user перед ожиданием ответа AI: владелец, флаг и запись — один запрос
+async def accept_user_message_service(db: Repository, user_id: int, dialog_id: int,
+                                      text_user: str) -> dict:
+    result = await db.submit_user_message(user_id, dialog_id, text_user)
+    if result is False:
+        return {'success': False, 'service_message': 500}
     # проверка чужой ли диалог
-    if result_ownership is False:
-        logger.warning(f"Сообщение пользователя id:{user_id} в чужой диалог id:{dialog_id}")
+    if result == 'forbidden':
+        logger.warning("Сообщение пользователя id:%s в чужой диалог id:%s", user_id, dialog_id)
         return {'success': False, 'service_message': 403}
-
     # проверка на спам сообщения
-    result_flag_check = await get_ai_response_flag_service(user_id, dialog_id)
-    if result_flag_check.get('success') and result_flag_check.get('service_message'):
+    if result == 'pending':
         return {'success': False, 'service_message': 409}
+    # будим воркеров, ждущих работу в этом процессе
+    notifier.wake('pending', dialog_id)
+    return {'success': True, 'service_message': 'Сообщение принято'}
 
-    # выставляем флаг для блокировки
-    result_flag = await db.set_ai_response_flag(user_id, dialog_id, True)
-    if result_flag is False:
-        return {'success': False, 'service_message': 500}
 
-    # добавляем сообщение user
-    result_user = await db.insert_message(user_id, dialog_id, text_user)
-    if result_user is False:
+# отправка сообщения user -> AI
+async def send_message_ai_service(db: Repository, user_id: int, dialog_id: int, text_user: str) -> dict:
+    # подписываемся до записи, чтобы не пропустить пробуждение
+    waiter = notifier.subscribe('answer', dialog_id)
+    try:
+        result = await accept_user_message_service(db, user_id, dialog_id, text_user)
+        if not result.get('success'):
+            return result
+
+        # ждём пробуждения от send_message_user_service, опрос флага — резервный;
+        # отключение клиента отменяет корутину (outcome остаётся 'cancelled')
+        started = time.perf_counter()
+        deadline = time.monotonic() + AI_WAIT_TIMEOUT
+        outcome = 'cancelled'
+        try:
+            while True:
+                waiter.clear()
+                result_answer = await db.get_ai_response_flag(user_id, dialog_id)
+                if result_answer is None:
+                    outcome = 'error'
+                    return {'success': False, 'service_message': 500}
+                if result_answer is False:
+                    # читаем сообщение бд
+                    message_ai = await db.read_ai_message(1, dialog_id)
+                    if message_ai is False:
+                        outcome = 'error'
+                        return {'success': False, 'service_message': 500}
+                    outcome = 'answered'
+                    return {'success': True, 'service_message': message_ai.get("content")}
+                # воркер останавливается: ответ запишется в диалог, клиент повторит запрос к другому воркеру
+                if drain_expired():
+                    outcome = 'drained'
+                    return {'success': False, 'service_message': 503}
+                # ответа нет за AI_WAIT_TIMEOUT: сообщение остаётся в очереди, ответ появится в истории диалога
+                if time.monotonic() >= deadline:
+                    outcome = 'timeout'
+                    return {'success': False, 'service_message': 504}
+                await notifier.wait(waiter, wait_interval(deadline))
+        finally:
+            ai_wait_duration.labels('wait', outcome).observe(time.perf_counter() - started)
+    finally:
+        notifier.unsubscribe('answer', dialog_id, waiter)
+
+
+# отправка сообщения user -> AI с потоковым ответом (SSE)
+async def stream_message_ai_service(db: Repository, user_id: int, dialog_id: int, text_user: str) -> dict:
+    queue = notifier.subscribe_stream(dialog_id)
+    result = await accept_user_message_service(db, user_id, dialog_id, text_user)
+    if not result.get('success'):
+        notifier.unsubscribe_stream(dialog_id, queue)
+        return result
+    return {'success': True, 'service_message': stream_ai_answer(db, user_id, dialog_id, queue)}
+
+
+# события SSE: chunk — часть ответа, done — сохранённый ответ целиком
+async def stream_ai_answer(db: Repository, user_id: int, dialog_id: int, queue: asyncio.Queue):
+    started = time.perf_counter()
+    deadline = time.monotonic() + AI_WAIT_TIMEOUT
+    outcome = 'cancelled'
+    try:
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), wait_interval(deadline))
+            except asyncio.TimeoutError:
+                event, data = None, ''
+            if event == 'chunk':
+                yield format_sse('chunk', {'text': data})
+                continue
+            if event in ('pending', 'chunk_end'):
+                continue
+            # ответ записан, уведомление потерялось или истёк интервал — сверяемся с БД
+            result_answer = await db.get_ai_response_flag(user_id, dialog_id)
+            if result_answer is None:
+                outcome = 'error'
+                yield format_sse('error', {'status': 500})
+                return
+            if result_answer is False:
+                message_ai = await db.read_ai_message(1, dialog_id)
+                if message_ai is False:
+                    outcome = 'error'
+                    yield format_sse('error', {'status': 500})
+                    return
+                outcome = 'answered'
+                yield format_sse('done', {'content': message_ai.get('content')})
+                return
+            if drain_expired():
+                outcome = 'drained'
+                yield format_sse('error', {'status': 503})
+                return
+            if time.monotonic() >= deadline:
+                outcome = 'timeout'
+                yield format_sse('error', {'status': 504})
+                return
+            if event is None:
+                yield ': ping\n\n'
+    finally:
+        ai_wait_duration.labels('stream', outcome).observe(time.perf_counter() - started)
+        notifier.unsubscribe_stream(dialog_id, queue)
+
+
+# поиск по сообщениям пользователя: страница результатов и есть ли следующая (читается на строку больше)
+async def search_messages_service(db: Repository, user_id: int, query: str, dialog_id: int | None,
+                                  limit: int, offset: int) -> dict:
+    results = await db.search_messages(user_id, query, dialog_id, limit + 1, offset)
+    if results is False:
         return {'success': False, 'service_message': 500}
+    return {'success': True, 'service_message': {'results': results[:limit], 'has_more': len(results) > limit}}
+
+
+# выгрузка всех диалогов пользователя в NDJSON
+async def export_dialogs_service(db: Repository, user_id: int) -> dict:
+    return {'success': True, 'service_message': stream_dialogs_export(db, user_id)}
+
+
+# строки NDJSON: {"type": "dialog"} перед сообщениями диалога, {"type": "message"} на сообщение,
+# в конце {"type": "end"} с числом диалогов и сообщений или {"type": "error"} — выгрузка оборвалась;
+# пачка курсора сразу уходит клиенту одним куском
+async def stream_dialogs_export(db: Repository, user_id: int):
+    dialogs = messages = 0
+    current = None
+    async with aclosing(db.export_dialogs(user_id, EXPORT_CHUNK_SIZE)) as chunks:
+        async for chunk in chunks:
+            if chunk is False:
+                yield orjson.dumps({'type': 'error', 'status': 500}) + b'\n'
+                return
+            lines = []
+            for dialog_id, dialog_name, message_id, role, content in chunk:
+                if dialog_id != current:
+                    current = dialog_id
+                    dialogs += 1
+                    lines.append(orjson.dumps({'type': 'dialog', 'dialog_id': dialog_id, 'dialog_name': dialog_name}))
+                if message_id is not None:
+                    messages += 1
+                    lines.append(orjson.dumps({'type': 'message', 'dialog_id': dialog_id, 'message_id': message_id,
+                                               'role': role, 'content': content}))
+            yield b'\n'.join(lines) + b'\n'
+    yield orjson.dumps({'type': 'end', 'dialogs': dialogs, 'messages': messages}) + b'\n'
+
+
+# long-polling: повторять fetch, пока не появится работа, не пройдёт wait секунд или не начнётся остановка;
+# empty — результат без работы (для JSON из БД — '[]')
+async def wait_for_pending_work(fetch, wait: float, empty=lambda result: not result) -> dict:
+    deadline = asyncio.get_running_loop().time() + min(wait, AI_LONG_POLL_MAX)
+    waiter = notifier.subscribe('pending', None)
+    try:
+        while True:
+            waiter.clear()
+            result = await fetch()
+            if result is False:
+                return {'success': False, 'service_message': 500}
+            remaining = deadline - asyncio.get_running_loop().time()
+            if not empty(result) or remaining <= 0 or drain_deadline is not None:
+                return {'success': True, 'service_message': result}
+            await notifier.wait(waiter, min(remaining, AI_WAIT_INTERVAL))
+    finally:
+        notifier.unsubscribe('pending', None, waiter)
+
+
+# получения сообщения users (JSON-массив, собранный в БД)
+async def get_message_users_service(db: Repository, wait: float = 0) -> dict:
+    return await wait_for_pending_work(db.read_user_message_json, wait, lambda result: result == '[]')
+
+
+# контекст диалога для AI: из кеша, продлённый сообщениями новее последнего учтённого;
+# при промахе — последние AI_CONTEXT_MAX_MESSAGES сообщений одним запросом
+async def get_dialog_context(db: Repository, user_id: int, dialog_id: int) -> list | bool:
+    context = dialog_contexts.get(dialog_id)
+    if context is None:
+        context = DialogContext(AI_CONTEXT_MAX_MESSAGES, AI_CONTEXT_MAX_TOKENS)
+        raw = await db.get_dialog_json(user_id, dialog_id, limit=AI_CONTEXT_MAX_MESSAGES)
+    else:
+        raw = await db.get_dialog_json(user_id, dialog_id, since=context.last_message_id)
+    if raw is False:
+        return False
+    context.extend(orjson.loads(raw))
+    dialog_contexts[dialog_id] = context
+    return context.messages()
+
+
+# захват пачки ожидающих диалогов воркером AI; context — с готовым контекстом каждого диалога
+async def claim_messages_service(db: Repository, worker_id: str, limit: int, wait: float = 0,
+                                 context: bool = True) -> dict:
+    result = await wait_for_pending_work(
+        lambda: db.claim_dialogs(worker_id, min(limit, AI_CLAIM_MAX_BATCH), AI_CLAIM_LEASE), wait
+    )
+    if not result.get('success'):
+        return result
+    dialogs = result['service_message']
+    for dialog in dialogs:
+        ai_pickup_delay.observe(dialog.pop('pickup_delay'))
+    if context and dialogs:
+        contexts = await asyncio.gather(*(
+            get_dialog_context(db, dialog['user_id'], dialog['dialog_id']) for dialog in dialogs
+        ))
+        # захват не снимается: диалоги вернутся в очередь по истечении аренды
+        if False in contexts:
+            return {'success': False, 'service_message': 500}
+        for dialog, dialog_context in zip(dialogs, contexts):
+            dialog['context'] = dialog_context
+    return result
+
+
+# глубина очереди для /metrics
+async def refresh_queue_depth_service(db: Repository) -> None:
+    depth = await db.count_pending_dialogs()
+    if depth is not None:
+        ai_queue_depth.set(depth)
 
-    # цикл пока не появиться сообщение от Ai
+
+# снятие флагов, висящих дольше AI_FLAG_TIMEOUT (воркер AI не ответил, ожидание давно завершилось):
+# пачками по AI_REAPER_BATCH, пока есть что снимать; число снятых, False — ошибка БД
+async def reap_stale_flags_service(db: Repository) -> int | bool:
+    total = 0
     while True:
-        result_answer = await db.get_ai_response_flag(user_id, dialog_id)
-        if result_answer is None:
-            return {'success': False, 'service_message': 500}
-        if result_answer is False:
-            # читаем сообщение бд
-            message_ai = await db.read_ai_message(1, dialog_id)
-            if message_ai is False:
-                return {'success': False, 'service_message': 500}
-            return {'success': True, 'service_message': message_ai.get("content")}
-        await asyncio.sleep(1)
+        reaped = await db.reap_stale_flags(AI_FLAG_TIMEOUT, AI_REAPER_BATCH)
+        if reaped is False:
+            return False
+        if reaped:
+            ai_flags_reaped.inc(len(reaped))
+            # age None — флаг без времени постановки: ждал неизвестно сколько
+            ages = [stale['age'] for stale in reaped]
+            oldest = 'неизвестно' if None in ages else f"{max(ages):.0f} с"
+            logger.warning("Сняты зависшие флаги ожидания AI: %s, диалоги id: %s, самый старый — %s",
+                           len(reaped), [stale['dialog_id'] for stale in reaped], oldest)
+        total += len(reaped)
+        if len(reaped) < AI_REAPER_BATCH:
+            return total
+
+
+# фоновая задача воркера (lifespan приложения); в каждом воркере uvicorn своя, пачки не пересекаются
+async def run_flag_reaper(db: Repository) -> None:
+    while True:
+        await asyncio.sleep(AI_REAPER_INTERVAL)
+        await reap_stale_flags_service(db)
 
 
-# получения сообщения users
-async def get_message_users_service() -> dict:
-    result = await db.read_user_message()
+# запись ответа AI в бд и снятие флага одной транзакцией (флаг подтверждает сообщения диалога)
+async def send_message_user_service(db: Repository, user_id: int, dialog_id: int, content: str) -> dict:
+    result = await db.save_ai_replies([(user_id, dialog_id, content)])
     if result is False:
         return {'success': False, 'service_message': 500}
-    return {'success': True, 'service_message': result}
+    if not result[0]:
+        return {'success': False, 'service_message': 404}
+    # будим ожидающего в этом процессе, остальные воркеры получат NOTIFY
+    notifier.wake('answer', dialog_id)
+    return {'success': True, 'service_message': 'Сообщение записано'}
 
 
-# запись ответа AI в бд, установка флага
-async def send_message_user_service(user_id: int, dialog_id: int, content: str) -> dict:
-    # запись в бд сообщения AI
-    result = await db.insert_message(1, dialog_id, content)
+# запись пачки ответов AI одной транзакцией, статус по каждому ответу
+async def send_messages_user_batch_service(db: Repository, replies: list[tuple[int, int, str]]) -> dict:
+    result = await db.save_ai_replies(replies)
     if result is False:
         return {'success': False, 'service_message': 500}
-    # разблокировали флаг
-    result_flag = await db.set_ai_response_flag(user_id, dialog_id, False)
-    if result_flag is False:
+    statuses = []
+    for (user_id, dialog_id, _), saved in zip(replies, result):
+        if saved:
+            notifier.wake('answer', dialog_id)
+        statuses.append({'dialog_id': dialog_id, 'status': 'saved' if saved else 'not_found'})
+    return {'success': True, 'service_message': statuses}
+
+
+# событие диалога всем воркерам: через NOTIFY (дойдёт и до этого процесса), без канала — только себе
+async def publish_dialog_event(db: Repository, event: str, dialog_id: int, data: str) -> bool:
+    if NOTIFY_CHANNEL:
+        return await db.notify_dialog(event, dialog_id, data)
+    notifier.wake(event, dialog_id, data)
+    return True
+
+
+# часть ответа AI: раздаём подписчикам и буферам всех воркеров, на done — одна запись целого ответа
+async def send_message_chunk_service(db: Repository, user_id: int, dialog_id: int, content: str,
+                                     done: bool) -> dict:
+    if content and await publish_dialog_event(db, 'chunk', dialog_id, content) is False:
         return {'success': False, 'service_message': 500}
-    return {'success': True, 'service_message': 'Сообщение записано'}
-
-
-# вернуть весь контекст беседы user и AI
-async def get_context_dialog_service(user_id: int, dialog_id: int) -> dict:
-    result_ownership = await db.check_dialog_ownership(user_id, dialog_id)
+    if not done:
+        return {'success': True, 'service_message': 'Часть ответа принята'}
+    # метка конца возвращается после всех частей: буфер этого процесса к ней полон
+    token = uuid.uuid4().hex
+    end = reply_buffers.expect(token)
+    try:
+        if await publish_dialog_event(db, 'chunk_end', dialog_id, token) is False:
+            return {'success': False, 'service_message': 500}
+        full_content = await asyncio.wait_for(end, STREAM_END_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Метка конца ответа диалога id:%s не вернулась через LISTEN", dialog_id)
+        return {'success': False, 'service_message': 503}
+    finally:
+        reply_buffers.cancel(token)
+    if not full_content:
+        return {'success': False, 'service_message': 400}
+    return await send_message_user_service(db, user_id, dialog_id, full_content)
+
+
+# вернуть контекст беседы user и AI: целиком, страницу до before или новое после since
+async def get_context_dialog_service(db: Repository, user_id: int, dialog_id: int, before: int | None = None,
+                                     since: int | None = None, limit: int | None = None) -> dict:
+    if before is not None and since is not None:
+        return {'success': False, 'service_message': 400}
+    result_ownership = await cached(f"owner:{user_id}:{dialog_id}",
+                                    lambda: db.check_dialog_ownership(user_id, dialog_id))
     if result_ownership is False:
         return {'success': False, 'service_message': 500}
-    result = await db.get_dialog(user_id, dialog_id)
+    result = await db.get_dialog_json(user_id, dialog_id, before, since, limit)
     if result is False:
         return {'success': False, 'service_message': 500}
     return {'success': True, 'service_message': result}
 
 
 # вернуть имя и картинку пользователю
-async def get_context_user_service(user_id: int) -> dict:
-    result = await db.get_user(user_id)
+async def get_context_user_service(db: Repository, user_id: int) -> dict:
+    result = await cached(f"me:{user_id}", lambda: db.get_user(user_id))
     if result is False:
         return {'success': False, 'service_message': 500}
     return {'success': True, 'service_message': result}
 
 
 # изменение name диалога
-async def update_user_name_chat_service(user_id: int, dialog_id: int, dialog_name: str):
+async def update_user_name_chat_service(db: Repository, user_id: int, dialog_id: int, dialog_name: str):
     result = await db.update_name_chat(user_id, dialog_id, dialog_name)
     if result is False:
         return {'success': False, 'service_message': 500}
+    await invalidate(db, f"dialogs:{user_id}")
     return {'success': True, 'service_message': result}
 
 
 # получение флага
-async def get_ai_response_flag_service(user_id: int, dialog_id: int) -> dict:
+async def get_ai_response_flag_service(db: Repository, user_id: int, dialog_id: int) -> dict:
     result = await db.get_ai_response_flag(user_id, dialog_id)
     if result is None:
         return {'success': False, 'service_message': 500}
-    await asyncio.sleep(1)
     return {'success': True, 'service_message': result}
 
 
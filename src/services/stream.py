@@ -0,0 +1,39 @@
+import asyncio
+
+
+class ReplyBuffers:
+    """Части потокового ответа AI по dialog_id в процессе.
+
+    POST частей одного ответа попадают в разные воркеры uvicorn, поэтому буфер пополняется не из запроса,
+    а из событий 'chunk', которые каждый процесс получает через LISTEN/NOTIFY. Воркер, получивший done,
+    публикует метку 'chunk_end' и ждёт её через тот же канал: уведомления приходят в порядке фиксации,
+    так что к приходу метки все части ответа уже в его буфере. Метка очищает буфер во всех процессах.
+    """
+
+    def __init__(self):
+        self.buffers: dict[int, list[str]] = {}
+        self.ends: dict[str, asyncio.Future] = {}
+
+    # обработчик 'chunk'
+    def on_chunk(self, dialog_id: int, data: str) -> None:
+        self.buffers.setdefault(dialog_id, []).append(data)
+
+    # обработчик 'pending': новое сообщение пользователя, части прерванного ответа не нужны
+    def on_reset(self, dialog_id: int, _: str = '') -> None:
+        self.buffers.pop(dialog_id, None)
+
+    # обработчик 'chunk_end': буфер диалога отдаётся ожидающему метку token (если он в этом процессе)
+    def on_end(self, dialog_id: int, token: str) -> None:
+        content = ''.join(self.buffers.pop(dialog_id, []))
+        future = self.ends.pop(token, None)
+        if future is not None and not future.done():
+            future.set_result(content)
+
+    # ожидание метки: создаётся до её публикации, чтобы не пропустить
+    def expect(self, token: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.ends[token] = future
+        return future
+
+    def cancel(self, token: str) -> None:
+        self.ends.pop(token, None)
@@ -1,16 +1,142 @@
+import asyncio
+import atexit
+import json
 import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+from fastapi import Request, Response
+
+from src.core.config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_SAMPLE, LOG_QUEUE_SIZE
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(filename)s - %(message)s'
+
+listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, функция, сообщение.
+
+    Traceback уже в конце сообщения: его форматирует DeferredQueueHandler.prepare в потоке запроса.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'func': record.funcName,
+            'message': record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает 1 из N записей ниже WARNING для функций из LOG_SAMPLE ('get_ai_response_flag=100')."""
+
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self.counters: dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.funcName)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        count = self.counters.get(record.funcName, 0)
+        self.counters[record.funcName] = count + 1
+        return count % rate == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler, который не блокирует запрос: при переполненной очереди запись отбрасывается
+    и считается в dropped.
+
+    prepare остаётся стандартным: сообщение и traceback форматируются в вызывающем потоке, а args,
+    exc_info и exc_text очищаются — в поток QueueListener не уходят изменяемые аргументы и кадры стека.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# пары 'модуль=уровень' через запятую
+def parse_pairs(value: str) -> dict[str, str]:
+    pairs = {}
+    for item in value.split(','):
+        name, _, setting = item.strip().partition('=')
+        if name and setting:
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+# корневой обработчик: очередь + фоновый поток записи в stdout; уровни модулей из LOG_LEVELS
+def setup_logging() -> None:
+    global listener
+    if listener is not None:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter({name: int(rate) for name, rate in parse_pairs(LOG_SAMPLE).items()}))
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 
 def get_logger(name: str) -> logging.Logger:
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    setup_logging()
+    return logging.getLogger(name)
+
+
+# событие Server-Sent Events
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# JSON-ответ, в который готовое значение (массив, собранный в БД) вставляется как есть, без разбора
+def raw_json_response(fields: dict, key: str, raw: str) -> Response:
+    head = orjson.dumps(fields)[:-1]
+    return Response(content=head + b',' + orjson.dumps(key) + b':' + raw.encode() + b'}',
+                    media_type='application/json')
+
 
-    if not logger.hasHandlers():
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
+# ждать coroutine, пока клиент на связи: при отключении она отменяется, результат — None
+async def cancel_on_disconnect(request: Request, coroutine):
+    task = asyncio.ensure_future(coroutine)
+    disconnect = asyncio.ensure_future(wait_disconnect(request))
+    try:
+        await asyncio.wait((task, disconnect), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+    if task.done():
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return None
 
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(filename)s - %(message)s')
-        console_handler.setFormatter(formatter)
 
-        logger.addHandler(console_handler)
-    return logger
+# тело запроса уже прочитано: следующее сообщение ASGI — http.disconnect при обрыве соединения
+async def wait_disconnect(request: Request) -> None:
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
@@ -0,0 +1,16 @@
+import os
+
+# настройки из .env.example, которые config.py читает без значения по умолчанию; тесты работают без Postgres
+for name, value in {
+    'DATABASE_HOST': 'localhost',
+    'DATABASE_PORT': '5432',
+    'DATABASE_NAME': 'test',
+    'DATABASE_USER': 'test',
+    'DATABASE_PASSWORD': 'test',
+    'API_KEY_AI': 'test-ai-key',
+    'SECRET_KEY_JWT': 'test-secret',
+    'ALGORITHM': 'HS256',
+    'HEALTH_SECRET_KEY': 'test-health-key',
+    'DATABASE_BACKEND': 'memory',
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,49 @@
+from src.core.admission import AdmissionControl
+from src.core.security import create_access_token
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def user_scope(user_id: int) -> dict:
+    token = create_access_token({'sub': str(user_id)})
+    return {'type': 'http', 'path': '/dialogs', 'headers': [(b'cookie', f'access_token={token}'.encode())]}
+
+
+# пользователь шлёт 20 запросов/с при лимите 5/с и burst 20 дольше burst/rate: корзина не обновляется
+# вытеснением из кеша, допущено burst + rate * время
+def test_user_rate_holds_under_steady_overload():
+    clock = Clock()
+    admission = AdmissionControl(5, 20, 0, 0, max_waits=10, max_users=100, timer=clock)
+    scope = user_scope(7)
+    admitted = 0
+    for step in range(170):
+        clock.now = step * 0.05
+        admitted += admission.check(scope) is None
+    assert 20 + 5 * 8.45 - 1 <= admitted <= 20 + 5 * 8.45 + 1
+
+
+def test_global_rejection_does_not_charge_user_bucket():
+    clock = Clock()
+    admission = AdmissionControl(5, 2, 1, 1, max_waits=10, max_users=100, timer=clock)
+    first, second = user_scope(1), user_scope(2)
+    assert admission.check(first) is None
+    reason, retry_after = admission.check(first)
+    assert reason == 'global_rate' and retry_after > 0
+    clock.now = 1
+    # отклонённый общим лимитом запрос не потратил токен пользователя
+    assert admission.check(first) is None
+    assert admission.check(second)[0] == 'global_rate'
+
+
+def test_wait_paths_limited_by_max_waits():
+    admission = AdmissionControl(0, 0, 0, 0, max_waits=1, max_users=100)
+    scope = {'type': 'http', 'path': '/send/message/ai', 'headers': []}
+    assert admission.check(scope) is None
+    admission.waits = 1
+    assert admission.check(scope) == ('max_waits', 1)
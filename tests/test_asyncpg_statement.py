@@ -0,0 +1,16 @@
+from src.repository.asyncpg_repository import DIALOG_JSON, SEARCH_MESSAGES, SAVE_AI_REPLIES, Statement
+
+
+def test_names_numbered_in_order_and_reused():
+    statement = Statement("SELECT :b, :a::text, CAST(:b AS BIGINT), 'x:y' FROM t WHERE c = :a")
+    assert statement.sql == "SELECT $1, $2::text, CAST($1 AS BIGINT), 'x:y' FROM t WHERE c = $2"
+    assert statement.bind(a=1, b=2, unused=3) == (statement.sql, 2, 1)
+
+
+def test_repository_queries_keep_casts_and_pick_variant_parameters():
+    assert '::text' in DIALOG_JSON[(False, False, False)].sql
+    assert DIALOG_JSON[(False, False, False)].names == ('dialog_id',)
+    assert DIALOG_JSON[(True, False, True)].names == ('dialog_id', 'before', 'limit')
+    assert SEARCH_MESSAGES[True].names == ('query', 'user_id', 'dialog_id', 'limit', 'offset', 'options')
+    assert SAVE_AI_REPLIES[True].names == ('user_ids', 'dialog_ids', 'contents', 'channel')
+    assert ':' not in SAVE_AI_REPLIES[False].sql.replace('::', '')
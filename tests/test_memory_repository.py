@@ -0,0 +1,183 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src.repository.memory_repository import BOT_USER_ID, MemoryDatabase
+
+
+@pytest.fixture
+def db() -> MemoryDatabase:
+    return MemoryDatabase()
+
+
+# пользователь с диалогом: (user_id, dialog_id)
+def user_with_dialog(db: MemoryDatabase, google_id: str = 'g-1') -> tuple[int, int]:
+    async def create():
+        user_id = await db.create_user(f'{google_id}@x', google_id, 'Имя', 'Фамилия', '')
+        return user_id, await db.create_dialog(user_id, 'диалог')
+
+    return asyncio.run(create())
+
+
+def test_submit_forbidden_pending_accepted(db):
+    owner, dialog_id = user_with_dialog(db)
+    stranger, _ = user_with_dialog(db, 'g-2')
+
+    async def run():
+        assert await db.submit_user_message(stranger, dialog_id, 'чужой') == 'forbidden'
+        assert await db.submit_user_message(owner, dialog_id, 'вопрос') == 'accepted'
+        # флаг уже стоит: второе сообщение не пишется
+        assert await db.submit_user_message(owner, dialog_id, 'ещё') == 'pending'
+        assert await db.save_ai_replies([(owner, dialog_id, 'ответ')]) == [True]
+        assert await db.submit_user_message(owner, dialog_id, 'снова') == 'accepted'
+        contents = [message['content'] for message in json.loads(await db.get_dialog_json(owner, dialog_id))]
+        assert contents == ['вопрос', 'ответ', 'снова']
+
+    asyncio.run(run())
+
+
+def test_claim_lease_and_acked_message_id(db):
+    owner, dialog_id = user_with_dialog(db)
+
+    async def run():
+        assert await db.claim_dialogs('w1', 10, 60) == []
+        await db.submit_user_message(owner, dialog_id, 'первый')
+        claimed = await db.claim_dialogs('w1', 10, 60)
+        assert [(dialog['dialog_id'], dialog['user_id']) for dialog in claimed] == [(dialog_id, owner)]
+        assert [message['content'] for message in claimed[0]['messages']] == ['первый']
+        # аренда действует: другой воркер диалог не получает
+        assert await db.claim_dialogs('w2', 10, 60) == []
+        # аренда истекла: диалог возвращается в очередь
+        db.dialogs[dialog_id]['claim_expires_at'] = time.time() - 1
+        assert [dialog['dialog_id'] for dialog in await db.claim_dialogs('w2', 10, 60)] == [dialog_id]
+        await db.save_ai_replies([(owner, dialog_id, 'ответ')])
+        bot_message_id = db.messages[dialog_id][-1][0]
+        assert db.dialogs[dialog_id]['acked_message_id'] == bot_message_id
+        # после ответа воркер получает только новые сообщения пользователя
+        await db.submit_user_message(owner, dialog_id, 'второй')
+        claimed = await db.claim_dialogs('w1', 10, 60)
+        assert [message['content'] for message in claimed[0]['messages']] == ['второй']
+        assert claimed[0]['messages'][0]['message_id'] > bot_message_id
+
+    asyncio.run(run())
+
+
+def test_claim_respects_limit_in_flag_order(db):
+    dialogs = [user_with_dialog(db, f'g-{i}') for i in range(3)]
+
+    async def run():
+        for user_id, dialog_id in dialogs:
+            await db.submit_user_message(user_id, dialog_id, 'вопрос')
+        first = await db.claim_dialogs('w1', 2, 60)
+        assert [dialog['dialog_id'] for dialog in first] == [dialogs[0][1], dialogs[1][1]]
+        assert [dialog['dialog_id'] for dialog in await db.claim_dialogs('w2', 2, 60)] == [dialogs[2][1]]
+
+    asyncio.run(run())
+
+
+def test_save_ai_replies_validates_each_reply(db):
+    owner, dialog_id = user_with_dialog(db)
+    other, other_dialog = user_with_dialog(db, 'g-2')
+
+    async def run():
+        await db.submit_user_message(owner, dialog_id, 'вопрос')
+        await db.submit_user_message(other, other_dialog, 'вопрос')
+        saved = await db.save_ai_replies([
+            (owner, dialog_id, 'ответ'),
+            (owner, other_dialog, 'в чужой диалог'),
+            (owner, 10_000, 'в несуществующий'),
+        ])
+        assert saved == [True, False, False]
+        assert await db.get_ai_response_flag(owner, dialog_id) is False
+        # ответ с чужим user_id не снял флаг и не записан
+        assert await db.get_ai_response_flag(other, other_dialog) is True
+        assert [author for _, author, _ in db.messages[other_dialog]] == [other]
+        assert db.messages[dialog_id][-1][1] == BOT_USER_ID
+
+    asyncio.run(run())
+
+
+def test_reap_stale_flags(db):
+    dialogs = [user_with_dialog(db, f'g-{i}') for i in range(4)]
+
+    async def run():
+        for user_id, dialog_id in dialogs:
+            await db.submit_user_message(user_id, dialog_id, 'вопрос')
+        now = time.time()
+        # три флага старше таймаута, у второго действующая аренда; четвёртый свежий
+        for _, dialog_id in dialogs[:3]:
+            db.pending[dialog_id] = now - 1000
+        db.dialogs[dialogs[1][1]]['claim_expires_at'] = now + 60
+        reaped = await db.reap_stale_flags(600, 1)
+        assert [stale['dialog_id'] for stale in reaped] == [dialogs[0][1]]
+        assert reaped[0]['age'] >= 1000
+        reaped = await db.reap_stale_flags(600, 10)
+        assert [stale['dialog_id'] for stale in reaped] == [dialogs[2][1]]
+        assert await db.count_pending_dialogs() == 2
+        assert await db.get_ai_response_flag(*dialogs[0]) is False
+
+    asyncio.run(run())
+
+
+def test_dialog_json_pagination(db):
+    owner, dialog_id = user_with_dialog(db)
+
+    async def run():
+        ids = [await db.insert_message(owner, dialog_id, f'сообщение {i}') for i in range(6)]
+
+        async def page(**params) -> list[int]:
+            return [message['message_id'] for message in json.loads(await db.get_dialog_json(owner, dialog_id,
+                                                                                             **params))]
+
+        assert await page() == ids
+        # последние limit, по возрастанию
+        assert await page(limit=2) == ids[-2:]
+        assert await page(before=ids[4], limit=2) == ids[2:4]
+        assert await page(before=ids[2]) == ids[:2]
+        assert await page(since=ids[3]) == ids[4:]
+        assert await page(since=ids[1], limit=2) == ids[2:4]
+        assert await page(since=ids[-1]) == []
+
+    asyncio.run(run())
+
+
+def test_search_messages(db):
+    owner, dialog_id = user_with_dialog(db)
+    _, second_dialog = owner, asyncio.run(db.create_dialog(owner, 'второй'))
+    stranger, stranger_dialog = user_with_dialog(db, 'g-2')
+
+    async def run():
+        await db.insert_message(owner, dialog_id, 'Кошка ловит мышь')
+        await db.insert_message(owner, dialog_id, 'кошка спит, кошка ест')
+        await db.insert_message(owner, second_dialog, 'собака и кошка')
+        await db.insert_message(stranger, stranger_dialog, 'чужая кошка')
+        results = await db.search_messages(owner, 'кошка', None, 10, 0)
+        # чужие диалоги не ищутся; больше вхождений — выше
+        assert len(results) == 3
+        assert results[0]['snippet'] == '**кошка** спит, **кошка** ест'
+        assert {result['dialog_id'] for result in results} == {dialog_id, second_dialog}
+        assert [result['dialog_id'] for result in await db.search_messages(owner, 'кошка', second_dialog, 10, 0)] \
+            == [second_dialog]
+        # все слова запроса
+        both = await db.search_messages(owner, 'кошка мышь', None, 10, 0)
+        assert [result['snippet'] for result in both] == ['**Кошка** ловит **мышь**']
+        page = await db.search_messages(owner, 'кошка', None, 2, 2)
+        assert [result['message_id'] for result in page] == [results[2]['message_id']]
+        assert await db.search_messages(owner, 'кошка', stranger_dialog, 10, 0) == []
+
+    asyncio.run(run())
+
+
+def test_delete_dialog_removes_messages_from_search_and_queue(db):
+    owner, dialog_id = user_with_dialog(db)
+
+    async def run():
+        await db.submit_user_message(owner, dialog_id, 'кошка')
+        assert await db.delete_dialog(owner, dialog_id) is True
+        assert await db.search_messages(owner, 'кошка', None, 10, 0) == []
+        assert await db.count_pending_dialogs() == 0
+        assert await db.delete_dialog(owner, dialog_id) is False
+
+    asyncio.run(run())
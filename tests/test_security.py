@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from src.core import security
+from src.core.security import TokenCache, create_access_token, decode_token, revoke_token
+
+
+@pytest.fixture
+def token_cache(monkeypatch) -> TokenCache:
+    cache = TokenCache(100, 2)
+    monkeypatch.setattr(security, 'token_cache', cache)
+    return cache
+
+
+def assert_rejected(token: str) -> None:
+    with pytest.raises(HTTPException) as error:
+        decode_token(token, log_errors=False)
+    assert error.value.status_code == 401
+
+
+def test_revoked_token_rejected_even_if_cached(token_cache):
+    token = create_access_token({'sub': '5'})
+    assert decode_token(token) == 5
+    assert revoke_token(token) is not None
+    assert_rejected(token)
+
+
+# переполненный denylist не возвращает вытесненный отзыв: отклоняются все токены, истекающие не позже
+def test_denylist_overflow_fails_closed(token_cache):
+    tokens = [create_access_token({'sub': str(user_id)}, timedelta(hours=user_id)) for user_id in (1, 2, 3)]
+    later = create_access_token({'sub': '4'}, timedelta(hours=4))
+    for token in tokens:
+        revoke_token(token)
+    assert len(token_cache.denylist) == 2
+    for token in tokens:
+        assert_rejected(token)
+    assert decode_token(later) == 4
+
+
+def test_token_without_exp_rejected(token_cache):
+    token = jwt.encode({'sub': '5'}, security.SECRET_KEY_JWT, algorithm=security.ALGORITHM)
+    assert_rejected(token)
+    assert revoke_token(token) is None
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src.repository.memory_repository import MemoryDatabase
+from src.services import service
+
+
+@pytest.fixture
+def db() -> MemoryDatabase:
+    # кеш модульный: ключи dialogs:{user_id} одинаковы у разных MemoryDatabase
+    service.cache.data.clear()
+    return MemoryDatabase()
+
+
+def create_user(db: MemoryDatabase, google_id: str = 'g-1') -> int:
+    return asyncio.run(db.create_user(f'{google_id}@x', google_id, 'Имя', 'Фамилия', ''))
+
+
+def test_dialog_list_cache_is_invalidated_by_writes(db):
+    user_id = create_user(db)
+
+    async def run():
+        async def names() -> list[str]:
+            result = await service.get_user_dialogs_service(db, user_id)
+            return [dialog['dialog_name'] for dialog in result['service_message']]
+
+        assert await names() == []
+        created = await service.init_user_dialog_service(db, user_id, 'первый')
+        dialog_id = created['service_message']
+        assert await names() == ['первый']
+        # запись мимо сервиса кеш не сбрасывает: список читается из кеша
+        await db.create_dialog(user_id, 'мимо кеша')
+        assert await names() == ['первый']
+        await service.update_user_name_chat_service(db, user_id, dialog_id, 'новое имя')
+        assert await names() == ['новое имя', 'мимо кеша']
+        await service.delete_user_dialog_service(db, user_id, dialog_id)
+        assert await names() == ['мимо кеша']
+
+    asyncio.run(run())
+
+
+def test_cached_skips_value_read_during_invalidation(db):
+    async def run():
+        async def load():
+            # запись и сброс кеша, пока чтение ещё идёт
+            await service.invalidate(db, 'key')
+            return 'устаревшее'
+
+        assert await service.cached('key', load) == 'устаревшее'
+        assert await service.cache.get('key') is None
+
+        async def fail():
+            return False
+
+        assert await service.cached('key', fail) is False
+        assert await service.cache.get('key') is None
+
+    asyncio.run(run())
+
+
+def test_accept_user_message_statuses(db):
+    owner, stranger = create_user(db), create_user(db, 'g-2')
+
+    async def run():
+        dialog_id = await db.create_dialog(owner, 'диалог')
+        assert (await service.accept_user_message_service(db, stranger, dialog_id, 'чужой'))['service_message'] == 403
+        assert (await service.accept_user_message_service(db, owner, dialog_id, 'вопрос'))['success'] is True
+        assert (await service.accept_user_message_service(db, owner, dialog_id, 'ещё'))['service_message'] == 409
+
+    asyncio.run(run())
+
+
+def test_batch_replies_report_status_per_dialog(db):
+    owner, stranger = create_user(db), create_user(db, 'g-2')
+
+    async def run():
+        dialog_id = await db.create_dialog(owner, 'диалог')
+        await db.submit_user_message(owner, dialog_id, 'вопрос')
+        result = await service.send_messages_user_batch_service(db, [
+            (owner, dialog_id, 'ответ'),
+            (stranger, dialog_id, 'не тот пользователь'),
+            (owner, 10_000, 'нет диалога'),
+        ])
+        assert result['service_message'] == [
+            {'dialog_id': dialog_id, 'status': 'saved'},
+            {'dialog_id': dialog_id, 'status': 'not_found'},
+            {'dialog_id': 10_000, 'status': 'not_found'},
+        ]
+        assert (await service.send_message_user_service(db, owner, 10_000, 'нет'))['service_message'] == 404
+
+    asyncio.run(run())
+
+
+def test_reaper_service_drains_in_batches(db, monkeypatch):
+    monkeypatch.setattr(service, 'AI_REAPER_BATCH', 2)
+    user_id = create_user(db)
+
+    async def run():
+        for i in range(5):
+            dialog_id = await db.create_dialog(user_id, f'диалог {i}')
+            await db.submit_user_message(user_id, dialog_id, 'вопрос')
+            if i < 4:
+                db.pending[dialog_id] = time.time() - service.AI_FLAG_TIMEOUT - 1
+        assert await service.reap_stale_flags_service(db) == 4
+        assert await db.count_pending_dialogs() == 1
+
+    asyncio.run(run())
+
+
+def test_dialog_context_pagination(db):
+    user_id = create_user(db)
+
+    async def run():
+        dialog_id = await db.create_dialog(user_id, 'диалог')
+        ids = [await db.insert_message(user_id, dialog_id, str(i)) for i in range(4)]
+        assert (await service.get_context_dialog_service(db, user_id, dialog_id, before=ids[2],
+                                                         since=ids[0]))['service_message'] == 400
+        result = await service.get_context_dialog_service(db, user_id, dialog_id, before=ids[3], limit=2)
+        assert [message['message_id'] for message in json.loads(result['service_message'])] == ids[1:3]
+
+    asyncio.run(run())
+
+
+def test_search_pages_report_has_more(db):
+    user_id = create_user(db)
+
+    async def run():
+        dialog_id = await db.create_dialog(user_id, 'диалог')
+        for i in range(3):
+            await db.insert_message(user_id, dialog_id, f'кошка {i}')
+        first = (await service.search_messages_service(db, user_id, 'кошка', None, 2, 0))['service_message']
+        assert len(first['results']) == 2 and first['has_more'] is True
+        last = (await service.search_messages_service(db, user_id, 'кошка', None, 2, 2))['service_message']
+        assert len(last['results']) == 1 and last['has_more'] is False
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import asyncio
+
+from src.services.stream import ReplyBuffers
+
+
+# два воркера uvicorn: у каждого свой буфер, события доходят до обоих (как LISTEN/NOTIFY)
+def fan_out(workers: list[ReplyBuffers], event: str, dialog_id: int, data: str) -> None:
+    for buffers in workers:
+        {'chunk': buffers.on_chunk, 'chunk_end': buffers.on_end, 'pending': buffers.on_reset}[event](dialog_id, data)
+
+
+def test_chunks_posted_to_different_workers_are_saved_whole():
+    async def run():
+        first, second = ReplyBuffers(), ReplyBuffers()
+        workers = [first, second]
+        # POST частей попадают в разные воркеры, done — во второй
+        for text in ('При', 'вет', ', ', 'мир'):
+            fan_out(workers, 'chunk', 7, text)
+        end = second.expect('token')
+        fan_out(workers, 'chunk_end', 7, 'token')
+        assert await asyncio.wait_for(end, 1) == 'Привет, мир'
+        # метка очищает буферы во всех процессах
+        assert first.buffers == {} and second.buffers == {} and second.ends == {}
+
+    asyncio.run(run())
+
+
+def test_new_user_message_drops_interrupted_reply():
+    async def run():
+        first, second = ReplyBuffers(), ReplyBuffers()
+        workers = [first, second]
+        fan_out(workers, 'chunk', 7, 'обрыв')
+        fan_out(workers, 'pending', 7, '')
+        fan_out(workers, 'chunk', 7, 'ответ')
+        end = first.expect('token')
+        fan_out(workers, 'chunk_end', 7, 'token')
+        assert await asyncio.wait_for(end, 1) == 'ответ'
+
+    asyncio.run(run())